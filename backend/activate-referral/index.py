@@ -6,12 +6,12 @@ Returns: Success status with bonus days added
 
 import json
 import os
-import psycopg2
 from typing import Dict, Any
 
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+import remnawave_client
+from db import get_connection
+from remnawave_client import RemnawaveError
+from remnawave_mirror import LookupUnavailable, find_user, squad_uuids
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'POST')
@@ -46,78 +46,76 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Username required'})
             }
         
-        conn = get_db_connection()
-        cur = conn.cursor()
+        with get_connection() as conn:
+            cur = conn.cursor()
         
-        # If referral code provided, register the referral
-        if referral_code:
-            print(f'🎁 Processing referral: {username} with code {referral_code}')
+            # If referral code provided, register the referral
+            if referral_code:
+                print(f'🎁 Processing referral: {username} with code {referral_code}')
             
-            # Find referrer by code
-            safe_code = referral_code.replace("'", "''")
-            cur.execute(
-                f"SELECT referrer_username FROM referrals WHERE referral_code = '{safe_code}' LIMIT 1"
-            )
-            result = cur.fetchone()
-            
-            if result:
-                referrer = result[0]
-                
-                # Check if already referred
-                safe_username = username.replace("'", "''")
+                # Find referrer by code
+                safe_code = referral_code.replace("'", "''")
                 cur.execute(
-                    f"SELECT id FROM referrals WHERE referred_username = '{safe_username}'"
+                    f"SELECT referrer_username FROM referrals WHERE referral_code = '{safe_code}' LIMIT 1"
                 )
-                if not cur.fetchone():
-                    # Try to update existing referral record (where referred_username is NULL)
-                    safe_referrer = referrer.replace("'", "''")
+                result = cur.fetchone()
+            
+                if result:
+                    referrer = result[0]
+                
+                    # Check if already referred
+                    safe_username = username.replace("'", "''")
                     cur.execute(
-                        f"""
-                        UPDATE referrals 
-                        SET referred_username = '{safe_username}', 
-                            bonus_days = 7, 
-                            status = 'activated', 
-                            activated_at = NOW()
-                        WHERE referrer_username = '{safe_referrer}' 
-                          AND referral_code = '{safe_code}' 
-                          AND referred_username IS NULL
-                        """
+                        f"SELECT id FROM referrals WHERE referred_username = '{safe_username}'"
                     )
-                    
-                    # If no rows updated, insert new record
-                    if cur.rowcount == 0:
+                    if not cur.fetchone():
+                        # Try to update existing referral record (where referred_username is NULL)
+                        safe_referrer = referrer.replace("'", "''")
                         cur.execute(
                             f"""
-                            INSERT INTO referrals (referrer_username, referral_code, referred_username, bonus_days, status, activated_at)
-                            VALUES ('{safe_referrer}', '{safe_code}', '{safe_username}', 7, 'activated', NOW())
+                            UPDATE referrals 
+                            SET referred_username = '{safe_username}', 
+                                bonus_days = 7, 
+                                status = 'activated', 
+                                activated_at = NOW()
+                            WHERE referrer_username = '{safe_referrer}' 
+                              AND referral_code = '{safe_code}' 
+                              AND referred_username IS NULL
                             """
                         )
                     
-                    # Get UUIDs from DB for both users
-                    safe_ref = referrer.replace("'", "''")
-                    cur.execute(f"SELECT remnawave_uuid FROM user_uuids WHERE username = '{safe_ref}' ORDER BY created_at DESC LIMIT 1")
-                    referrer_uuid_row = cur.fetchone()
-                    referrer_uuid = referrer_uuid_row[0] if referrer_uuid_row else None
+                        # If no rows updated, insert new record
+                        if cur.rowcount == 0:
+                            cur.execute(
+                                f"""
+                                INSERT INTO referrals (referrer_username, referral_code, referred_username, bonus_days, status, activated_at)
+                                VALUES ('{safe_referrer}', '{safe_code}', '{safe_username}', 7, 'activated', NOW())
+                                """
+                            )
                     
-                    cur.execute(f"SELECT remnawave_uuid FROM user_uuids WHERE username = '{safe_username}' ORDER BY created_at DESC LIMIT 1")
-                    referred_uuid_row = cur.fetchone()
-                    referred_uuid = referred_uuid_row[0] if referred_uuid_row else None
+                        # Get UUIDs from DB for both users
+                        safe_ref = referrer.replace("'", "''")
+                        cur.execute(f"SELECT remnawave_uuid FROM user_uuids WHERE username = '{safe_ref}' ORDER BY created_at DESC LIMIT 1")
+                        referrer_uuid_row = cur.fetchone()
+                        referrer_uuid = referrer_uuid_row[0] if referrer_uuid_row else None
                     
-                    print(f'🔑 Referrer UUID: {referrer_uuid}, Referred UUID: {referred_uuid}')
+                        cur.execute(f"SELECT remnawave_uuid FROM user_uuids WHERE username = '{safe_username}' ORDER BY created_at DESC LIMIT 1")
+                        referred_uuid_row = cur.fetchone()
+                        referred_uuid = referred_uuid_row[0] if referred_uuid_row else None
                     
-                    # Extend referrer subscription by 7 days via Remnawave
-                    extend_subscription(referrer, 7, referrer_uuid)
+                        print(f'🔑 Referrer UUID: {referrer_uuid}, Referred UUID: {referred_uuid}')
                     
-                    # Also give 7 days to the referred user (new user bonus)
-                    extend_subscription(username, 7, referred_uuid)
+                        # Extend referrer subscription by 7 days via Remnawave
+                        extend_subscription(referrer, 7, referrer_uuid)
                     
-                    conn.commit()
-                    print(f'✅ Referral activated: {referrer} gets +7 days for referring {username}, {username} gets +7 days as referral bonus')
-                else:
-                    print(f'⚠️ User {username} already has a referral')
+                        # Also give 7 days to the referred user (new user bonus)
+                        extend_subscription(username, 7, referred_uuid)
+                    
+                        print(f'✅ Referral activated: {referrer} gets +7 days for referring {username}, {username} gets +7 days as referral bonus')
+                    else:
+                        print(f'⚠️ User {username} already has a referral')
         
-        cur.close()
-        conn.close()
+            cur.close()
         
         return {
             'statusCode': 200,
@@ -136,29 +134,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 def extend_subscription(username: str, days: int, user_uuid: str = None):
     '''Extend user subscription using UUID from DB (more reliable than API search)'''
     try:
-        import requests
-        import os
-        import psycopg2
         from datetime import datetime
         
         remnawave_api_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
         remnawave_token = os.environ.get('REMNAWAVE_API_TOKEN', '')
-        remnawave_function_url = 'https://functions.poehali.dev/4e61ec57-0f83-4c68-83fb-8b3049f711ab'
         
         # Если UUID не передан - ищем в БД
         if not user_uuid:
             db_url = os.environ.get('DATABASE_URL', '')
             if db_url:
-                conn = psycopg2.connect(db_url)
-                cur = conn.cursor()
                 safe_username = username.replace("'", "''")
-                cur.execute(f"SELECT remnawave_uuid FROM user_uuids WHERE username = '{safe_username}' ORDER BY created_at DESC LIMIT 1")
-                result = cur.fetchone()
+                with get_connection() as conn:
+                    cur = conn.cursor()
+                    cur.execute(f"SELECT remnawave_uuid FROM user_uuids WHERE username = '{safe_username}' ORDER BY created_at DESC LIMIT 1")
+                    result = cur.fetchone()
+                    cur.close()
                 if result:
                     user_uuid = result[0]
                     print(f'🔑 Found UUID in DB: {user_uuid}')
-                cur.close()
-                conn.close()
         
         if not user_uuid:
             print(f'⚠️ No UUID found for {username}, cannot extend')
@@ -166,20 +159,8 @@ def extend_subscription(username: str, days: int, user_uuid: str = None):
         
         print(f'📅 Extending {username} (UUID: {user_uuid}) by {days} days')
         
-        # Получаем текущую дату истечения
-        get_response = requests.get(
-            f'{remnawave_api_url}/api/users',
-            headers={'Authorization': f'Bearer {remnawave_token}'},
-            timeout=10
-        )
-        
-        if get_response.status_code != 200:
-            print(f'⚠️ Failed to get users list: {get_response.status_code}')
-            return
-        
-        users_data = get_response.json()
-        users_list = users_data.get('response', {}).get('users', [])
-        user_data = next((u for u in users_list if u.get('uuid') == user_uuid), None)
+        # Текущая дата истечения: свежая запись зеркала или живой ответ Remnawave, не устаревшая
+        user_data = find_user(user_uuid=user_uuid, api_url=remnawave_api_url, token=remnawave_token, strict=True)
         
         if not user_data:
             print(f'⚠️ User {username} not found by UUID {user_uuid}')
@@ -203,36 +184,16 @@ def extend_subscription(username: str, days: int, user_uuid: str = None):
         print(f'📅 Current: {current_expire_ts}, New: {new_expire_ts} (+{days} days)')
         
         # Получаем список squad UUIDs (строки, не объекты)
-        active_squads = user_data.get('activeInternalSquads', [])
-        squad_uuids = []
-        
-        # Если это список объектов - извлекаем uuid
-        if active_squads and isinstance(active_squads[0], dict):
-            squad_uuids = [squad.get('uuid') for squad in active_squads if squad.get('uuid')]
-        # Если это уже список строк - используем как есть
-        elif active_squads and isinstance(active_squads[0], str):
-            squad_uuids = active_squads
-        
-        print(f'🎯 Squad UUIDs for extend: {squad_uuids}')
-        
-        # Используем extend_subscription action с UUID
-        response = requests.post(
-            remnawave_function_url,
-            headers={'Content-Type': 'application/json'},
-            json={
-                'action': 'extend_subscription',
-                'username': username,
-                'uuid': user_uuid,
-                'expire': new_expire_ts,
-                'internalSquads': squad_uuids
-            },
-            timeout=30
-        )
+        user_squads = squad_uuids(user_data)
+        print(f'🎯 Squad UUIDs for extend: {user_squads}')
         
-        if response.status_code == 200:
-            print(f'✅ Extended {username} subscription by {days} days')
-        else:
-            print(f'⚠️ Failed to extend {username}: {response.status_code} - {response.text}')
-            
+        # Продлеваем по UUID напрямую через клиент Remnawave
+        remnawave_client.extend_subscription(username, user_uuid, new_expire_ts, user_squads)
+        print(f'✅ Extended {username} subscription by {days} days')
+        
+    except LookupUnavailable as e:
+        print(f'⚠️ Not extending {username}: {str(e)}')
+    except RemnawaveError as e:
+        print(f'⚠️ Failed to extend {username}: {e.status_code} - {e.details}')
     except Exception as e:
         print(f'❌ Error extending subscription: {str(e)}')
\ No newline at end of file
@@ -1,11 +1,12 @@
 import json
 import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import bcrypt
 import secrets
 from typing import Dict, Any
 
+from db import get_connection
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Admin authentication - login and session validation
@@ -34,9 +35,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'DATABASE_URL not configured'})
         }
     
-    conn = psycopg2.connect(database_url)
-    
-    try:
+    with get_connection() as conn:
         if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action', 'login')
@@ -105,6 +104,3 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': 'Method not allowed'})
         }
-    
-    finally:
-        conn.close()
\ No newline at end of file
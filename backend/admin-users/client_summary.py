@@ -0,0 +1,65 @@
+'''
+Business: Сводка по клиентам (client_summary) для админки вместо GROUP BY по всей таблице payments
+Args: cursor открытой транзакции, usernames изменённых платежей
+Returns: refresh_clients() - пересчёт строк затронутых клиентов, rebuild() - полная пересборка
+'''
+
+from typing import Any, Iterable
+
+# Пересчёт только по платежам переданных клиентов (индекс по username); клиент без платежей удаляется.
+# Advisory-lock по клиенту: параллельная транзакция дождётся коммита и пересчитает уже с ним.
+# Параметр %(summary_usernames)s - чтобы SQL можно было дописать к другому запросу с именованными параметрами.
+REFRESH_SQL = """
+    SELECT pg_advisory_xact_lock(hashtext('client_summary:' || u))
+    FROM unnest(%(summary_usernames)s::text[]) AS u;
+    WITH agg AS (
+        SELECT username,
+               (ARRAY_AGG(email ORDER BY created_at DESC, id DESC))[1] AS email,
+               MAX(created_at) AS last_payment,
+               COALESCE(SUM(amount) FILTER (WHERE status = 'succeeded'), 0) AS total_paid,
+               COUNT(*) FILTER (WHERE status = 'succeeded') AS payment_count
+        FROM payments
+        WHERE username = ANY(%(summary_usernames)s)
+        GROUP BY username
+    ), removed AS (
+        DELETE FROM client_summary
+        WHERE username = ANY(%(summary_usernames)s)
+          AND username NOT IN (SELECT username FROM agg)
+    )
+    INSERT INTO client_summary (username, email, last_payment, total_paid, payment_count, updated_at)
+    SELECT username, email, last_payment, total_paid, payment_count, NOW() FROM agg
+    ON CONFLICT (username) DO UPDATE
+    SET email = EXCLUDED.email,
+        last_payment = EXCLUDED.last_payment,
+        total_paid = EXCLUDED.total_paid,
+        payment_count = EXCLUDED.payment_count,
+        updated_at = NOW()
+"""
+
+REBUILD_SQL = """
+    LOCK TABLE client_summary IN EXCLUSIVE MODE;
+    DELETE FROM client_summary;
+    INSERT INTO client_summary (username, email, last_payment, total_paid, payment_count, updated_at)
+    SELECT username,
+           (ARRAY_AGG(email ORDER BY created_at DESC, id DESC))[1],
+           MAX(created_at),
+           COALESCE(SUM(amount) FILTER (WHERE status = 'succeeded'), 0),
+           COUNT(*) FILTER (WHERE status = 'succeeded'),
+           NOW()
+    FROM payments
+    GROUP BY username;
+"""
+
+
+def refresh_clients(cursor: Any, usernames: Iterable[str]):
+    '''Вызывается в транзакции, которая вставила, удалила или сменила статус платежей этих клиентов'''
+    names = sorted({u for u in usernames if u})
+    if names:
+        cursor.execute(REFRESH_SQL, {'summary_usernames': names})
+
+
+def rebuild(cursor: Any) -> int:
+    '''Полная пересборка из payments (после ручных правок таблицы или пропущенных обновлений)'''
+    cursor.execute(REBUILD_SQL)
+    cursor.execute("SELECT COUNT(*) FROM client_summary")
+    return cursor.fetchone()[0]
@@ -7,10 +7,17 @@ Returns: HTTP response dict with user list, deletion results, or errors
 
 import json
 import os
-import psycopg2
-import requests
+import http_client
 from typing import Dict, Any, List
 
+import client_summary
+from db import get_connection
+from pagination import InvalidCursor, decode_cursor, keyset_page, page_limit
+from remnawave_mirror import find_user, mark_deleted
+
+USERS_PAGE_SIZE = int(os.environ.get('ADMIN_USERS_PAGE_SIZE', '200'))
+USERS_PAGE_MAX = 1000
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     cors_headers = {
         'Access-Control-Allow-Origin': '*',
@@ -57,7 +64,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     print(f'✅ Auth successful')
     
     if method == 'GET':
-        return get_users_list(cors_headers)
+        return get_users_list(event.get('queryStringParameters') or {}, cors_headers)
     
     if method == 'DELETE':
         return delete_user(event, cors_headers)
@@ -70,8 +77,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     }
 
 
-def get_users_list(cors_headers: Dict[str, str]) -> Dict[str, Any]:
-    '''Получает список всех пользователей из БД с их статусами'''
+def get_users_list(params: Dict[str, Any], cors_headers: Dict[str, str]) -> Dict[str, Any]:
+    '''Получает страницу пользователей из БД с их статусами (новые первыми, курсор в next_cursor)'''
     try:
         db_url = os.environ.get('DATABASE_URL', '')
         if not db_url:
@@ -82,43 +89,63 @@ def get_users_list(cors_headers: Dict[str, str]) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        conn = psycopg2.connect(db_url)
-        cursor = conn.cursor()
+        try:
+            after = decode_cursor(params.get('cursor'))
+        except InvalidCursor as e:
+            return {
+                'statusCode': 400,
+                'headers': cors_headers,
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        limit = page_limit(params.get('limit'), USERS_PAGE_SIZE, USERS_PAGE_MAX)
         
-        cursor.execute('''
-            SELECT 
-                username, 
-                email, 
-                plan_name, 
-                plan_days, 
-                status, 
-                created_at,
-                updated_at
-            FROM t_p66544974_beauty_website_proje.payments
-            ORDER BY created_at DESC
-        ''')
+        with get_connection() as conn:
+            cursor = conn.cursor()
         
-        rows = cursor.fetchall()
+            rows, next_cursor = keyset_page(
+                cursor,
+                '''
+                SELECT 
+                    username, 
+                    email, 
+                    plan_name, 
+                    plan_days, 
+                    status, 
+                    updated_at,
+                    created_at,
+                    id
+                FROM t_p66544974_beauty_website_proje.payments
+                ''',
+                [],
+                [],
+                after,
+                limit
+            )
         
-        users = []
-        for row in rows:
-            users.append({
-                'username': row[0],
-                'email': row[1],
-                'plan_name': row[2],
-                'plan_days': row[3],
-                'status': row[4],
-                'created_at': row[5].isoformat() if row[5] else None,
-                'updated_at': row[6].isoformat() if row[6] else None
-            })
+            users = []
+            for row in rows:
+                users.append({
+                    'username': row[0],
+                    'email': row[1],
+                    'plan_name': row[2],
+                    'plan_days': row[3],
+                    'status': row[4],
+                    'created_at': row[6].isoformat() if row[6] else None,
+                    'updated_at': row[5].isoformat() if row[5] else None
+                })
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
         return {
             'statusCode': 200,
             'headers': cors_headers,
-            'body': json.dumps({'users': users, 'total': len(users)}),
+            'body': json.dumps({
+                'users': users,
+                'total': len(users),
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            }),
             'isBase64Encoded': False
         }
         
@@ -188,35 +215,8 @@ def delete_from_remnawave(username: str) -> Dict[str, Any]:
             'Content-Type': 'application/json'
         }
         
-        # Сначала получаем UUID пользователя
-        users_response = requests.get(
-            f'{remnawave_url}/api/users',
-            headers=headers,
-            timeout=15
-        )
-        
-        if users_response.status_code != 200:
-            print(f'❌ Failed to fetch users from RemnaWave: {users_response.status_code}')
-            return {'status': 'error', 'message': 'Failed to fetch users'}
-        
-        users_data = users_response.json()
-        
-        # Извлекаем список пользователей
-        if 'response' in users_data and 'users' in users_data['response']:
-            users_list = users_data['response']['users']
-        elif 'users' in users_data:
-            users_list = users_data['users']
-        elif isinstance(users_data, list):
-            users_list = users_data
-        else:
-            users_list = []
-        
-        # Ищем пользователя по username
-        target_user = None
-        for user in users_list:
-            if user.get('username') == username:
-                target_user = user
-                break
+        # Сначала получаем UUID пользователя из зеркала remnawave_users
+        target_user = find_user(username=username, api_url=remnawave_url, token=remnawave_token)
         
         if not target_user:
             print(f'⚠️ User {username} not found in RemnaWave')
@@ -225,7 +225,7 @@ def delete_from_remnawave(username: str) -> Dict[str, Any]:
         user_uuid = target_user.get('uuid')
         
         # Удаляем пользователя
-        delete_response = requests.delete(
+        delete_response = http_client.delete(
             f'{remnawave_url}/api/users/{user_uuid}',
             headers=headers,
             timeout=15
@@ -233,6 +233,7 @@ def delete_from_remnawave(username: str) -> Dict[str, Any]:
         
         if delete_response.status_code in [200, 204]:
             print(f'✅ User {username} deleted from RemnaWave')
+            mark_deleted(user_uuid)
             return {'status': 'success', 'uuid': user_uuid}
         else:
             print(f'❌ Failed to delete from RemnaWave: {delete_response.status_code}')
@@ -250,20 +251,19 @@ def delete_from_database(username: str) -> Dict[str, Any]:
         if not db_url:
             return {'status': 'error', 'message': 'Database not configured'}
         
-        conn = psycopg2.connect(db_url)
-        cursor = conn.cursor()
+        with get_connection() as conn:
+            cursor = conn.cursor()
         
-        # Удаляем все записи пользователя
-        cursor.execute('''
-            DELETE FROM t_p66544974_beauty_website_proje.payments
-            WHERE username = %s
-        ''', (username,))
+            # Удаляем все записи пользователя
+            cursor.execute('''
+                DELETE FROM t_p66544974_beauty_website_proje.payments
+                WHERE username = %s
+            ''', (username,))
         
-        deleted_count = cursor.rowcount
+            deleted_count = cursor.rowcount
+            client_summary.refresh_clients(cursor, [username])
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            cursor.close()
         
         print(f'✅ Deleted {deleted_count} records for user {username} from database')
         return {'status': 'success', 'deleted_records': deleted_count}
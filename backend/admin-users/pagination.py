@@ -0,0 +1,90 @@
+'''
+Business: Keyset-пагинация (по умолчанию по created_at, id) с непрозрачным курсором
+Args: сырые limit/cursor из queryStringParameters
+Returns: page_limit()/decode_cursor() для разбора запроса, keyset_page() - страница и next_cursor
+'''
+
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, List, Optional, Sequence, Tuple
+
+DEFAULT_ORDER = ('created_at', 'id')
+
+
+class InvalidCursor(ValueError):
+    '''Курсор повреждён или выдан не этим API'''
+
+
+def page_limit(raw: Any, default: int, maximum: int) -> int:
+    '''Размер страницы из запроса, ограниченный сверху maximum'''
+    try:
+        value = int(raw) if raw not in (None, '') else default
+    except (TypeError, ValueError):
+        value = default
+    return max(1, min(value, maximum))
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(*values: Any) -> str:
+    payload = json.dumps([_plain(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str], size: int = len(DEFAULT_ORDER)) -> Optional[List[Any]]:
+    '''
+    None - первая страница; InvalidCursor - курсор нельзя разобрать.
+    Значения возвращаются как в JSON (даты строками) - PostgreSQL приводит их к типу колонок.
+    '''
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except ValueError as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor}') from e
+    if not isinstance(values, list) or len(values) != size or any(v is None for v in values):
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+    return values
+
+
+def keyset_page(cursor: Any, select_sql: str, where: List[str], params: List[Any],
+                after: Optional[Sequence[Any]], limit: int,
+                order_by: Tuple[str, ...] = DEFAULT_ORDER, descending: bool = True) -> Tuple[List[tuple], Optional[str]]:
+    '''
+    Выполняет select_sql с условиями where, отсортированный по order_by в одном направлении -
+    так PostgreSQL идёт по составному индексу с теми же колонками, и время не растёт с историей.
+    Последние len(order_by) колонок выборки должны совпадать с order_by: по ним строится next_cursor.
+    Колонки order_by не должны содержать NULL.
+    '''
+    direction = 'DESC' if descending else 'ASC'
+    conditions = list(where)
+    values = list(params)
+    if after is not None:
+        placeholders = ', '.join(['%s'] * len(order_by))
+        conditions.append(f"({', '.join(order_by)}) {'<' if descending else '>'} ({placeholders})")
+        values.extend(after)
+
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    cursor.execute(f"""
+        {select_sql}
+        {where_sql}
+        ORDER BY {', '.join(f'{col} {direction}' for col in order_by)}
+        LIMIT %s
+    """, values + [limit + 1])
+    rows = cursor.fetchall()
+
+    # Лишняя строка показывает, что есть следующая страница, без COUNT по всей истории
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*rows[-1][-len(order_by):])
+    return rows, next_cursor
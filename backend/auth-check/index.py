@@ -7,10 +7,11 @@ Returns: HTTP response with login check result or block status
 
 import json
 import os
-import psycopg2
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 
+from db import get_connection
+
 # Настройки защиты
 MAX_ATTEMPTS = 3
 BLOCK_DURATION_MINUTES = 15
@@ -77,54 +78,51 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        conn = psycopg2.connect(db_url)
+        with get_connection() as conn:
         
-        # Очистка старых записей (старше 24 часов)
-        cleanup_old_attempts(conn)
+            # Очистка старых записей (старше 24 часов)
+            cleanup_old_attempts(conn)
         
-        if action == 'check':
-            # Проверка, заблокирован ли IP для конкретного типа логина
-            blocked = is_ip_blocked(conn, ip_address, login_type)
-            conn.close()
+            if action == 'check':
+                # Проверка, заблокирован ли IP для конкретного типа логина
+                blocked = is_ip_blocked(conn, ip_address, login_type)
+            
+                if blocked:
+                    return {
+                        'statusCode': 429,
+                        'headers': cors_headers,
+                        'body': json.dumps({
+                            'blocked': True,
+                            'message': f'Слишком много неудачных попыток. Попробуйте через {BLOCK_DURATION_MINUTES} минут'
+                        }),
+                        'isBase64Encoded': False
+                    }
             
-            if blocked:
                 return {
-                    'statusCode': 429,
+                    'statusCode': 200,
                     'headers': cors_headers,
-                    'body': json.dumps({
-                        'blocked': True,
-                        'message': f'Слишком много неудачных попыток. Попробуйте через {BLOCK_DURATION_MINUTES} минут'
-                    }),
+                    'body': json.dumps({'blocked': False}),
                     'isBase64Encoded': False
                 }
-            
-            return {
-                'statusCode': 200,
-                'headers': cors_headers,
-                'body': json.dumps({'blocked': False}),
-                'isBase64Encoded': False
-            }
         
-        elif action == 'record':
-            # Запись попытки авторизации с типом логина
-            record_attempt(conn, ip_address, username, success, login_type)
-            conn.close()
+            elif action == 'record':
+                # Запись попытки авторизации с типом логина
+                record_attempt(conn, ip_address, username, success, login_type)
             
-            return {
-                'statusCode': 200,
-                'headers': cors_headers,
-                'body': json.dumps({'recorded': True}),
-                'isBase64Encoded': False
-            }
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': json.dumps({'recorded': True}),
+                    'isBase64Encoded': False
+                }
         
-        else:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': cors_headers,
-                'body': json.dumps({'error': 'Invalid action. Use "check" or "record"'}),
-                'isBase64Encoded': False
-            }
+            else:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': 'Invalid action. Use "check" or "record"'}),
+                    'isBase64Encoded': False
+                }
         
     except Exception as e:
         print(f'❌ Auth check error: {str(e)}')
@@ -1,6 +1,6 @@
 import json
 import os
-import requests
+import http_client
 from typing import Dict, Any
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -48,7 +48,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     try:
         print(f'🔍 Checking payment status: {payment_id}')
-        response = requests.get(
+        response = http_client.get(
             f'https://api.yookassa.ru/v3/payments/{payment_id}',
             auth=(shop_id, secret_key),
             timeout=10
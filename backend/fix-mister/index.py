@@ -6,9 +6,11 @@ Returns: Success status
 
 import json
 import os
-import requests
 from typing import Dict, Any
 
+import remnawave_client
+from remnawave_client import RemnawaveError
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     
@@ -31,30 +33,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         from datetime import datetime
         correct_expire_timestamp = int(datetime(2025, 12, 8, 17, 38, 39).timestamp())
         
-        remnawave_url = 'https://functions.poehali.dev/4e61ec57-0f83-4c68-83fb-8b3049f711ab'
-        
-        response = requests.post(
-            remnawave_url,
-            headers={'Content-Type': 'application/json'},
-            json={
-                'action': 'update_user',
-                'username': 'mister_1762018677494',
-                'uuid': 'b8e4535a-2aea-4076-9af0-fdc198988eab',
-                'expire': correct_expire_timestamp
-            },
-            timeout=30
+        user = remnawave_client.update_user(
+            user_uuid='b8e4535a-2aea-4076-9af0-fdc198988eab',
+            username='mister_1762018677494',
+            expire_at=remnawave_client.expire_at_from_timestamp(correct_expire_timestamp)
         )
         
         return {
-            'statusCode': response.status_code,
+            'statusCode': 200,
             'headers': cors_headers,
             'body': json.dumps({
-                'success': response.status_code == 200,
-                'response': response.text
+                'success': True,
+                'response': user
             }),
             'isBase64Encoded': False
         }
         
+    except RemnawaveError as e:
+        return {
+            'statusCode': e.status_code,
+            'headers': cors_headers,
+            'body': json.dumps({
+                'success': False,
+                'response': e.details
+            }),
+            'isBase64Encoded': False
+        }
     except Exception as e:
         return {
             'statusCode': 500,
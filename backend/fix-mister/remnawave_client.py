@@ -0,0 +1,406 @@
+'''
+Business: Клиент Remnawave API для прямого вызова из функций (без HTTP-хопа через функцию remnawave)
+Args: REMNAWAVE_API_URL, REMNAWAVE_API_TOKEN, REMNAWAVE_USERS_PAGE_SIZE, REMNAWAVE_PAGE_RETRIES из переменных окружения
+Returns: create_user/extend_subscription/update_user/extend_user/delete_user/patch_user/bulk_update_users,
+         get_user_by_username/get_user_by_uuid, iter_users/iter_user_pages - постраничный обход,
+         iter_user_pages_since - только изменённые после отметки, iter_users_by_username - по алфавиту;
+         ошибки API - RemnawaveError
+'''
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+import http_client
+import singleflight
+from remnawave_mirror import mark_deleted, record_user
+
+DEFAULT_SQUAD_UUID = 'e742f30b-82fb-431a-918b-1b4d22d6ba4d'
+DEFAULT_TRAFFIC_LIMIT_BYTES = 32212254720
+REQUEST_TIMEOUT = 10
+USERS_PAGE_SIZE = int(os.environ.get('REMNAWAVE_USERS_PAGE_SIZE', '500'))
+PAGE_RETRIES = int(os.environ.get('REMNAWAVE_PAGE_RETRIES', '3'))
+PAGE_RETRY_BACKOFF_SECONDS = 0.5
+# 429 означает, что запрос не выполнен - его безопасно повторить после паузы governor
+RATE_LIMIT_RETRIES = 2
+
+
+class RemnawaveError(Exception):
+    '''Remnawave ответил ошибкой или не настроен'''
+
+    def __init__(self, status_code: int, message: str, details: str = ''):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+class SortingUnsupported(Exception):
+    '''Remnawave вернул /api/users не в запрошенном порядке'''
+
+
+class DeltaUnsupported(SortingUnsupported):
+    '''Remnawave не отсортировал /api/users по updatedAt - выборку изменённых так не получить'''
+
+
+def is_configured() -> bool:
+    return bool(os.environ.get('REMNAWAVE_API_URL') and os.environ.get('REMNAWAVE_API_TOKEN'))
+
+
+def _config() -> Tuple[str, str]:
+    api_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
+    api_token = os.environ.get('REMNAWAVE_API_TOKEN', '')
+    if not api_url or not api_token:
+        raise RemnawaveError(500, 'API credentials not configured')
+    return api_url, api_token
+
+
+def _call(method: str, path: str, expected: Tuple[int, ...] = (200,), **kwargs: Any) -> Any:
+    '''
+    Запрос к Remnawave API; возвращает содержимое поля response.
+    Одновременные одинаковые GET в процессе (двойной клик, опрос из кабинета и страницы оплаты)
+    уходят в Remnawave одним запросом.
+    '''
+    if method == 'GET':
+        params = tuple(sorted((kwargs.get('params') or {}).items()))
+        return singleflight.do(('remnawave', path, params, expected), lambda: _send(method, path, expected, **kwargs))
+    return _send(method, path, expected, **kwargs)
+
+
+def _send(method: str, path: str, expected: Tuple[int, ...], **kwargs: Any) -> Any:
+    api_url, api_token = _config()
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        # Очередь и паузы после 429/5xx - в remnawave_governor, через который идёт http_client
+        response = http_client.request(
+            method,
+            f'{api_url}{path}',
+            headers={
+                'Authorization': f'Bearer {api_token}',
+                'Content-Type': 'application/json'
+            },
+            timeout=REQUEST_TIMEOUT,
+            **kwargs
+        )
+        if response.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+            break
+        print(f'⏳ {method} {path} throttled by Remnawave, retry {attempt + 1}/{RATE_LIMIT_RETRIES}')
+
+    if response.status_code not in expected:
+        raise RemnawaveError(response.status_code, f'{method} {path} failed', response.text)
+
+    if not response.content:
+        return {}
+    data = response.json()
+    return data.get('response', data) if isinstance(data, dict) else data
+
+
+def expire_at_from_timestamp(expire_timestamp: int) -> str:
+    return datetime.fromtimestamp(expire_timestamp).isoformat() + 'Z'
+
+
+def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
+    try:
+        return _call('GET', f'/api/users/by-username/{username}')
+    except RemnawaveError as e:
+        if e.status_code == 404:
+            return None
+        raise
+
+
+def get_user_by_uuid(user_uuid: str) -> Optional[Dict[str, Any]]:
+    try:
+        return _call('GET', f'/api/users/{user_uuid}')
+    except RemnawaveError as e:
+        if e.status_code == 404:
+            return None
+        raise
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    '''ISO-время из Remnawave (expireAt, updatedAt) в datetime с часовым поясом'''
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def list_users_page(start: int, size: int, sorting: Optional[List[Dict[str, Any]]] = None) -> Tuple[List[Dict[str, Any]], int]:
+    '''Страница /api/users (start - смещение, sorting - [{id, desc}]); возвращает пользователей и общее число'''
+    params: Dict[str, Any] = {'start': start, 'size': size}
+    if sorting:
+        params['sorting'] = json.dumps(sorting)
+    data = _call('GET', '/api/users', params=params)
+    if isinstance(data, dict):
+        users = data.get('users', [])
+        return users, int(data.get('total', start + len(users)))
+    users = data or []
+    return users, start + len(users)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, RemnawaveError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, requests.RequestException)
+
+
+def _page_with_retries(start: int, size: int, sorting: Optional[List[Dict[str, Any]]] = None) -> Tuple[List[Dict[str, Any]], int]:
+    for attempt in range(PAGE_RETRIES + 1):
+        try:
+            return list_users_page(start, size, sorting)
+        except Exception as e:
+            if attempt == PAGE_RETRIES or not _is_retryable(e):
+                raise
+            delay = PAGE_RETRY_BACKOFF_SECONDS * 2 ** attempt
+            print(f'⚠️ /api/users page start={start} failed: {str(e)}, retry {attempt + 1}/{PAGE_RETRIES} in {delay}s')
+            time.sleep(delay)
+
+
+def iter_user_pages(page_size: int = USERS_PAGE_SIZE, start: int = 0) -> Iterator[Tuple[List[Dict[str, Any]], int]]:
+    '''
+    Обходит /api/users страницами по page_size, отдавая (пользователи страницы, total).
+    В памяти только одна страница; упавшая страница повторяется до PAGE_RETRIES раз.
+    start - смещение, с которого продолжить прерванный обход.
+    '''
+    _config()
+    while True:
+        users, total = _page_with_retries(start, page_size)
+        if not users:
+            return
+        yield users, total
+        start += len(users)
+        if start >= total:
+            return
+
+
+def iter_user_pages_since(updated_after: datetime,
+                          page_size: int = USERS_PAGE_SIZE) -> Iterator[Tuple[List[Dict[str, Any]], int]]:
+    '''
+    Страницы пользователей с updatedAt не раньше updated_after: /api/users по убыванию updatedAt,
+    обход заканчивается на первом более старом. Изменение во время обхода поднимает пользователя
+    в начало списка - он сдвигает остальных назад и может попасться дважды, но не пропадает.
+    Если порядок не убывающий, Remnawave сортировку не поддерживает - DeltaUnsupported. Порядок
+    проверяется по всей странице до отсечки; первая строка старше updated_after при total > 0
+    тоже считается признаком игнорируемой сортировки (с отметкой sync-uuids самый свежий
+    пользователь в выборку попадает всегда).
+    '''
+    _config()
+    sorting = [{'id': 'updatedAt', 'desc': True}]
+    start = 0
+    previous: Optional[datetime] = None
+    while True:
+        users, total = _page_with_retries(start, page_size, sorting)
+        if not users:
+            return
+
+        stamps = [parse_timestamp(user.get('updatedAt')) for user in users]
+        for updated_at in stamps:
+            if updated_at is None or (previous is not None and updated_at > previous):
+                raise DeltaUnsupported(f'/api/users is not sorted by updatedAt at start={start}')
+            previous = updated_at
+        if start == 0 and total > 0 and stamps[0] < updated_after:
+            raise DeltaUnsupported(f'/api/users starts with a user updated at {stamps[0].isoformat()}, '
+                                   f'before {updated_after.isoformat()}')
+
+        fresh = [user for user, updated_at in zip(users, stamps) if updated_at >= updated_after]
+
+        if fresh:
+            yield fresh, total
+        if len(fresh) < len(users):
+            return
+        start += len(users)
+        if start >= total:
+            return
+
+
+def iter_users_by_username(page_size: int = USERS_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    '''
+    Пользователи по возрастанию username (посимвольно, как COLLATE "C" в PostgreSQL) - для
+    слияния с отсортированной выборкой из БД. Повтор из-за сдвига страниц пропускается;
+    если Remnawave сортирует иначе (или не сортирует) - SortingUnsupported.
+    '''
+    _config()
+    sorting = [{'id': 'username', 'desc': False}]
+    start = 0
+    previous: Optional[str] = None
+    while True:
+        users, total = _page_with_retries(start, page_size, sorting)
+        if not users:
+            return
+        for user in users:
+            username = user.get('username') or ''
+            if previous is not None and username <= previous:
+                if username == previous:
+                    continue
+                raise SortingUnsupported(f'/api/users is not sorted by username at start={start}')
+            previous = username
+            yield user
+        start += len(users)
+        if start >= total:
+            return
+
+
+def iter_users(page_size: int = USERS_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    '''Пользователи Remnawave по одному, страницы запрашиваются по мере чтения'''
+    for users, _ in iter_user_pages(page_size):
+        yield from users
+
+
+def list_users() -> List[Dict[str, Any]]:
+    '''Весь список сразу - только там, где он действительно нужен целиком (отдача в API)'''
+    return list(iter_users())
+
+
+def list_internal_squads() -> Any:
+    return _call('GET', '/api/internal-squads')
+
+
+def create_user(username: str, expire_timestamp: Optional[int], data_limit: int = 0,
+                internal_squads: Optional[List[str]] = None, proxies: Optional[Dict[str, Any]] = None,
+                data_limit_reset_strategy: str = 'day') -> Dict[str, Any]:
+    '''Создаёт пользователя сразу со всеми параметрами (squads только переданные, без дефолтных)'''
+    squad_uuids = internal_squads or []
+    payload = {
+        'username': username,
+        'proxies': proxies or {},
+        'expireAt': expire_at_from_timestamp(expire_timestamp) if expire_timestamp else None,
+        'expire': expire_timestamp,
+        'trafficLimitBytes': data_limit,
+        'trafficLimitStrategy': data_limit_reset_strategy.upper(),
+        'activeInternalSquads': squad_uuids
+    }
+
+    print(f'🔹 Creating user {username} with activeInternalSquads: {squad_uuids}')
+    user = _call('POST', '/api/users', expected=(200, 201), json=payload)
+    print(f'✅ User {username} created: {user.get("uuid")}')
+
+    record_user(user)
+    return user
+
+
+def extend_subscription(username: str, user_uuid: Optional[str], expire_timestamp: int,
+                        internal_squads: Optional[List[str]] = None,
+                        data_limit: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    Продлевает подписку одним PATCH существующего пользователя: UUID, ссылка подписки
+    и счётчики трафика сохраняются, доступ не пропадает. UUID из зеркала мог устареть
+    (пользователя пересоздали) - тогда продлевается живой UUID по username. Пересоздаёт
+    пользователя, только если в Remnawave нет и его. data_limit - лимит трафика тарифа
+    (по умолчанию DEFAULT_TRAFFIC_LIMIT_BYTES).
+    '''
+    expire_at = expire_at_from_timestamp(expire_timestamp)
+    squad_uuids = internal_squads or [DEFAULT_SQUAD_UUID]
+    traffic_limit = DEFAULT_TRAFFIC_LIMIT_BYTES if data_limit is None else data_limit
+    print(f'📅 Extending subscription for {username} ({user_uuid}) until {expire_at}, squads: {squad_uuids}')
+    patch_payload = {
+        'expireAt': expire_at,
+        'status': 'ACTIVE',
+        'trafficLimitBytes': traffic_limit,
+        'trafficLimitStrategy': 'DAY',
+        'activeInternalSquads': squad_uuids
+    }
+
+    if user_uuid:
+        try:
+            user = _call('PATCH', f'/api/users/{user_uuid}', expected=(200, 201), json=patch_payload)
+            print(f'✅ Subscription extended in place for {username} ({user_uuid})')
+            record_user(user)
+            return user
+        except RemnawaveError as e:
+            if e.status_code != 404:
+                raise
+            print(f'⚠️ User {user_uuid} not found in Remnawave, looking up {username}')
+            mark_deleted(user_uuid)
+
+    existing = get_user_by_username(username)
+    if existing and existing.get('uuid'):
+        user = _call('PATCH', f'/api/users/{existing["uuid"]}', expected=(200, 201), json=patch_payload)
+        print(f'✅ Subscription extended in place for {username} (live UUID {existing["uuid"]})')
+        record_user(user)
+        return user
+
+    user = _call('POST', '/api/users', expected=(200, 201), json={
+        'username': username,
+        'expireAt': expire_at,
+        'trafficLimitBytes': traffic_limit,
+        'trafficLimitStrategy': 'DAY',
+        'activeInternalSquads': squad_uuids,
+        'proxies': {}
+    })
+    print(f'✅ Subscription extended for {username} (recreated as {user.get("uuid")})')
+
+    record_user(user)
+    return user
+
+
+def update_user(user_uuid: Optional[str] = None, username: Optional[str] = None,
+                expire_at: Optional[str] = None, internal_squads: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    '''PATCH пользователя; None - обновлять нечего'''
+    if not user_uuid:
+        if not username:
+            raise RemnawaveError(400, 'UUID or username required')
+        user = get_user_by_username(username)
+        if not user:
+            raise RemnawaveError(404, f'User {username} not found')
+        user_uuid = user.get('uuid')
+
+    patch_payload: Dict[str, Any] = {}
+    if internal_squads:
+        patch_payload['inboundUuids'] = internal_squads
+    if expire_at:
+        patch_payload['expireAt'] = expire_at
+
+    if not patch_payload:
+        return None
+
+    print(f'🔹 PATCH /api/users/{user_uuid} with payload: {patch_payload}')
+    user = _call('PATCH', f'/api/users/{user_uuid}', expected=(200, 201), json=patch_payload)
+
+    record_user(user)
+    return user
+
+
+def patch_user(user_uuid: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+    '''PATCH произвольных полей без записи в зеркало - массовые вызовы пишут его сами, пачкой'''
+    return _call('PATCH', f'/api/users/{user_uuid}', expected=(200, 201), json=fields)
+
+
+def bulk_update_users(user_uuids: List[str], fields: Dict[str, Any]) -> int:
+    '''Одни и те же поля для списка пользователей одним запросом; возвращает affectedRows'''
+    data = _call('POST', '/api/users/bulk/update', expected=(200, 201), json={'uuids': user_uuids, 'fields': fields})
+    if isinstance(data, dict) and 'affectedRows' in data:
+        return int(data['affectedRows'])
+    return len(user_uuids)
+
+
+def extend_user(username: str, days: int) -> str:
+    '''Продлевает пользователя на days дней от текущего expireAt (или от сейчас); возвращает новый expireAt'''
+    user = get_user_by_username(username)
+    if not user:
+        raise RemnawaveError(404, f'User {username} not found')
+
+    current_expire_ts = 0
+    current_expire_str = user.get('expireAt', '')
+    if current_expire_str:
+        try:
+            current_expire_ts = int(datetime.fromisoformat(current_expire_str.replace('Z', '+00:00')).timestamp())
+        except ValueError:
+            pass
+
+    now_ts = int(datetime.now().timestamp())
+    new_expire_at = expire_at_from_timestamp(max(current_expire_ts, now_ts) + days * 86400)
+    print(f'🔹 {username}: current expire {current_expire_ts}, new expire {new_expire_at}')
+
+    updated = _call('PATCH', f'/api/users/{user.get("uuid")}', json={'expireAt': new_expire_at})
+    record_user(updated)
+    return new_expire_at
+
+
+def delete_user(user_uuid: str):
+    _call('DELETE', f'/api/users/{user_uuid}', expected=(200, 204))
+    mark_deleted(user_uuid)
@@ -0,0 +1,182 @@
+'''
+Business: Ограничитель частоты запросов к Remnawave (token bucket) с приоритетом живых запросов над массовыми
+Args: REMNAWAVE_RATE_PER_SECOND, REMNAWAVE_RATE_BURST, REMNAWAVE_BULK_RATE_PER_SECOND,
+      REMNAWAVE_GOVERNOR_MAX_WAIT_SECONDS, REMNAWAVE_LANE из переменных окружения
+Returns: регистрируется в http_client при импорте и пропускает через себя все запросы к REMNAWAVE_API_URL;
+         set_default_lane() - полоса функции, stats() - глубина очереди, ожидание, число 429/5xx
+'''
+
+import os
+import threading
+import time
+from typing import Any, Dict, Mapping
+from urllib.parse import urlsplit
+
+import requests
+
+import http_client
+
+LANE_INTERACTIVE = 'interactive'
+LANE_BULK = 'bulk'
+
+RATE_PER_SECOND = float(os.environ.get('REMNAWAVE_RATE_PER_SECOND', '30'))
+BURST = float(os.environ.get('REMNAWAVE_RATE_BURST', '30'))
+# Массовые задачи (восстановление, синхронизация, компенсации) получают не больше этой доли
+BULK_RATE_PER_SECOND = float(os.environ.get('REMNAWAVE_BULK_RATE_PER_SECOND', '20'))
+MAX_WAIT_SECONDS = float(os.environ.get('REMNAWAVE_GOVERNOR_MAX_WAIT_SECONDS', '30'))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+
+
+class GovernorTimeout(requests.exceptions.Timeout):
+    '''Запрос простоял в очереди к Remnawave дольше MAX_WAIT_SECONDS'''
+
+
+class _Bucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else 1.0
+
+
+class Governor:
+    '''
+    Общий bucket на процесс функции. Запрос из полосы bulk получает токен, только если
+    никто из interactive не ждёт, и дополнительно ограничен собственным bucket с BULK_RATE_PER_SECOND.
+    429 и 5xx ставят паузу для всех полос с экспоненциальным ростом (Retry-After, если он больше).
+    '''
+
+    def __init__(self, rate: float = RATE_PER_SECOND, burst: float = BURST,
+                 bulk_rate: float = BULK_RATE_PER_SECOND, max_wait: float = MAX_WAIT_SECONDS):
+        self.max_wait = max_wait
+        self.default_lane = os.environ.get('REMNAWAVE_LANE', LANE_INTERACTIVE)
+        self._cond = threading.Condition()
+        self._bucket = _Bucket(rate, burst)
+        self._bulk_bucket = _Bucket(bulk_rate, max(1.0, bulk_rate))
+        self._paused_until = 0.0
+        self._failures = 0
+        self._waiting = {LANE_INTERACTIVE: 0, LANE_BULK: 0}
+        self._stats = {
+            lane: {'requests': 0, 'waited': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0, 'timeouts': 0}
+            for lane in (LANE_INTERACTIVE, LANE_BULK)
+        }
+        self._throttled = 0
+        self._server_errors = 0
+
+    def applies_to(self, url: str) -> bool:
+        api_url = os.environ.get('REMNAWAVE_API_URL', '')
+        if not api_url:
+            return False
+        target = urlsplit(api_url)
+        parts = urlsplit(url)
+        return (parts.scheme, parts.netloc) == (target.scheme, target.netloc)
+
+    def acquire(self, lane: str = ''):
+        lane = lane if lane in self._waiting else self.default_lane
+        started = time.monotonic()
+        deadline = started + self.max_wait
+
+        with self._cond:
+            self._waiting[lane] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._bucket.refill(now)
+                    self._bulk_bucket.refill(now)
+
+                    wait = max(self._paused_until - now, self._bucket.wait_time())
+                    if lane == LANE_BULK:
+                        wait = max(wait, self._bulk_bucket.wait_time())
+                        if self._waiting[LANE_INTERACTIVE]:
+                            wait = max(wait, 0.05)
+
+                    if wait <= 0:
+                        self._bucket.tokens -= 1
+                        if lane == LANE_BULK:
+                            self._bulk_bucket.tokens -= 1
+                        break
+
+                    if now + wait > deadline:
+                        self._stats[lane]['timeouts'] += 1
+                        raise GovernorTimeout(f'Remnawave {lane} queue wait exceeded {self.max_wait}s')
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[lane] -= 1
+
+            waited_ms = (time.monotonic() - started) * 1000
+            lane_stats = self._stats[lane]
+            lane_stats['requests'] += 1
+            if waited_ms >= 1:
+                lane_stats['waited'] += 1
+                lane_stats['wait_ms_total'] += waited_ms
+                lane_stats['wait_ms_max'] = max(lane_stats['wait_ms_max'], waited_ms)
+
+    def observe(self, status_code: int, headers: Mapping[str, Any]):
+        if status_code == 429:
+            try:
+                retry_after = float(headers.get('Retry-After') or 0)
+            except (TypeError, ValueError):
+                retry_after = 0.0
+            self._back_off(throttled=True, retry_after=retry_after)
+        elif status_code >= 500:
+            self._back_off(throttled=False)
+        else:
+            with self._cond:
+                self._failures = 0
+
+    def observe_error(self):
+        self._back_off(throttled=False)
+
+    def _back_off(self, throttled: bool, retry_after: float = 0.0):
+        with self._cond:
+            if throttled:
+                self._throttled += 1
+            else:
+                self._server_errors += 1
+            self._failures += 1
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (self._failures - 1))
+            delay = max(delay, retry_after)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        print(f'⏸️ Remnawave backoff {delay:.1f}s after {self._failures} consecutive failure(s)')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            lanes = {}
+            for lane, lane_stats in self._stats.items():
+                lanes[lane] = {
+                    'queue_depth': self._waiting[lane],
+                    'requests': lane_stats['requests'],
+                    'waited': lane_stats['waited'],
+                    'wait_ms_avg': round(lane_stats['wait_ms_total'] / lane_stats['waited'], 1) if lane_stats['waited'] else 0.0,
+                    'wait_ms_max': round(lane_stats['wait_ms_max'], 1),
+                    'timeouts': lane_stats['timeouts']
+                }
+            return {
+                'default_lane': self.default_lane,
+                'lanes': lanes,
+                'throttled': self._throttled,
+                'server_errors': self._server_errors,
+                'paused_ms': max(0, round((self._paused_until - time.monotonic()) * 1000))
+            }
+
+
+# Один governor на процесс: все модули функции делят его через http_client
+governor = Governor()
+http_client.add_governor(governor)
+
+
+def set_default_lane(lane: str):
+    '''Массовые функции (restore-users, sync-uuids, ...) вызывают set_default_lane(LANE_BULK) при импорте'''
+    governor.default_lane = lane
+
+
+def stats() -> Dict[str, Any]:
+    return governor.stats()
@@ -7,9 +7,10 @@ Returns: HTTP response dict with receipts list
 
 import json
 import os
-import psycopg2
 from typing import Dict, Any, List
 
+from db import get_connection
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     cors_headers = {
         'Access-Control-Allow-Origin': '*',
@@ -56,61 +57,60 @@ def get_receipts(event: Dict[str, Any], cors_headers: Dict[str, str]) -> Dict[st
         limit = int(params.get('limit', 100))
         offset = int(params.get('offset', 0))
         
-        conn = psycopg2.connect(db_url)
-        cursor = conn.cursor()
+        with get_connection() as conn:
+            cursor = conn.cursor()
         
-        # Получаем чеки с данными платежей
-        cursor.execute("""
-            SELECT 
-                r.id,
-                r.payment_id,
-                r.yookassa_receipt_id,
-                r.tax_system_code,
-                r.vat_code,
-                r.amount,
-                r.email,
-                r.items,
-                r.status,
-                r.receipt_url,
-                r.created_at,
-                p.username,
-                p.plan_name,
-                p.status as payment_status
-            FROM receipts r
-            LEFT JOIN payments p ON r.payment_id = p.payment_id
-            ORDER BY r.created_at DESC
-            LIMIT %s OFFSET %s
-        """, (limit, offset))
+            # Получаем чеки с данными платежей
+            cursor.execute("""
+                SELECT 
+                    r.id,
+                    r.payment_id,
+                    r.yookassa_receipt_id,
+                    r.tax_system_code,
+                    r.vat_code,
+                    r.amount,
+                    r.email,
+                    r.items,
+                    r.status,
+                    r.receipt_url,
+                    r.created_at,
+                    p.username,
+                    p.plan_name,
+                    p.status as payment_status
+                FROM receipts r
+                LEFT JOIN payments p ON r.payment_id = p.payment_id
+                ORDER BY r.created_at DESC
+                LIMIT %s OFFSET %s
+            """, (limit, offset))
         
-        rows = cursor.fetchall()
+            rows = cursor.fetchall()
         
-        receipts: List[Dict[str, Any]] = []
-        for row in rows:
-            receipts.append({
-                'id': row[0],
-                'payment_id': row[1],
-                'yookassa_receipt_id': row[2],
-                'tax_system_code': row[3],
-                'tax_system_name': get_tax_system_name(row[3]),
-                'vat_code': row[4],
-                'vat_name': get_vat_name(row[4]),
-                'amount': float(row[5]),
-                'email': row[6],
-                'items': row[7],
-                'status': row[8],
-                'receipt_url': row[9],
-                'created_at': row[10].isoformat() if row[10] else None,
-                'username': row[11],
-                'plan_name': row[12],
-                'payment_status': row[13]
-            })
+            receipts: List[Dict[str, Any]] = []
+            for row in rows:
+                receipts.append({
+                    'id': row[0],
+                    'payment_id': row[1],
+                    'yookassa_receipt_id': row[2],
+                    'tax_system_code': row[3],
+                    'tax_system_name': get_tax_system_name(row[3]),
+                    'vat_code': row[4],
+                    'vat_name': get_vat_name(row[4]),
+                    'amount': float(row[5]),
+                    'email': row[6],
+                    'items': row[7],
+                    'status': row[8],
+                    'receipt_url': row[9],
+                    'created_at': row[10].isoformat() if row[10] else None,
+                    'username': row[11],
+                    'plan_name': row[12],
+                    'payment_status': row[13]
+                })
         
-        # Получаем общее количество чеков
-        cursor.execute("SELECT COUNT(*) FROM receipts")
-        total = cursor.fetchone()[0]
+            # Получаем общее количество чеков
+            cursor.execute("SELECT COUNT(*) FROM receipts")
+            total = cursor.fetchone()[0]
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
         return {
             'statusCode': 200,
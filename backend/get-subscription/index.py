@@ -1,10 +1,36 @@
 import json
 import os
-import psycopg2
-import requests
-from typing import Dict, Any
+import time
+import http_client
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
+import catalog
+import client_summary
+import remnawave_governor  # noqa: F401 - запросы к Remnawave через http_client идут через governor
+import singleflight
+import subscription_snapshot
+from db import get_connection
+from pagination import InvalidCursor, decode_cursor, keyset_page, page_limit
+
+DB_DEADLINE_SECONDS = float(os.environ.get('SUBSCRIPTION_DB_DEADLINE_SECONDS', '5'))
+REMNAWAVE_DEADLINE_SECONDS = float(os.environ.get('SUBSCRIPTION_REMNAWAVE_DEADLINE_SECONDS', '10'))
+PAYMENTS_PAGE_SIZE = int(os.environ.get('PAYMENTS_PAGE_SIZE', '20'))
+PAYMENTS_PAGE_MAX = 100
+CLIENTS_PAGE_SIZE = int(os.environ.get('CLIENTS_PAGE_SIZE', '100'))
+CLIENTS_PAGE_MAX = 500
+# Сортировки админки -> колонки keyset (username добивает порядок до уникального)
+CLIENT_SORTS = {
+    'last_payment': ('last_payment', 'username'),
+    'total_paid': ('total_paid', 'username'),
+    'payment_count': ('payment_count', 'username'),
+    'username': ('username',)
+}
+
+# Пул живёт между тёплыми вызовами: источники снимка опрашиваются параллельно
+_fetch_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('SUBSCRIPTION_FETCH_WORKERS', '8')), thread_name_prefix='subscription-fetch')
+
 def get_public_plans(cors_headers: Dict[str, str]) -> Dict[str, Any]:
     '''Получить активные тарифы для публичного доступа'''
     db_url = os.environ.get('DATABASE_URL', '')
@@ -16,10 +42,7 @@ def get_public_plans(cors_headers: Dict[str, str]) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(db_url)
-    cursor = conn.cursor()
-    
-    try:
+    with get_connection() as conn, conn.cursor() as cursor:
         cursor.execute("""
             SELECT plan_id, name, price, days, traffic_gb, is_custom, features, show_on
             FROM t_p66544974_beauty_website_proje.subscription_plans
@@ -48,9 +71,6 @@ def get_public_plans(cors_headers: Dict[str, str]) -> Dict[str, Any]:
             'body': json.dumps({'plans': plans}),
             'isBase64Encoded': False
         }
-    finally:
-        cursor.close()
-        conn.close()
 
 def handle_admin(event: Dict[str, Any], context: Any, cors_headers: Dict[str, str]) -> Dict[str, Any]:
     '''Обработка админских запросов'''
@@ -67,10 +87,7 @@ def handle_admin(event: Dict[str, Any], context: Any, cors_headers: Dict[str, st
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(db_url)
-    cursor = conn.cursor()
-    
-    try:
+    with get_connection() as conn, conn.cursor() as cursor:
         # GET /admin?action=plans - получить все тарифы
         if action == 'plans':
             cursor.execute("""
@@ -104,18 +121,44 @@ def handle_admin(event: Dict[str, Any], context: Any, cors_headers: Dict[str, st
                 'isBase64Encoded': False
             }
         
-        # GET /admin?action=clients - получить всех клиентов
+        # GET /admin?action=clients&sort=&order=&limit=&cursor= - страница клиентов из client_summary
         elif action == 'clients':
-            cursor.execute("""
-                SELECT DISTINCT username, email, 
-                       MAX(created_at) as last_payment,
-                       SUM(CASE WHEN status = 'succeeded' THEN amount ELSE 0 END) as total_paid,
-                       COUNT(CASE WHEN status = 'succeeded' THEN 1 END) as payment_count
-                FROM payments
-                GROUP BY username, email
-                ORDER BY last_payment DESC
-            """)
-            rows = cursor.fetchall()
+            sort = params.get('sort', 'last_payment')
+            if sort not in CLIENT_SORTS:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': f'sort must be one of {list(CLIENT_SORTS)}'}),
+                    'isBase64Encoded': False
+                }
+            
+            order_by = CLIENT_SORTS[sort]
+            try:
+                after = decode_cursor(params.get('cursor'), len(order_by))
+            except InvalidCursor as e:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': str(e)}),
+                    'isBase64Encoded': False
+                }
+            
+            rows, next_cursor = keyset_page(
+                cursor,
+                f"""
+                SELECT username, email, last_payment, total_paid, payment_count, {', '.join(order_by)}
+                FROM client_summary
+                """,
+                [],
+                [],
+                after,
+                page_limit(params.get('limit'), CLIENTS_PAGE_SIZE, CLIENTS_PAGE_MAX),
+                order_by,
+                descending=params.get('order', 'desc') != 'asc'
+            )
+            
+            cursor.execute("SELECT COUNT(*) FROM client_summary")
+            total = cursor.fetchone()[0]
             
             clients = []
             for row in rows:
@@ -130,7 +173,12 @@ def handle_admin(event: Dict[str, Any], context: Any, cors_headers: Dict[str, st
             return {
                 'statusCode': 200,
                 'headers': cors_headers,
-                'body': json.dumps({'clients': clients, 'total': len(clients)}),
+                'body': json.dumps({
+                    'clients': clients,
+                    'total': total,
+                    'next_cursor': next_cursor,
+                    'has_more': next_cursor is not None
+                }),
                 'isBase64Encoded': False
             }
         
@@ -141,6 +189,18 @@ def handle_admin(event: Dict[str, Any], context: Any, cors_headers: Dict[str, st
             body = json.loads(event.get('body', '{}'))
             body_action = body.get('action')
             
+            # Полная пересборка сводки клиентов из payments
+            if body_action == 'rebuild_clients':
+                total = client_summary.rebuild(cursor)
+                conn.commit()
+                print(f'📊 Client summary rebuilt: {total} clients')
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': json.dumps({'message': 'Client summary rebuilt', 'total': total}),
+                    'isBase64Encoded': False
+                }
+            
             # Обновление настроек кнопки конструктора
             if body_action == 'update_builder_settings':
                 settings = body.get('settings', {})
@@ -179,6 +239,7 @@ def handle_admin(event: Dict[str, Any], context: Any, cors_headers: Dict[str, st
                     body.get('squad_uuids', []),
                     plan_id
                 ))
+                catalog.bump_version(cursor)
                 conn.commit()
                 return {
                     'statusCode': 200,
@@ -211,6 +272,7 @@ def handle_admin(event: Dict[str, Any], context: Any, cors_headers: Dict[str, st
                     body.get('squad_uuids', [])
                 ))
                 new_plan_id = cursor.fetchone()[0]
+                catalog.bump_version(cursor)
                 conn.commit()
                 return {
                     'statusCode': 201,
@@ -231,6 +293,7 @@ def handle_admin(event: Dict[str, Any], context: Any, cors_headers: Dict[str, st
                 }
             
             cursor.execute("DELETE FROM t_p66544974_beauty_website_proje.subscription_plans WHERE plan_id = %s", (plan_id,))
+            catalog.bump_version(cursor)
             conn.commit()
             return {
                 'statusCode': 200,
@@ -246,9 +309,148 @@ def handle_admin(event: Dict[str, Any], context: Any, cors_headers: Dict[str, st
                 'body': json.dumps({'error': 'Invalid action'}),
                 'isBase64Encoded': False
             }
-    finally:
-        cursor.close()
-        conn.close()
+
+def fetch_payments(username: str, after: Optional[List[Any]] = None,
+                   limit: int = PAYMENTS_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    '''Страница истории платежей пользователя (новые первыми) и курсор следующей'''
+    with get_connection() as conn, conn.cursor() as cursor:
+        rows, next_cursor = keyset_page(
+            cursor,
+            """
+            SELECT payment_id, amount, plan_name, plan_days, status, updated_at, created_at, id
+            FROM payments
+            """,
+            ['username = %s'],
+            [username],
+            after,
+            limit
+        )
+    
+    payments = []
+    for row in rows:
+        payments.append({
+            'payment_id': row[0],
+            'amount': float(row[1]),
+            'plan_name': row[2],
+            'plan_days': row[3],
+            'status': row[4],
+            'created_at': row[6].isoformat() if row[6] else None,
+            'updated_at': row[5].isoformat() if row[5] else None
+        })
+    return payments, next_cursor
+
+
+def fetch_remnawave_subscription(username: str) -> Optional[Dict[str, Any]]:
+    '''Срок, ссылка и трафик пользователя из Remnawave; None - данных нет'''
+    remnawave_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
+    remnawave_token = os.environ.get('REMNAWAVE_API_TOKEN', '')
+    
+    if not remnawave_url or not remnawave_token:
+        return None
+    
+    def load_user() -> Tuple[int, Dict[str, Any]]:
+        # Точечный запрос одного пользователя вместо списка с поиском по нему
+        user_response = http_client.get(
+            f'{remnawave_url}/api/users/by-username/{username}',
+            headers={'Authorization': f'Bearer {remnawave_token}'},
+            timeout=REMNAWAVE_DEADLINE_SECONDS
+        )
+        print(f'📡 Remnawave request URL: {remnawave_url}/api/users/by-username/{username}')
+        print(f'📡 Remnawave response status: {user_response.status_code}')
+        return user_response.status_code, (user_response.json() if user_response.status_code == 200 else {})
+    
+    # Кабинет и страница успешной оплаты опрашивают одновременно - в Remnawave уходит один запрос
+    status_code, response_data = singleflight.do(('subscription', username), load_user)
+    
+    if status_code != 200:
+        return None
+    
+    user_data = response_data.get('response', {}) or {}
+    
+    print(f'👤 Full user data: {json.dumps(user_data)}')
+    
+    expire_at_str = user_data.get('expireAt', '')
+    subscription_url = user_data.get('subscriptionUrl', '')
+    used_traffic_bytes = user_data.get('usedTrafficBytes', 0)
+    lifetime_traffic = user_data.get('lifetimeUsedTrafficBytes', 0)
+    traffic_limit_bytes = user_data.get('trafficLimitBytes', 32212254720)
+    
+    print(f'📅 expireAt string: {expire_at_str}')
+    print(f'🔗 subscriptionUrl: {subscription_url}')
+    print(f'📊 Current traffic (daily): {used_traffic_bytes} bytes')
+    print(f'📊 Lifetime traffic (total): {lifetime_traffic} bytes')
+    print(f'📊 Traffic limit: {traffic_limit_bytes} bytes')
+    
+    # Парсим дату из ISO формата
+    expire_timestamp = None
+    if expire_at_str:
+        expire_dt = datetime.fromisoformat(expire_at_str.replace('Z', '+00:00'))
+        expire_timestamp = int(expire_dt.timestamp())
+        
+        print(f'⏰ expire_timestamp: {expire_timestamp}')
+    
+    return {
+        'expire_timestamp': expire_timestamp,
+        'subscription_url': subscription_url,
+        # Используем lifetime вместо current для отображения
+        'used_traffic_bytes': lifetime_traffic,
+        'traffic_limit_bytes': traffic_limit_bytes
+    }
+
+
+def load_subscription_snapshot(username: str) -> Optional[Dict[str, Any]]:
+    '''
+    Собирает снимок подписки; None - пользователя нет.
+    Платежи и Remnawave запрашиваются параллельно, каждый со своим дедлайном.
+    Без ответа Remnawave срок считается по БД, а снимок помечается degraded.
+    '''
+    started = time.monotonic()
+    payments_future = _fetch_pool.submit(fetch_payments, username)
+    remnawave_future = _fetch_pool.submit(fetch_remnawave_subscription, username)
+    
+    # Без платежей ответить нечего - ошибка или таймаут БД уходят наверх как 500
+    try:
+        payments, next_cursor = payments_future.result(timeout=DB_DEADLINE_SECONDS)
+    except FuturesTimeout:
+        raise TimeoutError(f'Payments query exceeded {DB_DEADLINE_SECONDS}s')
+    
+    if not payments:
+        return None
+    
+    remnawave_data = None
+    try:
+        remaining = max(REMNAWAVE_DEADLINE_SECONDS - (time.monotonic() - started), 0)
+        remnawave_data = remnawave_future.result(timeout=remaining)
+    except FuturesTimeout:
+        print(f'⚠️ Remnawave did not answer within {REMNAWAVE_DEADLINE_SECONDS}s, using DB data')
+    except Exception as e:
+        print(f'⚠️ Failed to fetch Remnawave data: {str(e)}')
+    
+    print(f'⏱️ Subscription sources fetched in {(time.monotonic() - started) * 1000:.0f} ms')
+    
+    snapshot = {
+        'payments': payments,
+        'next_cursor': next_cursor,
+        'expire_timestamp': None,
+        'subscription_url': '',
+        'used_traffic_bytes': 0,
+        'traffic_limit_bytes': 32212254720,
+        'degraded': not remnawave_data
+    }
+    if remnawave_data:
+        snapshot.update(remnawave_data)
+    
+    # Если Remnawave не вернул данные, но есть платежи - вычисляем из БД
+    if snapshot['expire_timestamp'] is None:
+        # Берем последний платеж (любой статус)
+        last_payment = payments[0]
+        created_dt = datetime.fromisoformat(last_payment['created_at'])
+        snapshot['expire_timestamp'] = int(created_dt.timestamp() + (last_payment['plan_days'] * 86400))
+        
+        print(f'💾 Calculated from DB: expire_timestamp={snapshot["expire_timestamp"]}')
+    
+    return snapshot
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -293,10 +495,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        conn = psycopg2.connect(db_url)
-        cursor = conn.cursor()
-        
-        try:
+        with get_connection() as conn, conn.cursor() as cursor:
             cursor.execute("""
                 SELECT setting_value
                 FROM t_p66544974_beauty_website_proje.site_settings
@@ -316,9 +515,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'settings': settings}),
                 'isBase64Encoded': False
             }
-        finally:
-            cursor.close()
-            conn.close()
     
     # Проверка админского пароля для POST/DELETE или админских action
     admin_password = headers.get('x-admin-password') or headers.get('X-Admin-Password')
@@ -362,22 +558,35 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            conn = psycopg2.connect(db_url)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT payment_id, amount, plan_name, plan_days, status, created_at, updated_at
-                FROM payments
-                WHERE username = %s
-                ORDER BY created_at DESC
-            """, (username,))
+            # Следующие страницы истории платежей - только БД, без снимка и Remnawave
+            if params.get('cursor'):
+                try:
+                    after = decode_cursor(params.get('cursor'))
+                except InvalidCursor as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': str(e)}),
+                        'isBase64Encoded': False
+                    }
+                limit = page_limit(params.get('limit'), PAYMENTS_PAGE_SIZE, PAYMENTS_PAGE_MAX)
+                payments, next_cursor = fetch_payments(username, after, limit)
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': json.dumps({
+                        'username': username,
+                        'payments': payments,
+                        'next_cursor': next_cursor,
+                        'has_more': next_cursor is not None
+                    }),
+                    'isBase64Encoded': False
+                }
             
-            rows = cursor.fetchall()
+            snapshot = subscription_snapshot.get(username, load_subscription_snapshot)
             
             # Если пользователь не найден - возвращаем 404
-            if not rows:
-                cursor.close()
-                conn.close()
+            if not snapshot:
                 return {
                     'statusCode': 404,
                     'headers': cors_headers,
@@ -385,110 +594,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            payments = []
-            for row in rows:
-                payments.append({
-                    'payment_id': row[0],
-                    'amount': float(row[1]),
-                    'plan_name': row[2],
-                    'plan_days': row[3],
-                    'status': row[4],
-                    'created_at': row[5].isoformat() if row[5] else None,
-                    'updated_at': row[6].isoformat() if row[6] else None
-                })
-            
-            cursor.close()
-            conn.close()
-            
-            # Получаем данные о подписке из Remnawave
-            expire_timestamp = None
+            # Дни считаем в момент ответа: снимок мог пролежать в кэше
+            payments = snapshot['payments']
+            expire_timestamp = snapshot['expire_timestamp']
             days_left = None
-            subscription_url = ''
-            used_traffic_bytes = 0
-            traffic_limit_bytes = 32212254720
-            
-            remnawave_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
-            remnawave_token = os.environ.get('REMNAWAVE_API_TOKEN', '')
-            
-            if remnawave_url and remnawave_token:
-                try:
-                    user_response = requests.get(
-                        f'{remnawave_url}/api/users?username={username}',
-                        headers={'Authorization': f'Bearer {remnawave_token}'},
-                        timeout=10
-                    )
-                    
-                    print(f'📡 Remnawave request URL: {remnawave_url}/api/users?username={username}')
-                    print(f'📡 Remnawave response status: {user_response.status_code}')
-                    
-                    if user_response.status_code == 200:
-                        response_data = user_response.json()
-                        users_list = response_data.get('response', {}).get('users', [])
-                        print(f'📊 Total users in response: {len(users_list)}')
-                        
-                        # Находим нужного пользователя по username
-                        user_data = {}
-                        for user in users_list:
-                            if user.get('username') == username:
-                                user_data = user
-                                break
-                        
-                        if not user_data and users_list:
-                            print(f'⚠️ User {username} not found in response, available: {[u.get("username") for u in users_list[:5]]}')
-                        
-                        print(f'👤 Full user data: {json.dumps(user_data)}')
-                        
-                        expire_at_str = user_data.get('expireAt', '')
-                        subscription_url = user_data.get('subscriptionUrl', '')
-                        used_traffic_bytes = user_data.get('usedTrafficBytes', 0)
-                        lifetime_traffic = user_data.get('lifetimeUsedTrafficBytes', 0)
-                        traffic_limit_bytes = user_data.get('trafficLimitBytes', 32212254720)
-                        
-                        print(f'📅 expireAt string: {expire_at_str}')
-                        print(f'🔗 subscriptionUrl: {subscription_url}')
-                        print(f'📊 Current traffic (daily): {used_traffic_bytes} bytes')
-                        print(f'📊 Lifetime traffic (total): {lifetime_traffic} bytes')
-                        print(f'📊 Traffic limit: {traffic_limit_bytes} bytes')
-                        
-                        # Используем lifetime вместо current для отображения
-                        used_traffic_bytes = lifetime_traffic
-                        
-                        # Парсим дату из ISO формата
-                        if expire_at_str:
-                            expire_dt = datetime.fromisoformat(expire_at_str.replace('Z', '+00:00'))
-                            expire_timestamp = int(expire_dt.timestamp())
-                            
-                            print(f'⏰ expire_timestamp: {expire_timestamp}')
-                            
-                            # Вычисляем количество дней до окончания
-                            now = datetime.now().timestamp()
-                            if expire_timestamp > now:
-                                seconds_left = expire_timestamp - now
-                                days_left = int(seconds_left / 86400)
-                            else:
-                                days_left = 0
-                            
-                            print(f'📆 days_left: {days_left}')
-                except Exception as e:
-                    print(f'⚠️ Failed to fetch Remnawave data: {str(e)}')
-            
-            # Если Remnawave не вернул данные, но есть платежи - вычисляем из БД
-            if expire_timestamp is None and payments:
-                # Берем последний платеж (любой статус)
-                last_payment = payments[0] if payments else None
-                if last_payment:
-                    created_dt = datetime.fromisoformat(last_payment['created_at'])
-                    expire_dt = created_dt.timestamp() + (last_payment['plan_days'] * 86400)
-                    expire_timestamp = int(expire_dt)
-                    
-                    now = datetime.now().timestamp()
-                    if expire_timestamp > now:
-                        seconds_left = expire_timestamp - now
-                        days_left = int(seconds_left / 86400)
-                    else:
-                        days_left = 0
-                    
-                    print(f'💾 Calculated from DB: expire_timestamp={expire_timestamp}, days_left={days_left}')
+            if expire_timestamp is not None:
+                now = datetime.now().timestamp()
+                days_left = int((expire_timestamp - now) / 86400) if expire_timestamp > now else 0
+            print(f'📆 days_left: {days_left}, snapshot cache: {subscription_snapshot.stats()}')
             
             return {
                 'statusCode': 200,
@@ -497,13 +610,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'username': username,
                     'payments': payments,
                     'total': len(payments),
+                    'next_cursor': snapshot['next_cursor'],
+                    'has_more': snapshot['next_cursor'] is not None,
                     'subscription': {
                         'days_left': days_left,
                         'expire_timestamp': expire_timestamp,
-                        'subscription_url': subscription_url,
+                        'subscription_url': snapshot['subscription_url'],
                         'is_active': days_left is not None and days_left > 0,
-                        'used_traffic_bytes': used_traffic_bytes,
-                        'traffic_limit_bytes': traffic_limit_bytes
+                        'used_traffic_bytes': snapshot['used_traffic_bytes'],
+                        'traffic_limit_bytes': snapshot['traffic_limit_bytes'],
+                        'degraded': snapshot.get('degraded', False)
                     }
                 }),
                 'isBase64Encoded': False
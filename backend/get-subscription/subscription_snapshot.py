@@ -0,0 +1,118 @@
+'''
+Business: Кэш снимков подписки пользователя для личного кабинета (stale-while-revalidate)
+Args: SUBSCRIPTION_SNAPSHOT_TTL_SECONDS, SUBSCRIPTION_SNAPSHOT_MAX_STALE_SECONDS,
+      SUBSCRIPTION_SNAPSHOT_DEGRADED_TTL_SECONDS, SUBSCRIPTION_SNAPSHOT_MAX_ENTRIES из переменных окружения
+Returns: get(username, loader) - снимок из памяти процесса; устаревший отдаётся сразу
+         и обновляется в фоне, изменённый (новый платёж или продление) перечитывается.
+         Неполный снимок (degraded - Remnawave не ответил) живёт DEGRADED_TTL_SECONDS
+         и устаревшим не отдаётся
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from db import get_connection
+
+TTL_SECONDS = float(os.environ.get('SUBSCRIPTION_SNAPSHOT_TTL_SECONDS', '30'))
+MAX_STALE_SECONDS = float(os.environ.get('SUBSCRIPTION_SNAPSHOT_MAX_STALE_SECONDS', '600'))
+DEGRADED_TTL_SECONDS = float(os.environ.get('SUBSCRIPTION_SNAPSHOT_DEGRADED_TTL_SECONDS', '5'))
+MAX_ENTRIES = int(os.environ.get('SUBSCRIPTION_SNAPSHOT_MAX_ENTRIES', '5000'))
+
+Loader = Callable[[str], Optional[Dict[str, Any]]]
+
+_lock = threading.Lock()
+_snapshots: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+_refreshing = set()
+_stats = {'hits': 0, 'stale': 0, 'misses': 0, 'invalidated': 0, 'degraded': 0}
+
+
+def _current_stamp(username: str) -> Optional[datetime]:
+    '''
+    Метка последнего изменения пользователя: платёж (создание, смена статуса)
+    или запись Remnawave в зеркале (создание, продление). Один индексный запрос.
+    '''
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT GREATEST(
+                (SELECT MAX(COALESCE(updated_at, created_at)) FROM payments WHERE username = %s),
+                (SELECT MAX(synced_at) FROM remnawave_users WHERE username = %s)
+            )
+        """, (username, username))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _store(username: str, stamp: Optional[datetime], snapshot: Optional[Dict[str, Any]]):
+    with _lock:
+        if snapshot is None:
+            _snapshots.pop(username, None)
+            return
+        _snapshots[username] = {'stamp': stamp, 'snapshot': snapshot, 'loaded_at': time.monotonic()}
+        _snapshots.move_to_end(username)
+        while len(_snapshots) > MAX_ENTRIES:
+            _snapshots.popitem(last=False)
+
+
+def _load(username: str, loader: Loader, stamp: Optional[datetime]) -> Optional[Dict[str, Any]]:
+    # Метка берётся до загрузки: изменение во время загрузки заметит следующий запрос
+    snapshot = loader(username)
+    _store(username, stamp, snapshot)
+    return snapshot
+
+
+def _refresh_in_background(username: str, loader: Loader):
+    with _lock:
+        if username in _refreshing:
+            return
+        _refreshing.add(username)
+
+    def refresh():
+        try:
+            _load(username, loader, _current_stamp(username))
+        except Exception as e:
+            print(f'⚠️ Background snapshot refresh failed for {username}: {str(e)}')
+        finally:
+            with _lock:
+                _refreshing.discard(username)
+
+    threading.Thread(target=refresh, name=f'snapshot-{username}', daemon=True).start()
+
+
+def get(username: str, loader: Loader) -> Optional[Dict[str, Any]]:
+    '''Снимок подписки; loader(username) строит его из БД и Remnawave (None - пользователя нет)'''
+    stamp = _current_stamp(username)
+    entry = _snapshots.get(username)
+
+    if entry is not None and entry['stamp'] == stamp:
+        age = time.monotonic() - entry['loaded_at']
+        degraded = entry['snapshot'].get('degraded', False)
+        if age < (DEGRADED_TTL_SECONDS if degraded else TTL_SECONDS):
+            _stats['hits'] += 1
+            return entry['snapshot']
+        if not degraded and age < MAX_STALE_SECONDS:
+            _stats['stale'] += 1
+            _refresh_in_background(username, loader)
+            return entry['snapshot']
+    elif entry is not None:
+        _stats['invalidated'] += 1
+        print(f'♻️ Snapshot for {username} invalidated: user changed since {entry["stamp"]}')
+
+    _stats['misses'] += 1
+    snapshot = _load(username, loader, stamp)
+    if snapshot is not None and snapshot.get('degraded'):
+        _stats['degraded'] += 1
+    return snapshot
+
+
+def invalidate(username: str):
+    '''Сбрасывает снимок пользователя в текущем процессе'''
+    with _lock:
+        _snapshots.pop(username, None)
+
+
+def stats() -> Dict[str, int]:
+    return {**_stats, 'entries': len(_snapshots)}
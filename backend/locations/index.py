@@ -6,9 +6,11 @@ Returns: HTTP response dict со списком локаций
 
 import json
 import os
-import psycopg2
 from typing import Dict, Any
 
+import catalog
+from db import get_connection
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters') or {}
@@ -50,10 +52,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(db_url)
-    cursor = conn.cursor()
-    
-    try:
+    with get_connection() as conn, conn.cursor() as cursor:
         if method == 'GET':
             if admin_mode:
                 cursor.execute("""
@@ -117,6 +116,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     body.get('sort_order'),
                     location_id
                 ))
+                catalog.bump_version(cursor)
                 conn.commit()
                 return {
                     'statusCode': 200,
@@ -140,6 +140,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     body.get('sort_order', 0)
                 ))
                 new_id = cursor.fetchone()[0]
+                catalog.bump_version(cursor)
                 conn.commit()
                 return {
                     'statusCode': 201,
@@ -159,6 +160,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             cursor.execute("DELETE FROM t_p66544974_beauty_website_proje.locations WHERE location_id = %s", (location_id,))
+            catalog.bump_version(cursor)
             conn.commit()
             return {
                 'statusCode': 200,
@@ -173,7 +175,3 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'}),
             'isBase64Encoded': False
         }
-    
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
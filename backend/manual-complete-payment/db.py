@@ -0,0 +1,173 @@
+'''
+Business: Общий пул подключений к PostgreSQL, переживающий тёплые вызовы функции
+Args: DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_ACQUIRE_TIMEOUT,
+      DB_POOL_HEALTH_CHECK_SECONDS из переменных окружения
+Returns: get_connection() - контекстный менеджер с подключением из пула
+'''
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2 import pool as pg_pool
+
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '5'))
+ACQUIRE_TIMEOUT_SECONDS = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+HEALTH_CHECK_AFTER_SECONDS = float(os.environ.get('DB_POOL_HEALTH_CHECK_SECONDS', '30'))
+
+# Пул живёт на уровне модуля: облачная функция переиспользует его между тёплыми вызовами
+_pool: Optional[pg_pool.ThreadedConnectionPool] = None
+_pool_dsn = ''
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+_last_released: Dict[int, float] = {}
+_stats = {'created': 0, 'reused': 0, 'health_checks': 0, 'discarded': 0}
+
+
+class PoolTimeout(Exception):
+    '''Все подключения пула заняты дольше ACQUIRE_TIMEOUT_SECONDS'''
+
+
+def _get_pool() -> pg_pool.ThreadedConnectionPool:
+    '''Создаёт пул при первом обращении или при смене DATABASE_URL'''
+    global _pool, _pool_dsn
+
+    dsn = os.environ.get('DATABASE_URL', '')
+    if not dsn:
+        raise RuntimeError('DATABASE_URL not configured')
+
+    with _pool_lock:
+        if _pool is None or _pool.closed or _pool_dsn != dsn:
+            if _pool is not None and not _pool.closed:
+                _pool.closeall()
+            _last_released.clear()
+            _pool = pg_pool.ThreadedConnectionPool(min(POOL_MIN_SIZE, POOL_MAX_SIZE), POOL_MAX_SIZE, dsn)
+            _pool_dsn = dsn
+            print(f'🗄️ DB pool created: min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE}')
+        return _pool
+
+
+def _is_healthy(conn: Any) -> bool:
+    '''Проверяет подключение, которое долго простаивало в пуле'''
+    if conn.closed:
+        return False
+
+    last_released = _last_released.pop(id(conn), None)
+    if last_released is None:
+        _stats['created'] += 1
+        return True
+
+    _stats['reused'] += 1
+    if time.monotonic() - last_released < HEALTH_CHECK_AFTER_SECONDS:
+        return True
+
+    _stats['health_checks'] += 1
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error as e:
+        print(f'⚠️ DB pool health check failed: {str(e)}')
+        return False
+
+
+def _acquire() -> Any:
+    if not _slots.acquire(timeout=ACQUIRE_TIMEOUT_SECONDS):
+        raise PoolTimeout(f'No free DB connection after {ACQUIRE_TIMEOUT_SECONDS}s (max={POOL_MAX_SIZE})')
+
+    try:
+        db_pool = _get_pool()
+        conn = db_pool.getconn()
+        attempts = 0
+        while not _is_healthy(conn) and attempts < POOL_MAX_SIZE:
+            _discard(db_pool, conn)
+            conn = db_pool.getconn()
+            attempts += 1
+        return conn
+    except Exception:
+        _slots.release()
+        raise
+
+
+def _discard(db_pool: pg_pool.ThreadedConnectionPool, conn: Any):
+    _stats['discarded'] += 1
+    _last_released.pop(id(conn), None)
+    try:
+        db_pool.putconn(conn, close=True)
+    except pg_pool.PoolError:
+        pass
+
+
+def _release(conn: Any, broken: bool):
+    try:
+        db_pool = _get_pool()
+        if broken or conn.closed:
+            _discard(db_pool, conn)
+            return
+
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        if conn.autocommit:
+            conn.autocommit = False
+
+        _last_released[id(conn)] = time.monotonic()
+        db_pool.putconn(conn)
+    except Exception as e:
+        print(f'⚠️ Failed to return connection to pool: {str(e)}')
+    finally:
+        _slots.release()
+
+
+@contextmanager
+def get_connection() -> Iterator[Any]:
+    '''
+    Выдаёт подключение из пула на время блока with.
+    При нормальном выходе транзакция коммитится, при исключении откатывается.
+    '''
+    conn = _acquire()
+    broken = False
+    try:
+        yield conn
+        if not conn.closed:
+            conn.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        raise
+    finally:
+        _release(conn, broken)
+
+
+def pool_stats() -> Dict[str, Any]:
+    '''Статистика пула для логов и health-check эндпоинтов'''
+    return {
+        'max_size': POOL_MAX_SIZE,
+        'idle': len(_last_released),
+        'created': _stats['created'],
+        'reused': _stats['reused'],
+        'health_checks': _stats['health_checks'],
+        'discarded': _stats['discarded']
+    }
+
+
+def close_pool():
+    '''Закрывает все подключения (для локальных прогонов и бенчмарков)'''
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+        _last_released.clear()
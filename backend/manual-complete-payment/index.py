@@ -1,8 +1,9 @@
 import json
-import os
-import psycopg2
 from typing import Dict, Any
 
+import client_summary
+from db import get_connection
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Вручную завершить pending платёж (для тестирования)
@@ -40,49 +41,45 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'payment_id required'})
         }
     
-    db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
-    conn.autocommit = True
-    cur = conn.cursor()
-    
-    cur.execute(f"UPDATE payments SET status = 'completed', updated_at = NOW() WHERE payment_id = '{payment_id}'")
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "UPDATE payments SET status = 'completed', updated_at = NOW() WHERE payment_id = %s RETURNING username",
+            (payment_id,)
+        )
+        # Смена статуса платежа - пересчитываем сводку клиента в той же транзакции
+        client_summary.refresh_clients(cur, [r[0] for r in cur.fetchall()])
     
-    cur.execute(f"SELECT user_id, plan FROM payments WHERE payment_id = '{payment_id}'")
-    row = cur.fetchone()
+        cur.execute(f"SELECT user_id, plan FROM payments WHERE payment_id = '{payment_id}'")
+        row = cur.fetchone()
     
-    if not row:
-        cur.close()
-        conn.close()
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Payment not found'})
-        }
+        if not row:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Payment not found'})
+            }
     
-    user_id, plan = row
+        user_id, plan = row
     
-    if plan == '1month':
-        days = 30
-    elif plan == '3months':
-        days = 90
-    elif plan == '6months':
-        days = 180
-    else:
-        days = 30
+        if plan == '1month':
+            days = 30
+        elif plan == '3months':
+            days = 90
+        elif plan == '6months':
+            days = 180
+        else:
+            days = 30
     
-    cur.execute(f"UPDATE subscriptions SET status = 'active', expires_at = NOW() + INTERVAL '{days} days', updated_at = NOW() WHERE user_id = '{user_id}'")
+        cur.execute(f"UPDATE subscriptions SET status = 'active', expires_at = NOW() + INTERVAL '{days} days', updated_at = NOW() WHERE user_id = '{user_id}'")
     
-    cur.close()
-    conn.close()
-    
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'success': True,
-            'payment_id': payment_id,
-            'user_id': user_id,
-            'plan': plan,
-            'days_added': days
-        })
-    }
\ No newline at end of file
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'success': True,
+                'payment_id': payment_id,
+                'user_id': user_id,
+                'plan': plan,
+                'days_added': days
+            })
+        }
\ No newline at end of file
@@ -6,14 +6,13 @@ Returns: Extended subscription info
 
 import json
 import os
-import requests
-import psycopg2
 from typing import Dict, Any
 from datetime import datetime
 
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+import remnawave_client
+from db import get_connection
+from remnawave_client import RemnawaveError
+from remnawave_mirror import LookupUnavailable, find_user, squad_uuids
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'POST')
@@ -47,25 +46,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'referrer_username required'})
             }
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Get all activated referrals for this referrer
-        safe_username = referrer_username.replace("'", "''")
-        cur.execute(
-            f"""
-            SELECT referred_username, bonus_days, activated_at 
-            FROM referrals 
-            WHERE referrer_username = '{safe_username}' 
-              AND status = 'activated' 
-              AND referred_username IS NOT NULL
-            ORDER BY activated_at DESC
-            """
-        )
-        
-        referrals = cur.fetchall()
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+        
+            # Get all activated referrals for this referrer
+            safe_username = referrer_username.replace("'", "''")
+            cur.execute(
+                f"""
+                SELECT referred_username, bonus_days, activated_at 
+                FROM referrals 
+                WHERE referrer_username = '{safe_username}' 
+                  AND status = 'activated' 
+                  AND referred_username IS NOT NULL
+                ORDER BY activated_at DESC
+                """
+            )
+        
+            referrals = cur.fetchall()
+            cur.close()
         
         if not referrals:
             return {
@@ -89,28 +87,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Remnawave API not configured'})
             }
         
-        # Get user info from Remnawave
-        headers = {
-            'Authorization': f'Bearer {remnawave_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        users_response = requests.get(
-            f'{remnawave_api_url}/api/users',
-            headers=headers,
-            timeout=10
-        )
-        
-        if users_response.status_code != 200:
-            return {
-                'statusCode': 500,
-                'headers': cors_headers,
-                'body': json.dumps({'error': 'Failed to get users from Remnawave'})
-            }
-        
-        users_data = users_response.json()
-        users_list = users_data.get('response', {}).get('users', [])
-        user_data = next((u for u in users_list if u.get('username') == referrer_username), None)
+        # Get user info from a fresh mirror row or Remnawave itself: a stale expireAt would shorten the subscription
+        user_data = find_user(username=referrer_username, api_url=remnawave_api_url, token=remnawave_token, strict=True)
         
         if not user_data:
             return {
@@ -137,44 +115,37 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         print(f'📅 New expire: {new_expire} (+{total_days} days)')
         
-        # Use remnawave function to extend subscription
-        remnawave_url = 'https://functions.poehali.dev/4e61ec57-0f83-4c68-83fb-8b3049f711ab'
-        
-        extend_response = requests.post(
-            remnawave_url,
-            headers={'Content-Type': 'application/json'},
-            json={
-                'action': 'extend_subscription',
-                'username': referrer_username,
-                'uuid': user_uuid,
-                'expire': new_timestamp,
-                'internalSquads': user_data.get('internalSquads', [])
-            },
-            timeout=30
-        )
+        # Extend directly through the Remnawave client
+        remnawave_client.extend_subscription(referrer_username, user_uuid, new_timestamp, squad_uuids(user_data))
         
-        if extend_response.status_code == 200:
-            print(f'✅ Extended {referrer_username} subscription by {total_days} days')
-            return {
-                'statusCode': 200,
-                'headers': cors_headers,
-                'body': json.dumps({
-                    'success': True,
-                    'referrer': referrer_username,
-                    'total_referrals': len(referrals),
-                    'bonus_days': total_days,
-                    'old_expire': current_expire,
-                    'new_expire': new_expire
-                })
-            }
-        else:
-            print(f'⚠️ Failed to extend subscription: {extend_response.text}')
-            return {
-                'statusCode': 500,
-                'headers': cors_headers,
-                'body': json.dumps({'error': extend_response.text})
-            }
-            
+        print(f'✅ Extended {referrer_username} subscription by {total_days} days')
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': json.dumps({
+                'success': True,
+                'referrer': referrer_username,
+                'total_referrals': len(referrals),
+                'bonus_days': total_days,
+                'old_expire': current_expire,
+                'new_expire': new_expire
+            })
+        }
+        
+    except LookupUnavailable as e:
+        print(f'⚠️ Failed to extend subscription: {str(e)}')
+        return {
+            'statusCode': 503,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Remnawave unavailable'})
+        }
+    except RemnawaveError as e:
+        print(f'⚠️ Failed to extend subscription: {e.details}')
+        return {
+            'statusCode': 500,
+            'headers': cors_headers,
+            'body': json.dumps({'error': e.details or str(e)})
+        }
     except Exception as e:
         print(f'❌ Error: {str(e)}')
         return {
@@ -0,0 +1,60 @@
+'''
+Business: Объединение одинаковых одновременных чтений (singleflight) в пределах процесса функции
+Args: ключ запроса (например, путь Remnawave API) и функция, выполняющая запрос
+Returns: do(key, fn) - результат единственного реального вызова для всех ждущих, stats() - счётчики
+'''
+
+import copy
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_lock = threading.Lock()
+_calls: Dict[Hashable, _Call] = {}
+_stats = {'upstream': 0, 'coalesced': 0}
+
+
+def do(key: Hashable, fn: Callable[[], Any]) -> Any:
+    '''
+    Первый вызов с ключом выполняет fn, остальные с тем же ключом ждут его результата
+    (или исключения). Каждый получает свою копию, чтобы изменения одного не видели другие.
+    '''
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _Call()
+            _calls[key] = call
+            _stats['upstream'] += 1
+        else:
+            _stats['coalesced'] += 1
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+    try:
+        call.result = fn()
+        return copy.deepcopy(call.result)
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            _calls.pop(key, None)
+        call.done.set()
+
+
+def stats() -> Dict[str, int]:
+    '''upstream - реальных запросов, coalesced - запросов, получивших чужой результат'''
+    with _lock:
+        return {**_stats, 'in_flight': len(_calls)}
@@ -1,15 +1,27 @@
 '''
 Business: Manually extend user subscriptions with specified days
-Args: event with username and days to add
-Returns: Success status
+Args: event with extensions: [{username, days}], MANUAL_EXTEND_WORKERS from environment
+Returns: Per-user results with new expiry and timings
 '''
 
 import json
 import os
-import requests
-from typing import Dict, Any
+import time
+import http_client
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
 from datetime import datetime
 
+import remnawave_governor
+from db import get_connection
+from remnawave_mirror import LookupUnavailable, find_user, lookup_many, upsert_users
+
+# Массовая задача: уступает живым запросам (оплата, личный кабинет) в очереди к Remnawave
+remnawave_governor.set_default_lane(remnawave_governor.LANE_BULK)
+
+# Параллельные PATCH в Remnawave: компенсация на сотни пользователей укладывается в таймаут функции
+EXTEND_WORKERS = int(os.environ.get('MANUAL_EXTEND_WORKERS', '8'))
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'POST')
     
@@ -38,94 +50,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        remnawave_api_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
-        remnawave_token = os.environ.get('REMNAWAVE_API_TOKEN', '')
-        
-        headers = {
-            'Authorization': f'Bearer {remnawave_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        results = []
-        
-        for ext in extensions:
-            username = ext.get('username')
-            days = ext.get('days', 0)
-            
-            if not username or days <= 0:
-                results.append({
-                    'username': username,
-                    'success': False,
-                    'error': 'Invalid username or days'
-                })
-                continue
-            
-            print(f'🔧 Extending {username} by {days} days')
-            
-            # Get user info
-            users_response = requests.get(
-                f'{remnawave_api_url}/api/users',
-                headers=headers,
-                timeout=10
-            )
-            
-            if users_response.status_code != 200:
-                results.append({
-                    'username': username,
-                    'success': False,
-                    'error': 'Failed to get users list'
-                })
-                continue
-            
-            users_data = users_response.json()
-            users_list = users_data.get('response', {}).get('users', [])
-            user_data = next((u for u in users_list if u.get('username') == username), None)
-            
-            if not user_data:
-                results.append({
-                    'username': username,
-                    'success': False,
-                    'error': 'User not found'
-                })
-                continue
-            
-            user_uuid = user_data.get('uuid')
-            current_expire = user_data.get('expireAt', '')
-            
-            # Calculate new expiration
-            if current_expire:
-                expire_dt = datetime.fromisoformat(current_expire.replace('Z', '+00:00'))
-                current_timestamp = int(expire_dt.timestamp())
-            else:
-                current_timestamp = int(datetime.now().timestamp())
-            
-            new_timestamp = current_timestamp + (days * 86400)
-            new_expire_at = datetime.fromtimestamp(new_timestamp).isoformat() + 'Z'
-            
-            print(f'📅 {username}: current={current_expire}, adding {days} days, new={new_expire_at}')
-            
-            # Update via PATCH
-            patch_response = requests.patch(
-                f'{remnawave_api_url}/api/users/{user_uuid}',
-                headers=headers,
-                json={'expireAt': new_expire_at},
-                timeout=10
-            )
-            
-            if patch_response.status_code == 200:
-                print(f'✅ Extended {username}')
-                results.append({
-                    'username': username,
-                    'success': True,
-                    'new_expire': new_expire_at
-                })
-            else:
-                print(f'❌ Failed: {patch_response.status_code} - {patch_response.text}')
-                results.append({
-                    'username': username,
-                    'success': False,
-                    'error': patch_response.text
-                })
+        results = extend_users(extensions)
         
         return {
             'statusCode': 200,
@@ -142,3 +67,130 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
+
+
+def extend_users(extensions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''
+    Bulk extension: one mirror query for all usernames, then PATCHes through a pool
+    of EXTEND_WORKERS threads and one batched mirror write-through at the end.
+    Results keep the order of extensions; repeated usernames are merged (days summed).
+    '''
+    started = time.monotonic()
+    remnawave_api_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
+    remnawave_token = os.environ.get('REMNAWAVE_API_TOKEN', '')
+    
+    days_by_username: Dict[str, int] = {}
+    results_by_username: Dict[str, Dict[str, Any]] = {}
+    order = []
+    for ext in extensions:
+        username = ext.get('username')
+        days = ext.get('days', 0)
+        if not username or not isinstance(days, int) or days <= 0:
+            order.append({'username': username, 'success': False, 'error': 'Invalid username or days'})
+            continue
+        if username not in days_by_username:
+            order.append(username)
+        days_by_username[username] = days_by_username.get(username, 0) + days
+    
+    try:
+        snapshot = lookup_many(days_by_username.keys())
+    except Exception as e:
+        print(f'⚠️ Remnawave mirror lookup failed: {str(e)}')
+        snapshot = {}
+    print(f'🪞 Mirror snapshot: {len(snapshot)}/{len(days_by_username)} users, '
+          f'{sum(1 for _, fresh in snapshot.values() if fresh)} fresh')
+    
+    def extend_one(username: str) -> Dict[str, Any]:
+        task_started = time.monotonic()
+        cached = snapshot.get(username)
+        if cached and cached[1]:
+            user_data = cached[0]
+        else:
+            # Нет в зеркале или запись устарела - точечный запрос одного пользователя.
+            # PATCH ставит абсолютный срок: от устаревшего expireAt он может подписку сократить
+            try:
+                user_data = find_user(username=username, api_url=remnawave_api_url, token=remnawave_token, strict=True)
+            except LookupUnavailable as e:
+                print(f'⚠️ {username}: {str(e)}')
+                return {'username': username, 'success': False, 'error': 'Remnawave unavailable',
+                        'lookup_ms': round((time.monotonic() - task_started) * 1000)}
+        lookup_ms = round((time.monotonic() - task_started) * 1000)
+        
+        if not user_data:
+            return {'username': username, 'success': False, 'error': 'User not found', 'lookup_ms': lookup_ms}
+        
+        result = patch_expire(remnawave_api_url, remnawave_token, user_data, days_by_username[username])
+        result['lookup_ms'] = lookup_ms
+        result['duration_ms'] = round((time.monotonic() - task_started) * 1000)
+        return result
+    
+    usernames = list(days_by_username)
+    if usernames:
+        with ThreadPoolExecutor(max_workers=max(1, min(EXTEND_WORKERS, len(usernames)))) as pool:
+            for username, result in zip(usernames, pool.map(extend_one, usernames)):
+                results_by_username[username] = result
+    
+    updated_users = [r.pop('user') for r in results_by_username.values() if r.get('user')]
+    if updated_users:
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                upsert_users(cursor, updated_users)
+                cursor.close()
+        except Exception as e:
+            print(f'⚠️ Failed to update Remnawave mirror: {str(e)}')
+    
+    results = [results_by_username[item] if isinstance(item, str) else item for item in order]
+    succeeded = sum(1 for r in results if r.get('success'))
+    print(f'🏁 Extended {succeeded}/{len(results)} users in {round((time.monotonic() - started) * 1000)}ms')
+    print(f'🚦 Remnawave governor: {remnawave_governor.stats()}')
+    return results
+
+
+def patch_expire(remnawave_api_url: str, remnawave_token: str, user_data: Dict[str, Any], days: int) -> Dict[str, Any]:
+    '''Adds days to the current expireAt with a single PATCH'''
+    username = user_data.get('username')
+    user_uuid = user_data.get('uuid')
+    current_expire = user_data.get('expireAt', '')
+    
+    # Calculate new expiration
+    if current_expire:
+        expire_dt = datetime.fromisoformat(current_expire.replace('Z', '+00:00'))
+        current_timestamp = int(expire_dt.timestamp())
+    else:
+        current_timestamp = int(datetime.now().timestamp())
+    
+    new_timestamp = current_timestamp + (days * 86400)
+    new_expire_at = datetime.fromtimestamp(new_timestamp).isoformat() + 'Z'
+    
+    print(f'📅 {username}: current={current_expire}, adding {days} days, new={new_expire_at}')
+    
+    patch_started = time.monotonic()
+    try:
+        patch_response = http_client.patch(
+            f'{remnawave_api_url}/api/users/{user_uuid}',
+            headers={
+                'Authorization': f'Bearer {remnawave_token}',
+                'Content-Type': 'application/json'
+            },
+            json={'expireAt': new_expire_at},
+            timeout=10
+        )
+    except Exception as e:
+        print(f'❌ Failed {username}: {str(e)}')
+        return {'username': username, 'success': False, 'error': str(e)}
+    patch_ms = round((time.monotonic() - patch_started) * 1000)
+    
+    if patch_response.status_code == 200:
+        print(f'✅ Extended {username}')
+        return {
+            'username': username,
+            'success': True,
+            'days': days,
+            'new_expire': new_expire_at,
+            'patch_ms': patch_ms,
+            'user': patch_response.json().get('response')
+        }
+    
+    print(f'❌ Failed: {patch_response.status_code} - {patch_response.text}')
+    return {'username': username, 'success': False, 'error': patch_response.text, 'patch_ms': patch_ms}
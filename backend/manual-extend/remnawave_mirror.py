@@ -0,0 +1,310 @@
+'''
+Business: Локальное зеркало пользователей Remnawave (таблица remnawave_users)
+Args: JSON пользователя из Remnawave API, REMNAWAVE_MIRROR_MAX_AGE_SECONDS из окружения
+Returns: find_user() - поиск по username/UUID одним индексным запросом (strict=True - только свежие данные
+         для расчёта нового срока), lookup_many() - пакетный поиск,
+         upsert_users()/record_user()/mark_deleted() - синхронизация и write-through,
+         save_sync_state()/load_sync_state() - время и отметка последней синхронизации
+'''
+
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+import http_client
+import remnawave_governor  # noqa: F401 - все запросы к Remnawave через http_client идут через governor
+import singleflight
+from db import get_connection
+
+MIRROR_MAX_AGE_SECONDS = int(os.environ.get('REMNAWAVE_MIRROR_MAX_AGE_SECONDS', '300'))
+SYNC_STATE_NAME = 'users'
+
+_COLUMNS = (
+    'uuid', 'username', 'short_uuid', 'status', 'expire_at', 'created_at',
+    'traffic_limit_bytes', 'traffic_limit_strategy', 'used_traffic_bytes',
+    'subscription_url', 'internal_squads', 'remnawave_updated_at'
+)
+
+
+class LookupUnavailable(Exception):
+    '''Свежей записи в зеркале нет, а Remnawave не ответил (find_user с strict=True)'''
+
+
+def squad_uuids(user: Dict[str, Any]) -> List[str]:
+    '''UUID активных squads: Remnawave отдаёт их то объектами, то строками'''
+    uuids = []
+    for squad in user.get('activeInternalSquads') or []:
+        value = squad.get('uuid') if isinstance(squad, dict) else squad
+        if value:
+            uuids.append(value)
+    return uuids
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def _format_ts(value: Optional[datetime]) -> str:
+    if not value:
+        return ''
+    return value.isoformat().replace('+00:00', 'Z')
+
+
+def _row_from_user(user: Dict[str, Any]) -> tuple:
+    traffic = user.get('userTraffic') or {}
+    used_traffic = user.get('usedTrafficBytes', traffic.get('usedTrafficBytes'))
+    return (
+        user['uuid'],
+        user['username'],
+        user.get('shortUuid'),
+        user.get('status'),
+        _parse_ts(user.get('expireAt')),
+        _parse_ts(user.get('createdAt')),
+        user.get('trafficLimitBytes'),
+        user.get('trafficLimitStrategy'),
+        int(used_traffic) if used_traffic is not None else None,
+        user.get('subscriptionUrl'),
+        json.dumps(squad_uuids(user)),
+        _parse_ts(user.get('updatedAt'))
+    )
+
+
+def _user_from_row(row: tuple) -> Dict[str, Any]:
+    '''Собирает dict в формате ответа Remnawave API, чтобы вызывающему коду не было разницы'''
+    squads = row[10] if isinstance(row[10], list) else json.loads(row[10] or '[]')
+    return {
+        'uuid': row[0],
+        'username': row[1],
+        'shortUuid': row[2],
+        'status': row[3],
+        'expireAt': _format_ts(row[4]),
+        'createdAt': _format_ts(row[5]),
+        'trafficLimitBytes': row[6],
+        'trafficLimitStrategy': row[7],
+        'usedTrafficBytes': row[8],
+        'subscriptionUrl': row[9],
+        'activeInternalSquads': squads,
+        'updatedAt': _format_ts(row[11])
+    }
+
+
+def upsert_users(cursor: Any, users: Iterable[Dict[str, Any]]) -> int:
+    '''
+    Пакетно записывает пользователей в зеркало.
+    Строки, у которых updatedAt в Remnawave не изменился, не переписываются.
+    '''
+    # ON CONFLICT не допускает один и тот же uuid дважды в одной пачке
+    by_uuid = {u['uuid']: u for u in users if u.get('uuid') and u.get('username')}
+    rows = [_row_from_user(u) for u in by_uuid.values()]
+    if not rows:
+        return 0
+
+    updates = ', '.join(f'{col} = EXCLUDED.{col}' for col in _COLUMNS[1:])
+    result = execute_values(cursor, f"""
+        INSERT INTO remnawave_users ({', '.join(_COLUMNS)})
+        VALUES %s
+        ON CONFLICT (uuid) DO UPDATE
+        SET {updates}, synced_at = NOW(), deleted_at = NULL
+        WHERE remnawave_users.remnawave_updated_at IS DISTINCT FROM EXCLUDED.remnawave_updated_at
+           OR remnawave_users.remnawave_updated_at IS NULL
+           OR remnawave_users.deleted_at IS NOT NULL
+        RETURNING uuid
+    """, rows, template=f"({', '.join(['%s'] * len(_COLUMNS))})", page_size=500, fetch=True)
+    return len(result)
+
+
+def mark_missing_deleted(cursor: Any, seen_uuids: List[str]) -> int:
+    '''После полной синхронизации помечает удалёнными тех, кого больше нет в Remnawave'''
+    cursor.execute("""
+        UPDATE remnawave_users SET deleted_at = NOW()
+        WHERE deleted_at IS NULL AND NOT (uuid = ANY(%s))
+    """, (seen_uuids,))
+    return cursor.rowcount
+
+
+def save_sync_state(cursor: Any, total_users: int, changed_users: int,
+                    watermark: Optional[datetime] = None, full: bool = True):
+    '''
+    watermark - самый поздний updatedAt, который видела синхронизация (отметка для дельты).
+    full - полный проход: только он двигает last_synced_at, по которому _lookup считает свежим
+    всё зеркало, и задаёт watermark заново; дельта и прерванный проход пишут last_partial_sync_at,
+    а watermark только поднимают.
+    '''
+    cursor.execute("""
+        INSERT INTO remnawave_sync_state
+        (name, last_synced_at, last_partial_sync_at, total_users, changed_users, watermark, last_full_sync_at)
+        VALUES (%s, CASE WHEN %s THEN NOW() END, CASE WHEN %s THEN NULL ELSE NOW() END, %s, %s, %s,
+                CASE WHEN %s THEN NOW() END)
+        ON CONFLICT (name) DO UPDATE
+        SET last_synced_at = COALESCE(EXCLUDED.last_synced_at, remnawave_sync_state.last_synced_at),
+            last_partial_sync_at = COALESCE(EXCLUDED.last_partial_sync_at, remnawave_sync_state.last_partial_sync_at),
+            total_users = EXCLUDED.total_users, changed_users = EXCLUDED.changed_users,
+            watermark = CASE WHEN EXCLUDED.last_full_sync_at IS NOT NULL
+                             THEN COALESCE(EXCLUDED.watermark, remnawave_sync_state.watermark)
+                             ELSE GREATEST(remnawave_sync_state.watermark, EXCLUDED.watermark) END,
+            last_full_sync_at = COALESCE(EXCLUDED.last_full_sync_at, remnawave_sync_state.last_full_sync_at)
+    """, (SYNC_STATE_NAME, full, full, total_users, changed_users, watermark, full))
+
+
+def load_sync_state(cursor: Any) -> Tuple[Optional[datetime], Optional[float]]:
+    '''
+    (watermark в UTC без часового пояса, секунд с последнего полного прохода), None если его не было.
+    Возраст считает сама БД: last_full_sync_at записан её NOW() и с часами функции не сравнивается.
+    '''
+    cursor.execute(
+        "SELECT watermark, EXTRACT(EPOCH FROM NOW() - last_full_sync_at) FROM remnawave_sync_state WHERE name = %s",
+        (SYNC_STATE_NAME,)
+    )
+    row = cursor.fetchone()
+    return (row[0], float(row[1]) if row[1] is not None else None) if row else (None, None)
+
+
+def record_user(user: Optional[Dict[str, Any]]):
+    '''Write-through после создания/продления: ошибки зеркала не ломают основной сценарий'''
+    if not user or not user.get('uuid') or not user.get('username'):
+        return
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # Пересозданный пользователь (в т.ч. продление без записи в Remnawave) получает новый UUID - старую запись убираем
+            cursor.execute("""
+                UPDATE remnawave_users SET deleted_at = NOW()
+                WHERE username = %s AND uuid <> %s AND deleted_at IS NULL
+            """, (user['username'], user['uuid']))
+            upsert_users(cursor, [user])
+            cursor.close()
+    except Exception as e:
+        print(f'⚠️ Failed to update Remnawave mirror for {user.get("username")}: {str(e)}')
+
+
+def mark_deleted(user_uuid: str):
+    '''Write-through после удаления пользователя в Remnawave'''
+    if not user_uuid:
+        return
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE remnawave_users SET deleted_at = NOW() WHERE uuid = %s AND deleted_at IS NULL",
+                (user_uuid,)
+            )
+            cursor.close()
+    except Exception as e:
+        print(f'⚠️ Failed to mark {user_uuid} deleted in Remnawave mirror: {str(e)}')
+
+
+def _lookup(username: Optional[str], user_uuid: Optional[str]) -> Optional[tuple]:
+    '''Возвращает (строка, свежая ли она) из зеркала'''
+    if user_uuid:
+        where, value = 'u.uuid = %s', user_uuid
+    else:
+        where, value = 'u.username = %s', username
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {', '.join('u.' + col for col in _COLUMNS)},
+                   GREATEST(u.synced_at, s.last_synced_at) > NOW() - make_interval(secs => %s)
+            FROM remnawave_users u
+            LEFT JOIN remnawave_sync_state s ON s.name = %s
+            WHERE {where} AND u.deleted_at IS NULL
+            ORDER BY u.created_at DESC NULLS LAST
+            LIMIT 1
+        """, (MIRROR_MAX_AGE_SECONDS, SYNC_STATE_NAME, value))
+        row = cursor.fetchone()
+        cursor.close()
+
+    if not row:
+        return None
+    return row[:-1], bool(row[-1])
+
+
+def lookup_many(usernames: Iterable[str]) -> Dict[str, Tuple[Dict[str, Any], bool]]:
+    '''Пакетный поиск в зеркале одним запросом: username -> (пользователь, свежая ли запись)'''
+    names = sorted({u for u in usernames if u})
+    if not names:
+        return {}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT DISTINCT ON (u.username) {', '.join('u.' + col for col in _COLUMNS)},
+                   GREATEST(u.synced_at, s.last_synced_at) > NOW() - make_interval(secs => %s)
+            FROM remnawave_users u
+            LEFT JOIN remnawave_sync_state s ON s.name = %s
+            WHERE u.username = ANY(%s) AND u.deleted_at IS NULL
+            ORDER BY u.username, u.created_at DESC NULLS LAST
+        """, (MIRROR_MAX_AGE_SECONDS, SYNC_STATE_NAME, names))
+        rows = cursor.fetchall()
+        cursor.close()
+
+    return {row[1]: (_user_from_row(row[:-1]), bool(row[-1])) for row in rows}
+
+
+def _fetch_one(api_url: str, token: str, username: Optional[str], user_uuid: Optional[str]) -> Optional[Dict[str, Any]]:
+    '''Точечный запрос одного пользователя вместо выгрузки всего списка; одновременные одинаковые - одним запросом'''
+    path = f'/api/users/{user_uuid}' if user_uuid else f'/api/users/by-username/{username}'
+    return singleflight.do(('mirror', api_url, path), lambda: _fetch_path(api_url, token, path))
+
+
+def _fetch_path(api_url: str, token: str, path: str) -> Optional[Dict[str, Any]]:
+    response = http_client.get(
+        f'{api_url}{path}',
+        headers={'Authorization': f'Bearer {token}'},
+        timeout=10
+    )
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    data = response.json()
+    user = data.get('response', data)
+    return user if isinstance(user, dict) and user.get('uuid') else None
+
+
+def find_user(username: Optional[str] = None, user_uuid: Optional[str] = None,
+              api_url: str = '', token: str = '', strict: bool = False) -> Optional[Dict[str, Any]]:
+    '''
+    Ищет пользователя в зеркале. Если записи нет или она старше MIRROR_MAX_AGE_SECONDS -
+    запрашивает одного пользователя из Remnawave и обновляет зеркало.
+    strict - для тех, кто считает от expireAt новый срок: вместо устаревшей записи
+    (или None, когда записи нет) при недоступном Remnawave - LookupUnavailable.
+    '''
+    if not username and not user_uuid:
+        return None
+
+    cached = None
+    try:
+        cached = _lookup(username, user_uuid)
+    except Exception as e:
+        print(f'⚠️ Remnawave mirror lookup failed: {str(e)}')
+
+    if cached and cached[1]:
+        return _user_from_row(cached[0])
+
+    if api_url and token:
+        try:
+            user = _fetch_one(api_url, token, username, user_uuid)
+            if user:
+                record_user(user)
+                return user
+            if cached:
+                mark_deleted(cached[0][0])
+            return None
+        except Exception as e:
+            print(f'⚠️ Remnawave single-user fetch failed: {str(e)}')
+            if strict:
+                raise LookupUnavailable(f'Remnawave unavailable: {str(e)}')
+
+    if strict:
+        raise LookupUnavailable('Remnawave API not configured and no fresh mirror row')
+
+    # API недоступен - для чтения лучше устаревшая запись, чем никакой
+    return _user_from_row(cached[0]) if cached else None
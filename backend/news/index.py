@@ -7,9 +7,10 @@ Returns: HTTP response dict
 
 import json
 import os
-import psycopg2
 from typing import Dict, Any
 
+from db import get_connection
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -37,10 +38,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'DATABASE_URL not configured'})
         }
     
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    
-    try:
+    with get_connection() as conn, conn.cursor() as cur:
         if method == 'GET':
             public_access = query_params.get('public') == 'true'
             
@@ -152,7 +150,3 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': 'Method not allowed'})
         }
-    
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
@@ -0,0 +1,138 @@
+'''
+Business: Общая обработка webhook ЮKassa для payment и payment-callback
+Args: тело уведомления ЮKassa (event, object), CORS заголовки ответа
+Returns: HTTP response; повторная доставка того же события отсекается
+         одной вставкой в processed_payment_events
+'''
+
+import json
+from typing import Any, Dict
+
+import client_summary
+from db import get_connection
+from outbox import JOB_PROVISION, enqueue_job
+
+
+def event_key(event_type: str, payment_status: str) -> str:
+    '''Ключ события: тип уведомления, а для уведомлений без него - статус платежа'''
+    return event_type or f'status.{payment_status}'
+
+
+def claim_event(cursor: Any, payment_id: str, event: str) -> bool:
+    '''
+    Отмечает событие обработанным. False - такое событие по платежу уже было.
+    Вставка откатывается вместе с транзакцией, если обработка упала.
+    '''
+    cursor.execute("""
+        INSERT INTO processed_payment_events (payment_id, event)
+        VALUES (%s, %s)
+        ON CONFLICT (payment_id, event) DO NOTHING
+    """, (payment_id, event))
+    return cursor.rowcount > 0
+
+
+def handle_yookassa_webhook(webhook_data: Dict[str, Any], cors_headers: Dict[str, str]) -> Dict[str, Any]:
+    '''Обработка webhook от YooKassa'''
+    try:
+        event_type = webhook_data.get('event', '')
+        payment_object = webhook_data.get('object', {})
+        
+        payment_id = payment_object.get('id', '')
+        payment_status = payment_object.get('status', '')
+        amount_data = payment_object.get('amount', {})
+        amount = float(amount_data.get('value', 0))
+        metadata = payment_object.get('metadata', {})
+        
+        username = metadata.get('username', '')
+        email = metadata.get('email', '')
+        plan_name = metadata.get('plan_name', '')
+        plan_days = int(metadata.get('plan_days', 0))
+        custom_plan_str = metadata.get('custom_plan', '')
+        plan_id_str = metadata.get('plan_id', '')
+        
+        custom_plan = None
+        if custom_plan_str:
+            try:
+                custom_plan = json.loads(custom_plan_str)
+            except:
+                pass
+        
+        plan_id = None
+        if plan_id_str:
+            try:
+                plan_id = int(plan_id_str)
+            except:
+                pass
+        
+        # Получаем email из receipt если не в metadata
+        if not email:
+            receipt = payment_object.get('receipt', {})
+            customer = receipt.get('customer', {})
+            email = customer.get('email', '')
+        
+        print(f'🔔 Webhook received: {event_type}')
+        print(f'📋 Payment ID: {payment_id}, Status: {payment_status}')
+        print(f'👤 Username: {username}, Email: {email}')
+        print(f'💰 Amount: {amount} RUB, Plan: {plan_name} ({plan_days} days), Plan ID: {plan_id}')
+        if custom_plan:
+            print(f'🎯 Custom plan: {custom_plan}')
+        
+        succeeded = event_type == 'payment.succeeded' or payment_status == 'succeeded'
+        queued = False
+        
+        # Отметка события, статус платежа и задача на выдачу подписки пишутся одной транзакцией,
+        # Remnawave, реферальный бонус и письмо обрабатывает provisioning-worker
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if not claim_event(cursor, payment_id, event_key(event_type, payment_status)):
+                cursor.close()
+                print(f'🔁 Duplicate webhook {event_type or payment_status} for {payment_id}, skipping')
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': json.dumps({'status': 'ok', 'duplicate': True}),
+                    'isBase64Encoded': False
+                }
+            
+            update_payment_status(cursor, payment_id, payment_status)
+            if succeeded and username:
+                queued = enqueue_job(cursor, JOB_PROVISION, payment_id, {
+                    'username': username,
+                    'email': email,
+                    'plan_days': plan_days,
+                    'plan_id': plan_id,
+                    'plan_name': plan_name,
+                    'custom_plan': custom_plan
+                })
+            cursor.close()
+        
+        if succeeded:
+            print(f'📬 Provisioning job for {payment_id}: {"queued" if queued else "already in outbox"}')
+        
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': json.dumps({'status': 'ok', 'queued': queued}),
+            'isBase64Encoded': False
+        }
+        
+    except Exception as e:
+        print(f'❌ Webhook error: {str(e)}')
+        return {
+            'statusCode': 500,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def update_payment_status(cursor: Any, payment_id: str, status: str):
+    '''Обновляет статус платежа в БД в транзакции webhook'''
+    cursor.execute("""
+        UPDATE payments 
+        SET status = %s, updated_at = NOW()
+        WHERE payment_id = %s
+        RETURNING username
+    """, (status, payment_id))
+    client_summary.refresh_clients(cursor, [row[0] for row in cursor.fetchall()])
+    print(f'💾 Payment status updated: {payment_id} -> {status}')
@@ -6,9 +6,10 @@ Returns: JSON с тарифными планами или ошибкой
 '''
 import json
 import os
-import psycopg
 from typing import Dict, Any, List
 
+from db import get_connection
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -46,19 +47,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Database connection not configured'})
         }
     
-    conn = psycopg.connect(dsn, autocommit=True)
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT plan_id, name, price, days, traffic_gb, features
-        FROM t_p66544974_beauty_website_proje.subscription_plans
-        WHERE is_active = true AND 'register' = ANY(show_on)
-        ORDER BY sort_order ASC
-    ''')
+        cursor.execute('''
+            SELECT plan_id, name, price, days, traffic_gb, features
+            FROM t_p66544974_beauty_website_proje.subscription_plans
+            WHERE is_active = true AND 'register' = ANY(show_on)
+            ORDER BY sort_order ASC
+        ''')
     
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
+        rows = cursor.fetchall()
+        cursor.close()
     
     plans: List[Dict[str, Any]] = []
     for row in rows:
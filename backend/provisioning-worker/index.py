@@ -0,0 +1,441 @@
+'''
+Business: Воркер очереди provisioning_outbox - создаёт/продлевает подписку в Remnawave,
+          активирует реферальный бонус и отправляет письмо после оплаты
+Args: event с httpMethod (вызов по расписанию или вручную), queryStringParameters.limit
+Returns: HTTP response со статистикой обработанных задач
+'''
+
+import json
+import os
+import time
+import http_client
+from typing import Dict, Any, Optional
+from datetime import datetime
+
+import catalog
+import remnawave_client
+import remnawave_governor
+import singleflight
+from db import get_connection
+from outbox import (JOB_PROVISION, JOB_REFERRAL, JOB_WELCOME_EMAIL, claim_jobs, complete_job, enqueue_job,
+                    retry_job, save_job_payload)
+from remnawave_client import RemnawaveError
+from remnawave_mirror import LookupUnavailable, find_user, record_user
+
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '5'))
+TIME_BUDGET_SECONDS = float(os.environ.get('OUTBOX_TIME_BUDGET_SECONDS', '25'))
+# Пауза перед активацией реферала, чтобы Remnawave успел заиндексировать нового пользователя
+REFERRAL_DELAY_SECONDS = 3
+ACTIVATE_REFERRAL_URL = os.environ.get('ACTIVATE_REFERRAL_URL', 'https://functions.poehali.dev/358b9593-075d-4262-9190-984599107ece')
+SEND_EMAIL_URL = os.environ.get('SEND_EMAIL_URL', 'https://functions.poehali.dev/b7df3121-2214-4658-b0d1-8af63a4ce471')
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    cors_headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type',
+        'Access-Control-Max-Age': '86400',
+        'Content-Type': 'application/json'
+    }
+    
+    method = event.get('httpMethod', 'POST')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    params = event.get('queryStringParameters') or {}
+    try:
+        limit = max(1, int(params.get('limit', BATCH_SIZE)))
+    except ValueError:
+        limit = BATCH_SIZE
+    
+    try:
+        stats = drain_outbox(limit)
+        print(f'📦 Outbox drained: {stats}')
+        print(f'🌐 HTTP connections: {http_client.stats()}')
+        print(f'🚦 Remnawave governor: {remnawave_governor.stats()}')
+        print(f'🔀 Remnawave singleflight: {singleflight.stats()}')
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': json.dumps({'status': 'ok', **stats}),
+            'isBase64Encoded': False
+        }
+    except Exception as e:
+        print(f'❌ Outbox worker error: {str(e)}')
+        return {
+            'statusCode': 500,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def drain_outbox(limit: int) -> Dict[str, int]:
+    '''Забирает задачи пачками, пока очередь не опустеет или не кончится бюджет времени'''
+    started = time.monotonic()
+    stats = {'done': 0, 'retried': 0, 'failed': 0, 'lost': 0}
+    
+    while time.monotonic() - started < TIME_BUDGET_SECONDS:
+        jobs = claim_jobs(limit)
+        if not jobs:
+            break
+        for job in jobs:
+            stats[run_job(job)] += 1
+    
+    return stats
+
+
+def run_job(job: Dict[str, Any]) -> str:
+    '''Выполняет одну задачу и сохраняет её статус'''
+    print(f'⚙️ Job #{job["id"]} {job["job_type"]} for {job["payment_id"]}, attempt {job["attempts"]}/{job["max_attempts"]}')
+    
+    job_handler = JOB_HANDLERS.get(job['job_type'])
+    try:
+        if not job_handler:
+            result = {'success': False, 'error': f'Unknown job type: {job["job_type"]}', 'permanent': True}
+        else:
+            result = job_handler(job['payment_id'], job['payload'])
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+    
+    if result.get('success'):
+        follow_up = result.pop('follow_up', [])
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            completed = complete_job(cursor, job, result)
+            if completed:
+                for job_type, payload, delay_seconds in follow_up:
+                    enqueue_job(cursor, job_type, job['payment_id'], payload, delay_seconds)
+            cursor.close()
+        if not completed:
+            print(f'⚠️ Job #{job["id"]} lease expired and the job was reclaimed, result not saved')
+            return 'lost'
+        print(f'✅ Job #{job["id"]} done')
+        return 'done'
+    
+    status = retry_job(job, str(result.get('error', 'unknown error')), give_up=result.get('permanent', False))
+    if status == 'lost':
+        print(f'⚠️ Job #{job["id"]} lease expired and the job was reclaimed, not rescheduling: {result.get("error")}')
+        return 'lost'
+    print(f'⚠️ Job #{job["id"]} {status}: {result.get("error")}')
+    return 'failed' if status == 'failed' else 'retried'
+
+
+def run_provision(payment_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Создаёт или продлевает пользователя и ставит реферал и письмо в очередь.
+    Итоговый срок считается один раз и сохраняется в payload задачи до обращения к Remnawave:
+    повтор после таймаута или падения воркера выставляет тот же expireAt, а не добавляет дни снова.
+    '''
+    username = payload.get('username', '')
+    email = payload.get('email', '')
+
+    target = payload.get('target')
+    if target:
+        print(f'♻️ Reusing saved target for {username}: expire={target["expire_timestamp"]}')
+    else:
+        target = plan_subscription(
+            username,
+            int(payload.get('plan_days', 0)),
+            payload.get('plan_id'),
+            payload.get('plan_name', ''),
+            payload.get('custom_plan')
+        )
+        if not target.get('success'):
+            return target
+        target.pop('success')
+        save_job_payload(JOB_PROVISION, payment_id, {**payload, 'target': target})
+
+    result = create_user_in_remnawave(username, target)
+    existing_user = result.pop('existing_user', None)
+    if existing_user:
+        # План считался для нового пользователя, а он уже есть: дни прибавляются к его живому сроку
+        target = replan_for_existing(existing_user, target)
+        save_job_payload(JOB_PROVISION, payment_id, {**payload, 'target': target})
+        result = create_user_in_remnawave(username, target)
+    if not result.get('success'):
+        return result
+
+    subscription_url = result.get('subscription_url', '')
+    print(f'✅ User created in Remnawave: {subscription_url}')
+
+    return {
+        'success': True,
+        'subscription_url': subscription_url,
+        'follow_up': [
+            (JOB_REFERRAL, {'username': username}, REFERRAL_DELAY_SECONDS),
+            (JOB_WELCOME_EMAIL, {'email': email, 'username': username, 'subscription_url': subscription_url}, 0)
+        ]
+    }
+
+
+def plan_subscription(username: str, plan_days: int, plan_id: Optional[int] = None, plan_name: str = '', custom_plan: Any = None) -> Dict[str, Any]:
+    '''Считает итоговый срок, squads и лимит трафика по текущему состоянию пользователя'''
+    remnawave_api_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
+    remnawave_token = os.environ.get('REMNAWAVE_API_TOKEN', '')
+
+    # Проверяем, существует ли пользователь
+    user_uuid = None
+    current_expire_timestamp = None
+
+    try:
+        # Свежая запись зеркала remnawave_users или живой ответ Remnawave - не устаревшая копия
+        user_data = find_user(username=username, api_url=remnawave_api_url, token=remnawave_token, strict=True)
+    except LookupUnavailable as e:
+        # Без точного текущего срока план не сохраняем - иначе продление посчитается от сейчас
+        print(f'⚠️ Could not check user existence: {str(e)}')
+        return {'success': False, 'error': f'Could not check user existence: {str(e)}'}
+    print(f'🔍 Found user: {user_data is not None}')
+    if user_data and user_data.get('uuid'):
+        user_uuid = user_data.get('uuid')
+        expire_at_str = user_data.get('expireAt', '')
+        if expire_at_str:
+            expire_dt = datetime.fromisoformat(expire_at_str.replace('Z', '+00:00'))
+            current_expire_timestamp = int(expire_dt.timestamp())
+        print(f'👤 User exists: uuid={user_uuid}, current_expire={current_expire_timestamp}')
+
+    # Вычисляем новый timestamp окончания подписки
+    now_ts = int(datetime.now().timestamp())
+    if user_uuid and current_expire_timestamp:
+        # Продлеваем от текущей даты окончания (или от сейчас, если срок истёк)
+        base_ts = max(current_expire_timestamp, now_ts)
+        expire_timestamp = base_ts + (plan_days * 86400)
+        print(f'📅 Extending subscription: +{plan_days} days from {base_ts} to {expire_timestamp}')
+    else:
+        # Новый пользователь - считаем от сейчас
+        expire_timestamp = now_ts + (plan_days * 86400)
+        print(f'📅 New subscription: {plan_days} days, expire={expire_timestamp}')
+
+    # Получаем traffic_gb и squad_uuid из custom_plan ИЛИ из тарифа
+    squad_uuids = []
+    traffic_gb = 30  # дефолтное значение
+
+    if custom_plan and isinstance(custom_plan, dict):
+        # Кастомный тариф - берём squad из локаций и traffic из плана
+        traffic_gb = custom_plan.get('traffic_gb', 30)
+        print(f'📊 Custom plan traffic: {traffic_gb} GB')
+
+        locations_data = custom_plan.get('locations', [])
+        if locations_data:
+            location_ids = [loc.get('location_id') for loc in locations_data if loc.get('location_id')]
+            if location_ids:
+                squad_uuids = catalog.location_squads(location_ids)
+                print(f'🎯 Custom plan squads from locations: {squad_uuids}')
+    else:
+        # Обычный тариф - берём squad_uuids и traffic_gb из каталога тарифов
+        if plan_id:
+            # Если есть plan_id - используем его (точное совпадение)
+            plan = catalog.get_plan(plan_id)
+            print(f'🎯 Looking up plan by plan_id: {plan_id}')
+        else:
+            # Fallback: ищем по name и days (может быть неточным!)
+            plan = catalog.find_plan(plan_name, plan_days)
+            print(f'⚠️ Looking up plan by name/days (fallback): {plan_name}, {plan_days}')
+
+        if plan:
+            if plan['squad_uuids']:
+                squad_uuids = plan['squad_uuids']
+                print(f'🎯 Regular plan squads from plans table: {squad_uuids}')
+            if plan['traffic_gb']:
+                traffic_gb = plan['traffic_gb']
+                print(f'📊 Regular plan traffic: {traffic_gb} GB')
+
+    # Переводим GB в байты
+    data_limit = traffic_gb * 1024 * 1024 * 1024
+    print(f'📊 Final traffic limit: {traffic_gb} GB = {data_limit} bytes')
+
+    # Если нет custom_plan, используем дефолтный squad
+    if not squad_uuids:
+        squad_uuids = ['e742f30b-82fb-431a-918b-1b4d22d6ba4d']
+
+    return {
+        'success': True,
+        'user_uuid': user_uuid,
+        'plan_days': plan_days,
+        'expire_timestamp': expire_timestamp,
+        'squad_uuids': squad_uuids,
+        'data_limit': data_limit
+    }
+
+
+def create_user_in_remnawave(username: str, target: Dict[str, Any]) -> Dict[str, Any]:
+    '''Создаёт или продлевает пользователя в Remnawave до сохранённого target (абсолютный expireAt)'''
+    expire_timestamp = target['expire_timestamp']
+    squad_uuids = target['squad_uuids']
+    user_uuid = target.get('user_uuid')
+    try:
+        # Пользователь существовал на момент расчёта - продлеваем
+        if user_uuid:
+            print(f'🔄 Extending user subscription: {username}, squads: {squad_uuids}')
+            user = remnawave_client.extend_subscription(
+                username, user_uuid, expire_timestamp, squad_uuids, data_limit=target['data_limit']
+            )
+            subscription_url = user.get('subscriptionUrl', '')
+            print('✅ User subscription extended successfully')
+            # Продление идёт PATCH'ем с тем же UUID; новый UUID только если пользователя пришлось пересоздать
+            if user.get('uuid') and user.get('uuid') != user_uuid:
+                save_user_uuid(username, user['uuid'])
+            return {'success': True, 'subscription_url': subscription_url}
+
+        # Новый пользователь - создаём
+        print(f'🔹 Creating user in Remnawave: {username} with squads: {squad_uuids}')
+        try:
+            user = remnawave_client.create_user(
+                username,
+                expire_timestamp,
+                data_limit=target['data_limit'],
+                internal_squads=squad_uuids,
+                proxies={'vless-reality': {}},
+                data_limit_reset_strategy='day'
+            )
+        except RemnawaveError as e:
+            if not user_already_exists(e):
+                raise
+            # Прошлая попытка успела создать пользователя, но ответ потерялся
+            user = remnawave_client.get_user_by_username(username)
+            if not user or not user.get('uuid'):
+                raise
+            if not has_expire(user, expire_timestamp):
+                # Пользователь создан не нами: срок из плана для нового затёр бы его оставшиеся дни
+                print(f'⚠️ User {username} already exists ({user["uuid"]}) with expireAt {user.get("expireAt")}, replanning')
+                return {'success': False, 'error': f'User {username} already exists', 'existing_user': user}
+            # Прошлая попытка успела создать пользователя с этим target, но ответ потерялся
+            print(f'♻️ User {username} was created by a previous attempt ({user["uuid"]})')
+            record_user(user)
+        subscription_url = user.get('subscriptionUrl', '')
+        user_uuid = user.get('uuid', '')
+
+        print(f'✅ User created: {subscription_url}, UUID: {user_uuid}')
+        print(f'✅ User squads were set during creation: {squad_uuids}')
+
+        # Save UUID to database for referral system
+        if user_uuid:
+            save_user_uuid(username, user_uuid)
+
+        return {'success': True, 'subscription_url': subscription_url}
+
+    except RemnawaveError as e:
+        print(f'❌ Remnawave error: {e.status_code} - {e.details}')
+        # 4xx (кроме 429) не исправится повтором
+        return {'success': False, 'error': e.details or str(e), 'permanent': 400 <= e.status_code < 500 and e.status_code != 429}
+    except Exception as e:
+        print(f'❌ Error creating user in Remnawave: {str(e)}')
+        return {'success': False, 'error': str(e)}
+
+
+def has_expire(user: Dict[str, Any], expire_timestamp: int) -> bool:
+    '''expireAt пользователя совпадает с тем, что отправлялся для expire_timestamp'''
+    live = remnawave_client.parse_timestamp(user.get('expireAt'))
+    sent = remnawave_client.parse_timestamp(remnawave_client.expire_at_from_timestamp(expire_timestamp))
+    return live is not None and abs((live - sent).total_seconds()) < 1
+
+
+def replan_for_existing(user: Dict[str, Any], target: Dict[str, Any]) -> Dict[str, Any]:
+    '''Target для пользователя, который уже есть в Remnawave: +plan_days от его живого expireAt (или от сейчас)'''
+    now_ts = int(datetime.now().timestamp())
+    live_expire = remnawave_client.parse_timestamp(user.get('expireAt'))
+    base_ts = max(int(live_expire.timestamp()) if live_expire else 0, now_ts)
+    expire_timestamp = base_ts + target['plan_days'] * 86400
+    print(f'📅 Replanned for existing user: +{target["plan_days"]} days from {base_ts} to {expire_timestamp}')
+    return {**target, 'user_uuid': user['uuid'], 'expire_timestamp': expire_timestamp}
+
+
+def user_already_exists(error: RemnawaveError) -> bool:
+    '''POST /api/users отказал из-за занятого username'''
+    return error.status_code in (400, 409) and 'already exists' in (error.details or '').lower()
+
+
+def save_user_uuid(username: str, user_uuid: str):
+    '''UUID пользователя Remnawave для реферальной системы (user_uuids)'''
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO user_uuids (username, remnawave_uuid, created_at)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (username, remnawave_uuid) DO NOTHING
+            """, (username, user_uuid))
+            cur.close()
+        print(f'💾 UUID saved to DB: {user_uuid}')
+    except Exception as e:
+        print(f'⚠️ Failed to save UUID: {str(e)}')
+
+
+def activate_referral(payment_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    '''Активирует реферальный бонус после успешной оплаты'''
+    username = payload.get('username', '')
+    
+    # Получаем реферальный код из платежа
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT referral_code FROM payments WHERE payment_id = %s", (payment_id,))
+        result = cur.fetchone()
+        cur.close()
+    
+    if not result or not result[0]:
+        return {'success': True, 'skipped': 'no referral code'}
+    
+    referral_code = result[0]
+    print(f'🎁 Found referral code: {referral_code} for user {username}')
+    
+    # Вызываем функцию активации реферала
+    response = http_client.post(
+        ACTIVATE_REFERRAL_URL,
+        headers={'Content-Type': 'application/json'},
+        json={
+            'username': username,
+            'referral_code': referral_code
+        },
+        timeout=15
+    )
+    
+    if response.status_code == 200:
+        print(f'✅ Referral activated for {username}')
+        return {'success': True, 'referral_code': referral_code}
+    
+    return {
+        'success': False,
+        'error': f'Failed to activate referral: {response.status_code} - {response.text}',
+        'permanent': response.status_code < 500
+    }
+
+
+def send_welcome_email(payment_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    '''Отправляет приветственное email с инструкциями'''
+    email = payload.get('email', '')
+    if not email:
+        return {'success': True, 'skipped': 'no email'}
+    
+    response = http_client.post(
+        SEND_EMAIL_URL,
+        headers={'Content-Type': 'application/json'},
+        json={
+            'email': email,
+            'subscription_url': payload.get('subscription_url', ''),
+            'username': payload.get('username', '')
+        },
+        timeout=10
+    )
+    
+    if response.status_code == 200:
+        print(f'📧 Email sent to {email}')
+        return {'success': True}
+    
+    return {
+        'success': False,
+        'error': f'Failed to send email: {response.status_code} - {response.text}',
+        'permanent': response.status_code < 500
+    }
+
+
+JOB_HANDLERS = {
+    JOB_PROVISION: run_provision,
+    JOB_REFERRAL: activate_referral,
+    JOB_WELCOME_EMAIL: send_welcome_email
+}
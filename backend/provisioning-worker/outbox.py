@@ -0,0 +1,133 @@
+'''
+Business: Очередь задач выдачи подписки (таблица provisioning_outbox)
+Args: курсор открытой транзакции для постановки задач, DATABASE_URL для воркера
+Returns: enqueue_job() для webhook, claim_jobs()/save_job_payload()/complete_job()/retry_job() для воркера
+'''
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from db import get_connection
+
+JOB_PROVISION = 'provision'
+JOB_REFERRAL = 'referral'
+JOB_WELCOME_EMAIL = 'welcome_email'
+
+LOCK_SECONDS = int(os.environ.get('OUTBOX_LOCK_SECONDS', '120'))
+BACKOFF_BASE_SECONDS = int(os.environ.get('OUTBOX_BACKOFF_BASE_SECONDS', '10'))
+BACKOFF_MAX_SECONDS = int(os.environ.get('OUTBOX_BACKOFF_MAX_SECONDS', '1800'))
+
+
+def enqueue_job(cursor: Any, job_type: str, payment_id: str, payload: Dict[str, Any], delay_seconds: int = 0) -> bool:
+    '''
+    Ставит задачу в очередь в транзакции вызывающего кода.
+    Повторный webhook по тому же платежу не создаёт дубль (UNIQUE payment_id + job_type).
+    '''
+    cursor.execute("""
+        INSERT INTO provisioning_outbox (job_type, payment_id, payload, next_attempt_at)
+        VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+        ON CONFLICT (payment_id, job_type) DO NOTHING
+    """, (job_type, payment_id, json.dumps(payload), delay_seconds))
+    return cursor.rowcount > 0
+
+
+def claim_jobs(limit: int) -> List[Dict[str, Any]]:
+    '''
+    Забирает готовые к выполнению задачи и блокирует их на LOCK_SECONDS.
+    Задачи упавшего воркера возвращаются в работу после истечения блокировки,
+    а исчерпавшие попытки - помечаются failed, а не берутся снова.
+    '''
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE provisioning_outbox
+            SET status = 'failed', locked_until = NULL, updated_at = NOW(),
+                last_error = COALESCE(last_error, 'Lock expired on the last attempt')
+            WHERE status = 'processing' AND locked_until < NOW() AND attempts >= max_attempts
+        """)
+        cursor.execute("""
+            UPDATE provisioning_outbox
+            SET status = 'processing',
+                attempts = attempts + 1,
+                locked_until = NOW() + make_interval(secs => %s),
+                updated_at = NOW()
+            WHERE id IN (
+                SELECT id FROM provisioning_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= NOW())
+                   OR (status = 'processing' AND locked_until < NOW() AND attempts < max_attempts)
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, job_type, payment_id, payload, attempts, max_attempts
+        """, (LOCK_SECONDS, limit))
+        rows = cursor.fetchall()
+        cursor.close()
+
+    return [
+        {
+            'id': row[0],
+            'job_type': row[1],
+            'payment_id': row[2],
+            'payload': row[3] if isinstance(row[3], dict) else json.loads(row[3] or '{}'),
+            'attempts': row[4],
+            'max_attempts': row[5]
+        }
+        for row in rows
+    ]
+
+
+def save_job_payload(job_type: str, payment_id: str, payload: Dict[str, Any]):
+    '''
+    Сохраняет payload задачи отдельной транзакцией - до обращения к внешнему API,
+    чтобы повтор после сбоя выполнил то же самое, а не посчитал заново
+    '''
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE provisioning_outbox
+            SET payload = %s, updated_at = NOW()
+            WHERE payment_id = %s AND job_type = %s
+        """, (json.dumps(payload), payment_id, job_type))
+        cursor.close()
+
+
+def complete_job(cursor: Any, job: Dict[str, Any], result: Optional[Dict[str, Any]] = None) -> bool:
+    '''
+    Отмечает задачу выполненной. False - блокировка истекла и задачу уже забрал другой воркер
+    (attempts сменился): его результат не перезаписываем.
+    '''
+    cursor.execute("""
+        UPDATE provisioning_outbox
+        SET status = 'done', result = %s, last_error = NULL,
+            locked_until = NULL, completed_at = NOW(), updated_at = NOW()
+        WHERE id = %s AND status = 'processing' AND attempts = %s
+    """, (json.dumps(result or {}), job['id'], job['attempts']))
+    return cursor.rowcount > 0
+
+
+def retry_job(job: Dict[str, Any], error: str, give_up: bool = False) -> str:
+    '''
+    Возвращает задачу в очередь с экспоненциальной задержкой или помечает failed.
+    'lost' - блокировка истекла и задачу уже забрал другой воркер, статус не меняется.
+    '''
+    if give_up or job['attempts'] >= job['max_attempts']:
+        status = 'failed'
+        delay = 0
+    else:
+        status = 'pending'
+        delay = min(BACKOFF_BASE_SECONDS * (2 ** (job['attempts'] - 1)), BACKOFF_MAX_SECONDS)
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE provisioning_outbox
+            SET status = %s, last_error = %s, locked_until = NULL,
+                next_attempt_at = NOW() + make_interval(secs => %s), updated_at = NOW()
+            WHERE id = %s AND status = 'processing' AND attempts = %s
+        """, (status, error[:2000], delay, job['id'], job['attempts']))
+        updated = cursor.rowcount > 0
+        cursor.close()
+
+    return status if updated else 'lost'
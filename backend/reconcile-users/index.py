@@ -0,0 +1,446 @@
+'''
+Business: Сверка оплат с Remnawave: оплатившие без пользователя в панели, пользователи панели без оплат,
+          expireAt, не совпадающий с историей оплат; по запросу - исправление расхождений
+Args: event с httpMethod: POST - сверка (X-Admin-Password), body {repair, categories, source: api|mirror},
+      исправления выполняются только по source=api; GET - отчёт последней сверки
+Returns: HTTP response с числом расхождений по категориям, примерами и результатом исправлений
+'''
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Iterator, List, Optional
+
+from psycopg2.extras import Json, execute_values
+
+import remnawave_client
+import remnawave_governor
+from db import get_connection
+from remnawave_client import RemnawaveError, SortingUnsupported
+from remnawave_mirror import upsert_users
+
+# Массовая задача: уступает живым запросам (оплата, личный кабинет) в очереди к Remnawave
+remnawave_governor.set_default_lane(remnawave_governor.LANE_BULK)
+
+STREAM_BATCH_SIZE = int(os.environ.get('RECONCILE_STREAM_BATCH_SIZE', '2000'))
+EXPIRE_TOLERANCE_HOURS = float(os.environ.get('RECONCILE_EXPIRE_TOLERANCE_HOURS', '24'))
+SAMPLE_LIMIT = int(os.environ.get('RECONCILE_SAMPLE_LIMIT', '50'))
+REPAIR_LIMIT = int(os.environ.get('RECONCILE_REPAIR_LIMIT', '100'))
+REPAIR_BATCH_SIZE = 20
+WORKERS = int(os.environ.get('RECONCILE_WORKERS', '8'))
+RECONCILE_LOCK_KEY = 'reconcile-users'
+
+# Активная оплаченная подписка, которой нет в панели
+MISSING_IN_PANEL = 'missing_in_panel'
+# Оплаты были, но срок давно истёк и пользователя в панели нет - ожидаемо, только счётчик
+EXPIRED_NOT_IN_PANEL = 'expired_not_in_panel'
+# Пользователь панели без единой успешной оплаты (рефералы, ручные, тестовые)
+UNPAID_IN_PANEL = 'unpaid_in_panel'
+# expireAt в панели раньше оплаченного - клиент недополучил дни
+EXPIRE_BEHIND = 'expire_behind'
+# expireAt позже оплаченного (бонусы, ручные продления) - только счётчик и примеры
+EXPIRE_AHEAD = 'expire_ahead'
+CATEGORIES = (MISSING_IN_PANEL, EXPIRED_NOT_IN_PANEL, UNPAID_IN_PANEL, EXPIRE_BEHIND, EXPIRE_AHEAD)
+REPAIRABLE = (MISSING_IN_PANEL, EXPIRE_BEHIND)
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method = event.get('httpMethod', 'POST')
+
+    cors_headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Password',
+        'Access-Control-Max-Age': '86400',
+        'Content-Type': 'application/json'
+    }
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    headers = event.get('headers') or {}
+    admin_password = headers.get('x-admin-password') or headers.get('X-Admin-Password')
+    if admin_password != os.environ.get('ADMIN_PASSWORD', 'admin123'):
+        return {
+            'statusCode': 401,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        if method == 'GET':
+            report = last_report()
+            return {
+                'statusCode': 200 if report else 404,
+                'headers': cors_headers,
+                'body': json.dumps(report or {'error': 'No reconciliation runs yet'}),
+                'isBase64Encoded': False
+            }
+
+        try:
+            body_data = json.loads(event.get('body') or '{}')
+        except json.JSONDecodeError:
+            body_data = {}
+
+        categories = body_data.get('categories') or list(REPAIRABLE)
+        unknown = [c for c in categories if c not in REPAIRABLE]
+        if unknown:
+            return {
+                'statusCode': 400,
+                'headers': cors_headers,
+                'body': json.dumps({'error': f'Only {", ".join(REPAIRABLE)} can be repaired, got {unknown}'}),
+                'isBase64Encoded': False
+            }
+
+        result = reconcile(
+            repair=body_data.get('repair') is True,
+            repair_categories=categories,
+            source=body_data.get('source', 'api')
+        )
+        return {
+            'statusCode': 409 if result.get('skipped') else 200,
+            'headers': cors_headers,
+            'body': json.dumps(result),
+            'isBase64Encoded': False
+        }
+    except RemnawaveError as e:
+        print(f'❌ Remnawave error during reconciliation: {e.status_code} {e.details}')
+        return {
+            'statusCode': 502,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e), 'details': e.details}),
+            'isBase64Encoded': False
+        }
+    except Exception as e:
+        print(f'❌ Reconciliation error: {str(e)}')
+        return {
+            'statusCode': 500,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    '''TIMESTAMP из БД хранится в UTC без часового пояса'''
+    if value is None or value.tzinfo:
+        return value
+    return value.replace(tzinfo=timezone.utc)
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z') if value else None
+
+
+def paid_users(conn: Any) -> Iterator[Dict[str, Any]]:
+    '''
+    Оплатившие клиенты по возрастанию username. Серверный курсор отдаёт успешные оплаты
+    порциями по STREAM_BATCH_SIZE; expected_expire сворачивается так же, как продлевает
+    provisioning-worker: от max(текущий срок, время оплаты) плюс plan_days.
+    '''
+    cursor = conn.cursor(name='reconcile_payments')
+    cursor.itersize = STREAM_BATCH_SIZE
+    cursor.execute("""
+        SELECT username, email, plan_days, created_at
+        FROM payments
+        WHERE status = 'succeeded'
+        ORDER BY username COLLATE "C", created_at, id
+    """)
+
+    current: Optional[Dict[str, Any]] = None
+    for username, email, plan_days, created_at in cursor:
+        if current is None or current['username'] != username:
+            if current is not None:
+                yield current
+            current = {'username': username, 'email': email, 'payments': 0, 'expected_expire': None}
+        paid_at = _utc(created_at)
+        base = max(current['expected_expire'] or paid_at, paid_at)
+        current['expected_expire'] = base + timedelta(days=plan_days or 0)
+        current['payments'] += 1
+        current['email'] = email or current['email']
+    if current is not None:
+        yield current
+    cursor.close()
+
+
+def mirror_users(conn: Any) -> Iterator[Dict[str, Any]]:
+    '''Запасной источник: зеркало remnawave_users, если Remnawave не умеет сортировать по username'''
+    cursor = conn.cursor(name='reconcile_mirror')
+    cursor.itersize = STREAM_BATCH_SIZE
+    cursor.execute("""
+        SELECT DISTINCT ON (username COLLATE "C") uuid, username, expire_at
+        FROM remnawave_users
+        WHERE deleted_at IS NULL
+        ORDER BY username COLLATE "C", created_at DESC NULLS LAST
+    """)
+    for user_uuid, username, expire_at in cursor:
+        yield {'uuid': user_uuid, 'username': username, 'expireAt': _iso(_utc(expire_at))}
+    cursor.close()
+
+
+def merge_join(paid: Iterator[Dict[str, Any]], panel: Iterator[Dict[str, Any]]) -> Iterator[tuple]:
+    '''Пары (оплаты, пользователь панели) по username; с одной стороны может быть None'''
+    left = next(paid, None)
+    right = next(panel, None)
+    while left is not None or right is not None:
+        if right is None or (left is not None and left['username'] < right['username']):
+            yield left, None
+            left = next(paid, None)
+        elif left is None or right['username'] < left['username']:
+            yield None, right
+            right = next(panel, None)
+        else:
+            yield left, right
+            left = next(paid, None)
+            right = next(panel, None)
+
+
+def classify(paid: Optional[Dict[str, Any]], user: Optional[Dict[str, Any]], now: datetime) -> Optional[str]:
+    if user is None:
+        return MISSING_IN_PANEL if paid['expected_expire'] > now else EXPIRED_NOT_IN_PANEL
+    if paid is None:
+        return UNPAID_IN_PANEL
+
+    panel_expire = remnawave_client.parse_timestamp(user.get('expireAt'))
+    tolerance = timedelta(hours=EXPIRE_TOLERANCE_HOURS)
+    # Отставание считаем только для ещё не истёкшей оплаты: старый срок в прошлом никому не мешает
+    if paid['expected_expire'] > now and (panel_expire is None or panel_expire < paid['expected_expire'] - tolerance):
+        return EXPIRE_BEHIND
+    if panel_expire is not None and panel_expire > paid['expected_expire'] + tolerance:
+        return EXPIRE_AHEAD
+    return None
+
+
+def reconcile(repair: bool, repair_categories: List[str], source: str) -> Dict[str, Any]:
+    '''
+    Слияние двух отсортированных по username потоков: оплаты из БД и пользователи Remnawave.
+    В памяти только текущая пара, счётчики, примеры (SAMPLE_LIMIT на категорию) и пачка исправлений.
+    '''
+    started = time.monotonic()
+    now = datetime.now(timezone.utc)
+    counts = {category: 0 for category in CATEGORIES}
+    samples: Dict[str, List[Dict[str, Any]]] = {category: [] for category in CATEGORIES}
+    stats = {'paid_users': 0, 'panel_users': 0, 'in_sync': 0}
+    repairs = {'repaired': 0, 'failed': 0, 'errors': []}
+    pending: List[tuple] = []
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Два одновременных исправления создали бы одного пользователя дважды
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (RECONCILE_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            cursor.close()
+            return {'success': False, 'skipped': True, 'error': 'Reconciliation is already running'}
+
+        try:
+            cursor.execute(
+                "INSERT INTO reconcile_runs (panel_source, repair) VALUES (%s, %s) RETURNING id",
+                (source, repair)
+            )
+            run_id = cursor.fetchone()[0]
+            conn.commit()
+
+            try:
+                if source == 'mirror':
+                    pairs = _run_merge(conn, mirror_users(conn), now, counts, samples, stats, pending)
+                else:
+                    try:
+                        pairs = _run_merge(conn, remnawave_client.iter_users_by_username(), now,
+                                           counts, samples, stats, pending, repair, repair_categories, repairs)
+                    except SortingUnsupported as e:
+                        # Уже выполненные исправления безопасны: отставание считается только по совпавшим парам,
+                        # а ошибочно "отсутствующего" Remnawave не создаст повторно (username уникален)
+                        print(f'⚠️ {str(e)}, reconciling against the remnawave_users mirror')
+                        conn.rollback()
+                        source = 'mirror'
+                        for category in CATEGORIES:
+                            counts[category] = 0
+                            samples[category] = []
+                        stats.update(paid_users=0, panel_users=0, in_sync=0)
+                        pending.clear()
+                        pairs = _run_merge(conn, mirror_users(conn), now, counts, samples, stats, pending)
+
+                if repair:
+                    _flush_repairs(pending, repairs)
+            except Exception as e:
+                conn.rollback()
+                cursor.execute(
+                    "UPDATE reconcile_runs SET finished_at = NOW(), error = %s WHERE id = %s",
+                    (str(e)[:1000], run_id)
+                )
+                conn.commit()
+                raise
+
+            cursor.execute("""
+                UPDATE reconcile_runs
+                SET finished_at = NOW(), panel_source = %s, paid_users = %s, panel_users = %s,
+                    counts = %s, samples = %s, repaired = %s, repair_failed = %s
+                WHERE id = %s
+            """, (source, stats['paid_users'], stats['panel_users'], Json(counts), Json(samples),
+                  repairs['repaired'], repairs['failed'], run_id))
+            conn.commit()
+        finally:
+            # Lock сессионный: снимаем явно, иначе он останется на подключении в пуле
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (RECONCILE_LOCK_KEY,))
+            cursor.close()
+
+    duration_ms = round((time.monotonic() - started) * 1000)
+    print(f'🔎 Reconciliation {run_id} ({source}): {pairs} usernames, {counts}, '
+          f'repaired {repairs["repaired"]}, failed {repairs["failed"]} in {duration_ms}ms')
+    return {
+        'success': True,
+        'run_id': run_id,
+        'source': source,
+        **stats,
+        'counts': counts,
+        'samples': samples,
+        'repair': repair,
+        'repaired': repairs['repaired'],
+        'repair_failed': repairs['failed'],
+        'repair_errors': repairs['errors'][:SAMPLE_LIMIT],
+        'repair_limit_reached': repair and repairs['repaired'] + repairs['failed'] >= REPAIR_LIMIT,
+        'duration_ms': duration_ms
+    }
+
+
+def _run_merge(conn: Any, panel: Iterator[Dict[str, Any]], now: datetime, counts: Dict[str, int],
+               samples: Dict[str, List[Dict[str, Any]]], stats: Dict[str, int], pending: List[tuple],
+               repair: bool = False, repair_categories: Optional[List[str]] = None,
+               repairs: Optional[Dict[str, Any]] = None) -> int:
+    '''
+    Один проход слияния. Исправления копятся пачками по REPAIR_BATCH_SIZE и выполняются по ходу,
+    но только для источника api: решения по устаревшему зеркалу не исполняются.
+    '''
+    pairs = 0
+    for paid, user in merge_join(paid_users(conn), panel):
+        pairs += 1
+        if paid is not None:
+            stats['paid_users'] += 1
+        if user is not None:
+            stats['panel_users'] += 1
+
+        category = classify(paid, user, now)
+        if category is None:
+            stats['in_sync'] += 1
+            continue
+
+        counts[category] += 1
+        if len(samples[category]) < SAMPLE_LIMIT:
+            samples[category].append({
+                'username': (paid or user)['username'],
+                'uuid': user.get('uuid') if user else None,
+                'panel_expire': user.get('expireAt') if user else None,
+                'expected_expire': _iso(paid['expected_expire']) if paid else None,
+                'payments': paid['payments'] if paid else 0
+            })
+
+        if repair and category in (repair_categories or []):
+            if repairs['repaired'] + repairs['failed'] + len(pending) < REPAIR_LIMIT:
+                pending.append((category, paid, user))
+            if len(pending) >= REPAIR_BATCH_SIZE:
+                _flush_repairs(pending, repairs)
+    return pairs
+
+
+def _repair_one(item: tuple) -> Dict[str, Any]:
+    category, paid, user = item
+    username = paid['username']
+    expire_ts = int(paid['expected_expire'].timestamp())
+    try:
+        if category == MISSING_IN_PANEL:
+            # Те же параметры, что у restore-users
+            created = remnawave_client.create_user(
+                username,
+                expire_ts,
+                data_limit=remnawave_client.DEFAULT_TRAFFIC_LIMIT_BYTES,
+                internal_squads=[remnawave_client.DEFAULT_SQUAD_UUID],
+                proxies={'vless-reality': {}},
+                data_limit_reset_strategy='day'
+            )
+            return {'username': username, 'action': 'created', 'uuid': created.get('uuid')}
+
+        updated = remnawave_client.patch_user(user['uuid'], {
+            'expireAt': remnawave_client.expire_at_from_timestamp(expire_ts),
+            'status': 'ACTIVE'
+        })
+        return {'username': username, 'action': 'extended', 'uuid': user['uuid'], 'user': updated}
+    except Exception as e:
+        details = e.details if isinstance(e, RemnawaveError) else ''
+        return {'username': username, 'action': 'failed', 'error': details or str(e)}
+
+
+def _flush_repairs(pending: List[tuple], repairs: Dict[str, Any]):
+    '''Пачка исправлений через пул; UUID созданных и обновлённые записи зеркала - по запросу на пачку'''
+    if not pending:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(WORKERS, len(pending)))) as pool:
+        results = list(pool.map(_repair_one, pending))
+    pending.clear()
+
+    for result in results:
+        if result['action'] == 'failed':
+            repairs['failed'] += 1
+            repairs['errors'].append({'username': result['username'], 'error': result['error']})
+            print(f'❌ Repair failed for {result["username"]}: {result["error"]}')
+        else:
+            repairs['repaired'] += 1
+            print(f'🛠️ {result["username"]}: {result["action"]}')
+
+    uuid_rows = [(r['username'], r['uuid']) for r in results if r['action'] == 'created' and r.get('uuid')]
+    extended = [r['user'] for r in results if r['action'] == 'extended' and r.get('user')]
+    if not uuid_rows and not extended:
+        return
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if uuid_rows:
+                execute_values(cursor, """
+                    INSERT INTO user_uuids (username, remnawave_uuid, created_at)
+                    VALUES %s
+                    ON CONFLICT (username, remnawave_uuid) DO UPDATE
+                    SET created_at = NOW()
+                """, uuid_rows, template='(%s, %s, NOW())')
+            if extended:
+                upsert_users(cursor, extended)
+            cursor.close()
+    except Exception as e:
+        print(f'⚠️ Failed to save repaired users: {str(e)}')
+
+
+def last_report() -> Optional[Dict[str, Any]]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, started_at, finished_at, panel_source, repair, paid_users, panel_users,
+                   counts, samples, repaired, repair_failed, error
+            FROM reconcile_runs
+            ORDER BY started_at DESC
+            LIMIT 1
+        """)
+        row = cursor.fetchone()
+        cursor.close()
+
+    if not row:
+        return None
+    return {
+        'run_id': row[0],
+        'started_at': row[1].isoformat() if row[1] else None,
+        'finished_at': row[2].isoformat() if row[2] else None,
+        'source': row[3],
+        'repair': row[4],
+        'paid_users': row[5],
+        'panel_users': row[6],
+        'counts': row[7],
+        'samples': row[8],
+        'repaired': row[9],
+        'repair_failed': row[10],
+        'error': row[11]
+    }
@@ -7,9 +7,10 @@ Returns: HTTP response dict with list of usernames or sends email
 
 import json
 import os
-import psycopg2
 from typing import Dict, Any, List
-import requests
+import http_client
+
+from db import get_connection
 
 def get_client_ip(event: Dict[str, Any]) -> str:
     '''Извлекает IP клиента из события'''
@@ -87,7 +88,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     auth_check_url = os.environ.get('AUTH_CHECK_URL', 'https://functions.poehali.dev/833bc0dd-ad44-4b38-b1ac-2ff2f5b265e5')
     
-    check_response = requests.post(
+    check_response = http_client.post(
         auth_check_url,
         json={'action': 'check', 'login_type': 'restore'},
         timeout=5
@@ -106,26 +107,25 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(db_url)
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    safe_email = email.replace("'", "''")
-    cursor.execute(f"""
-        SELECT DISTINCT username, created_at
-        FROM t_p66544974_beauty_website_proje.payments 
-        WHERE LOWER(email) = '{safe_email}'
-        AND status = 'succeeded'
-        ORDER BY created_at DESC
-    """)
+        safe_email = email.replace("'", "''")
+        cursor.execute(f"""
+            SELECT DISTINCT username, created_at
+            FROM t_p66544974_beauty_website_proje.payments 
+            WHERE LOWER(email) = '{safe_email}'
+            AND status = 'succeeded'
+            ORDER BY created_at DESC
+        """)
     
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
+        rows = cursor.fetchall()
+        cursor.close()
     
     if not rows:
         print(f'❌ [Restore Access] No purchases found for {email} - recording failed attempt')
         
-        requests.post(
+        http_client.post(
             auth_check_url,
             json={
                 'action': 'record',
@@ -150,7 +150,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     print(f'✅ [Restore Access] Found {len(usernames)} usernames for email {email}')
     
-    requests.post(
+    http_client.post(
         auth_check_url,
         json={
             'action': 'record',
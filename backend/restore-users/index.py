@@ -1,16 +1,32 @@
 '''
 Business: Восстановление удаленных пользователей в Remnawave из базы данных
-Args: event с httpMethod POST, опционально username для восстановления одного пользователя
-Returns: Результат восстановления пользователей
+Args: event с httpMethod POST, опционально username для восстановления одного пользователя,
+      custom_days, restart - начать новое задание вместо продолжения прерванного
+Returns: Результат восстановления пользователей (status running - вызвать ещё раз для продолжения)
 '''
 
 import json
 import os
-import psycopg2
-import requests
-from typing import Dict, Any, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+from psycopg2.extras import execute_values
+
+import remnawave_client
+import remnawave_governor
+from db import get_connection
+from remnawave_client import RemnawaveError
+
+# Массовая задача: уступает живым запросам (оплата, личный кабинет) в очереди к Remnawave
+remnawave_governor.set_default_lane(remnawave_governor.LANE_BULK)
+
+CHUNK_SIZE = int(os.environ.get('RESTORE_CHUNK_SIZE', '50'))
+WORKERS = int(os.environ.get('RESTORE_WORKERS', '8'))
+TIME_BUDGET_SECONDS = float(os.environ.get('RESTORE_TIME_BUDGET_SECONDS', '25'))
+RESTORE_LOCK_KEY = 'restore-users'
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     cors_headers = {
         'Access-Control-Allow-Origin': '*',
@@ -52,9 +68,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     target_username = body_data.get('username', '')
     custom_days = body_data.get('custom_days', 0)
+    restart = bool(body_data.get('restart', False))
     
     try:
-        result = restore_users(target_username, custom_days)
+        result = restore_users(target_username, custom_days, restart)
         
         return {
             'statusCode': 200,
@@ -73,8 +90,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
 
 
-def restore_users(target_username: str = '', custom_days: int = 0) -> Dict[str, Any]:
-    '''Восстанавливает пользователей в Remnawave'''
+def restore_users(target_username: str = '', custom_days: int = 0, restart: bool = False) -> Dict[str, Any]:
+    '''
+    Восстанавливает пользователей в Remnawave пачками по CHUNK_SIZE через пул из WORKERS потоков.
+    Полное восстановление - задание в restore_jobs: после каждой пачки UUID сохраняются одним запросом
+    вместе с контрольной точкой, поэтому вызов, упёршийся в TIME_BUDGET_SECONDS, продолжит следующий.
+    '''
     
     db_url = os.environ.get('DATABASE_URL', '')
     remnawave_api_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
@@ -83,191 +104,251 @@ def restore_users(target_username: str = '', custom_days: int = 0) -> Dict[str,
     if not db_url or not remnawave_api_url or not remnawave_token:
         return {'error': 'Missing credentials'}
     
+    started = time.monotonic()
+    
     # Получаем список существующих пользователей в Remnawave
     print('🔍 Fetching existing users from Remnawave...')
     try:
-        response = requests.get(
-            f'{remnawave_api_url}/api/users',
-            headers={'Authorization': f'Bearer {remnawave_token}'},
-            timeout=15
-        )
-        
-        if response.status_code != 200:
-            return {'error': f'Failed to fetch Remnawave users: {response.text}'}
-        
-        users_data = response.json()
-        existing_users = users_data.get('response', {}).get('users', [])
-        existing_usernames = {u.get('username') for u in existing_users}
+        # Постранично: в памяти остаются только имена, а не полные объекты пользователей
+        existing_usernames = {u.get('username') for u in remnawave_client.iter_users()}
         
         print(f'✅ Found {len(existing_usernames)} existing users in Remnawave')
         
+    except RemnawaveError as e:
+        return {'error': f'Failed to fetch Remnawave users: {e.details or str(e)}'}
     except Exception as e:
         return {'error': f'Failed to connect to Remnawave: {str(e)}'}
     
-    # Получаем пользователей из БД
-    conn = psycopg2.connect(db_url)
-    cursor = conn.cursor()
-    
     if target_username:
-        # Восстанавливаем одного пользователя
-        safe_username = target_username.replace("'", "''")
-        cursor.execute(f"""
-            SELECT 
-                p.username, 
-                p.email, 
-                p.plan_name, 
-                p.plan_days,
-                p.created_at,
-                uu.remnawave_uuid
-            FROM t_p66544974_beauty_website_proje.payments p
-            LEFT JOIN t_p66544974_beauty_website_proje.user_uuids uu ON p.username = uu.username
-            WHERE p.username = '{safe_username}' AND p.status = 'succeeded'
-            LIMIT 1
-        """)
-    else:
-        # Восстанавливаем всех пользователей
-        cursor.execute("""
-            SELECT 
-                p.username, 
-                p.email, 
-                p.plan_name, 
-                p.plan_days,
-                p.created_at,
-                uu.remnawave_uuid
-            FROM t_p66544974_beauty_website_proje.payments p
-            LEFT JOIN t_p66544974_beauty_website_proje.user_uuids uu ON p.username = uu.username
-            WHERE p.status = 'succeeded'
-            ORDER BY p.created_at ASC
-        """)
+        # Восстанавливаем одного пользователя, без задания
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            candidates = fetch_candidates(cursor, only_username=target_username)
+            chunk = restore_chunk(cursor, candidates, existing_usernames, custom_days)
+            cursor.close()
+        return {
+            'success': True,
+            'status': 'done',
+            'total_in_db': len(candidates),
+            'restored': len(chunk['restored']),
+            'skipped': len(chunk['skipped']),
+            'errors': len(chunk['errors']),
+            'restored_users': chunk['restored'],
+            'skipped_users': chunk['skipped'],
+            'error_details': chunk['errors']
+        }
     
-    users_to_restore = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    restored, skipped, errors = [], [], []
     
-    print(f'📋 Found {len(users_to_restore)} users in database')
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Один исполнитель на задание: параллельный вызов не создаст пользователей дважды
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (RESTORE_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            cursor.close()
+            return {'success': False, 'error': 'Restore is already running in another invocation'}
+        
+        try:
+            job = start_or_resume_job(cursor, custom_days, restart)
+            conn.commit()
+            print(f'📋 Restore job {job["id"]}: {job["total"]} users in database, resuming after {job["last_username"]!r}')
+            
+            while job['status'] == 'running' and time.monotonic() - started < TIME_BUDGET_SECONDS:
+                candidates = fetch_candidates(cursor, after_username=job['last_username'])
+                if not candidates:
+                    cursor.execute("""
+                        UPDATE restore_jobs SET status = 'done', finished_at = NOW(), updated_at = NOW()
+                        WHERE id = %s
+                    """, (job['id'],))
+                    conn.commit()
+                    job['status'] = 'done'
+                    break
+                
+                chunk = restore_chunk(cursor, candidates, existing_usernames, job['custom_days'])
+                job['last_username'] = candidates[-1][0]
+                
+                if chunk['errors']:
+                    execute_values(cursor, """
+                        INSERT INTO restore_job_errors (job_id, username, error)
+                        VALUES %s
+                        ON CONFLICT (job_id, username) DO UPDATE SET error = EXCLUDED.error, created_at = NOW()
+                    """, [(job['id'], e['username'], e['error']) for e in chunk['errors']])
+                cursor.execute("""
+                    UPDATE restore_jobs
+                    SET last_username = %s, restored = restored + %s, skipped = skipped + %s,
+                        failed = failed + %s, updated_at = NOW()
+                    WHERE id = %s
+                    RETURNING restored, skipped, failed
+                """, (job['last_username'], len(chunk['restored']), len(chunk['skipped']), len(chunk['errors']), job['id']))
+                job['restored'], job['skipped'], job['failed'] = cursor.fetchone()
+                conn.commit()
+                
+                restored.extend(chunk['restored'])
+                skipped.extend(chunk['skipped'])
+                errors.extend(chunk['errors'])
+                print(f'💾 Checkpoint {job["last_username"]!r}: restored {job["restored"]}, '
+                      f'skipped {job["skipped"]}, failed {job["failed"]} of {job["total"]}')
+        finally:
+            # Lock сессионный: снимаем явно, иначе он останется на подключении в пуле
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (RESTORE_LOCK_KEY,))
+            cursor.close()
     
-    restored = []
-    skipped = []
-    errors = []
+    if job['status'] == 'running':
+        print(f'⏸️ Time budget spent, job {job["id"]} will resume after {job["last_username"]!r}')
     
-    for user_data in users_to_restore:
-        username = user_data[0]
-        email = user_data[1]
-        plan_name = user_data[2]
-        plan_days = user_data[3]
-        created_at = user_data[4]
-        old_uuid = user_data[5]
-        
+    return {
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'total_in_db': job['total'],
+        'restored': job['restored'],
+        'skipped': job['skipped'],
+        'errors': job['failed'],
+        'restored_users': restored,
+        'skipped_users': skipped,
+        'error_details': errors
+    }
+
+
+def start_or_resume_job(cursor: Any, custom_days: int, restart: bool) -> Dict[str, Any]:
+    '''Продолжает незавершённое задание или начинает новое (restart - бросить незавершённое)'''
+    if restart:
+        cursor.execute("UPDATE restore_jobs SET status = 'abandoned', updated_at = NOW() WHERE status = 'running'")
+    
+    cursor.execute("""
+        SELECT id, custom_days, last_username, total, restored, skipped, failed
+        FROM restore_jobs WHERE status = 'running'
+        ORDER BY id DESC LIMIT 1
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute("""
+            INSERT INTO restore_jobs (custom_days, total)
+            SELECT %s, COUNT(DISTINCT username) FROM payments WHERE status = 'succeeded'
+            RETURNING id, custom_days, last_username, total, restored, skipped, failed
+        """, (custom_days,))
+        row = cursor.fetchone()
+    
+    return {
+        'id': row[0], 'custom_days': row[1], 'last_username': row[2], 'total': row[3],
+        'restored': row[4], 'skipped': row[5], 'failed': row[6], 'status': 'running'
+    }
+
+
+def fetch_candidates(cursor: Any, after_username: Optional[str] = None, only_username: str = '') -> List[tuple]:
+    '''Следующая пачка клиентов с успешной оплатой по username (последний платёж клиента)'''
+    if only_username:
+        where, params = 'p.username = %s', [only_username]
+    elif after_username is not None:
+        where, params = 'p.username > %s', [after_username]
+    else:
+        where, params = 'TRUE', []
+    
+    cursor.execute(f"""
+        SELECT DISTINCT ON (p.username)
+            p.username,
+            p.email,
+            p.plan_name,
+            p.plan_days,
+            p.created_at,
+            uu.remnawave_uuid
+        FROM payments p
+        LEFT JOIN LATERAL (
+            SELECT remnawave_uuid FROM user_uuids
+            WHERE username = p.username
+            ORDER BY created_at DESC LIMIT 1
+        ) uu ON TRUE
+        WHERE p.status = 'succeeded' AND {where}
+        ORDER BY p.username, p.created_at DESC
+        LIMIT %s
+    """, params + [CHUNK_SIZE])
+    return cursor.fetchall()
+
+
+def restore_chunk(cursor: Any, candidates: List[tuple], existing_usernames: set, custom_days: int) -> Dict[str, List]:
+    '''Создаёт недостающих пользователей пачки параллельно и сохраняет их UUID одним запросом'''
+    restored, skipped, errors = [], [], []
+    to_create = []
+    
+    for username, email, plan_name, plan_days, created_at, old_uuid in candidates:
         # Пропускаем если пользователь уже существует в Remnawave
         if username in existing_usernames:
-            print(f'⏭️  Skipping {username} - already exists in Remnawave')
             skipped.append(username)
             continue
-        
-        # Создаем пользователя в Remnawave
-        print(f'🔄 Restoring user: {username}')
-        
         # Используем custom_days если указаны, иначе plan_days из БД
-        days_to_use = custom_days if custom_days > 0 else plan_days
-        result = create_user_in_remnawave(username, email, days_to_use)
+        days_to_use = custom_days if custom_days > 0 else (plan_days or 0)
+        to_create.append((username, email, days_to_use, old_uuid))
+    
+    if to_create:
+        with ThreadPoolExecutor(max_workers=max(1, min(WORKERS, len(to_create)))) as pool:
+            results = list(pool.map(lambda item: create_user_in_remnawave(item[0], item[1], item[2]), to_create))
         
-        if result.get('success'):
-            restored.append({
-                'username': username,
-                'email': email,
-                'subscription_url': result.get('subscription_url', ''),
-                'old_uuid': old_uuid
-            })
-            print(f'✅ Restored: {username}')
-        else:
-            errors.append({
-                'username': username,
-                'error': result.get('error', 'Unknown error')
-            })
-            print(f'❌ Failed to restore {username}: {result.get("error")}')
+        for (username, email, _, old_uuid), result in zip(to_create, results):
+            if result.get('success'):
+                existing_usernames.add(username)
+                restored.append({
+                    'username': username,
+                    'email': email,
+                    'subscription_url': result.get('subscription_url', ''),
+                    'uuid': result.get('uuid', ''),
+                    'old_uuid': old_uuid
+                })
+            elif result.get('exists'):
+                # Создан уже после снимка списка (оплатой или прошлым прерванным вызовом)
+                existing_usernames.add(username)
+                skipped.append(username)
+            else:
+                errors.append({'username': username, 'error': result.get('error', 'Unknown error')})
+                print(f'❌ Failed to restore {username}: {result.get("error")}')
     
-    return {
-        'success': True,
-        'total_in_db': len(users_to_restore),
-        'restored': len(restored),
-        'skipped': len(skipped),
-        'errors': len(errors),
-        'restored_users': restored,
-        'skipped_users': skipped,
-        'error_details': errors
-    }
+    uuid_rows = [(r['username'], r['uuid']) for r in restored if r['uuid']]
+    if uuid_rows:
+        execute_values(cursor, """
+            INSERT INTO user_uuids (username, remnawave_uuid, created_at)
+            VALUES %s
+            ON CONFLICT (username, remnawave_uuid) DO UPDATE
+            SET created_at = NOW()
+        """, uuid_rows, template='(%s, %s, NOW())')
+    
+    print(f'✅ Chunk: restored {len(restored)}, skipped {len(skipped)}, failed {len(errors)}')
+    return {'restored': restored, 'skipped': skipped, 'errors': errors}
 
 
 def create_user_in_remnawave(username: str, email: str, plan_days: int) -> Dict[str, Any]:
-    '''Создает пользователя в Remnawave'''
+    '''Создает пользователя в Remnawave (UUID сохраняет вызывающий код пачкой)'''
     try:
-        remnawave_url = 'https://functions.poehali.dev/4e61ec57-0f83-4c68-83fb-8b3049f711ab'
-        
         # Вычисляем дату окончания подписки
         expire_timestamp = int(datetime.now().timestamp()) + (plan_days * 86400)
         
         # Дефолтные настройки для восстановленных пользователей
         traffic_gb = 30
         data_limit = traffic_gb * 1024 * 1024 * 1024
-        squad_uuids = ['e742f30b-82fb-431a-918b-1b4d22d6ba4d']  # дефолтный squad
-        
-        payload = {
-            'action': 'create_user',
-            'username': username,
-            'email': email,
-            'proxies': {
-                'vless-reality': {}
-            },
-            'data_limit': data_limit,
-            'expire': expire_timestamp,
-            'data_limit_reset_strategy': 'day',
-            'internalSquads': squad_uuids
-        }
+        squad_uuids = [remnawave_client.DEFAULT_SQUAD_UUID]  # дефолтный squad
         
         print(f'🔹 Creating user in Remnawave: {username}')
         
-        response = requests.post(
-            remnawave_url,
-            headers={'Content-Type': 'application/json'},
-            json=payload,
-            timeout=30
+        user = remnawave_client.create_user(
+            username,
+            expire_timestamp,
+            data_limit=data_limit,
+            internal_squads=squad_uuids,
+            proxies={'vless-reality': {}},
+            data_limit_reset_strategy='day'
         )
+        subscription_url = user.get('subscriptionUrl', '')
+        user_uuid = user.get('uuid', '')
         
-        if response.status_code == 200 or response.status_code == 201:
-            data = response.json()
-            response_data = data.get('response', data)
-            subscription_url = response_data.get('subscriptionUrl', response_data.get('subscription_url', ''))
-            user_uuid = response_data.get('uuid', '')
-            
-            print(f'✅ User created: {subscription_url}, UUID: {user_uuid}')
-            
-            # Сохраняем UUID в базу данных
-            if user_uuid:
-                try:
-                    db_url = os.environ.get('DATABASE_URL', '')
-                    if db_url:
-                        conn = psycopg2.connect(db_url)
-                        cur = conn.cursor()
-                        safe_username = username.replace("'", "''")
-                        safe_uuid = user_uuid.replace("'", "''")
-                        cur.execute(f"""
-                            INSERT INTO t_p66544974_beauty_website_proje.user_uuids (username, remnawave_uuid, created_at)
-                            VALUES ('{safe_username}', '{safe_uuid}', NOW())
-                            ON CONFLICT (username, remnawave_uuid) DO UPDATE 
-                            SET created_at = NOW()
-                        """)
-                        conn.commit()
-                        cur.close()
-                        conn.close()
-                        print(f'💾 UUID saved to DB: {user_uuid}')
-                except Exception as e:
-                    print(f'⚠️ Failed to save UUID: {str(e)}')
-            
-            return {'success': True, 'subscription_url': subscription_url, 'uuid': user_uuid}
-        else:
-            print(f'❌ Remnawave error: {response.status_code} - {response.text}')
-            return {'success': False, 'error': response.text}
+        print(f'✅ User created: {subscription_url}, UUID: {user_uuid}')
+        
+        return {'success': True, 'subscription_url': subscription_url, 'uuid': user_uuid}
         
+    except RemnawaveError as e:
+        if e.status_code in (400, 409) and 'already exists' in (e.details or '').lower():
+            print(f'⏭️ User {username} already exists in Remnawave')
+            return {'success': False, 'exists': True}
+        print(f'❌ Remnawave error: {e.status_code} - {e.details}')
+        return {'success': False, 'error': e.details or str(e)}
     except Exception as e:
         print(f'❌ Error creating user: {str(e)}')
-        return {'success': False, 'error': str(e)}
\ No newline at end of file
+        return {'success': False, 'error': str(e)}
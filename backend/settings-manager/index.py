@@ -1,9 +1,11 @@
 import json
 import os
-import psycopg2
 import base64
+import psycopg2
 from typing import Dict, Any, Optional
 
+from db import get_connection
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Управление настройками проекта (секреты, подключения к БД, API)
@@ -153,15 +155,14 @@ def get_secret_value(key: str) -> str:
         return os.environ.get(key, '')
     
     try:
-        conn = psycopg2.connect(db_url)
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT secret_value FROM project_secrets WHERE secret_key = %s',
-            (key,)
-        )
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT secret_value FROM project_secrets WHERE secret_key = %s',
+                (key,)
+            )
+            result = cursor.fetchone()
+            cursor.close()
         
         if result:
             encoded_value = result[0]
@@ -178,29 +179,28 @@ def update_secrets(updates: Dict[str, str]) -> Dict[str, Any]:
         return {'success': False, 'message': 'DATABASE_URL не настроен'}
     
     try:
-        conn = psycopg2.connect(db_url)
-        cursor = conn.cursor()
         updated_keys = []
         
-        for key, value in updates.items():
-            if not value:
-                continue
+        with get_connection() as conn:
+            cursor = conn.cursor()
             
-            encoded_value = base64.b64encode(value.encode('utf-8')).decode('utf-8')
+            for key, value in updates.items():
+                if not value:
+                    continue
+                
+                encoded_value = base64.b64encode(value.encode('utf-8')).decode('utf-8')
+                
+                cursor.execute(
+                    '''INSERT INTO project_secrets (secret_key, secret_value, updated_at)
+                       VALUES (%s, %s, CURRENT_TIMESTAMP)
+                       ON CONFLICT (secret_key) 
+                       DO UPDATE SET secret_value = EXCLUDED.secret_value, 
+                                     updated_at = CURRENT_TIMESTAMP''',
+                    (key, encoded_value)
+                )
+                updated_keys.append(key)
             
-            cursor.execute(
-                '''INSERT INTO project_secrets (secret_key, secret_value, updated_at)
-                   VALUES (%s, %s, CURRENT_TIMESTAMP)
-                   ON CONFLICT (secret_key) 
-                   DO UPDATE SET secret_value = EXCLUDED.secret_value, 
-                                 updated_at = CURRENT_TIMESTAMP''',
-                (key, encoded_value)
-            )
-            updated_keys.append(key)
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+            cursor.close()
         
         return {
             'success': True,
@@ -249,14 +249,14 @@ def test_yookassa_connection(shop_id: str, secret_key: str) -> Dict[str, Any]:
         return {'success': False, 'message': 'Shop ID или Secret Key не указаны'}
     
     try:
-        import requests
+        import http_client
         import base64
         
         auth_string = f"{shop_id}:{secret_key}"
         auth_bytes = auth_string.encode('utf-8')
         auth_b64 = base64.b64encode(auth_bytes).decode('utf-8')
         
-        response = requests.get(
+        response = http_client.get(
             'https://api.yookassa.ru/v3/payments',
             headers={
                 'Authorization': f'Basic {auth_b64}',
@@ -288,9 +288,9 @@ def test_remnawave_connection(api_url: str, api_token: str) -> Dict[str, Any]:
         return {'success': False, 'message': 'API URL или Token не указаны'}
     
     try:
-        import requests
+        import http_client
         
-        response = requests.get(
+        response = http_client.get(
             f"{api_url.rstrip('/')}/api/admin/users",
             headers={
                 'Authorization': f'Bearer {api_token}',
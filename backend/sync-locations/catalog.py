@@ -0,0 +1,115 @@
+'''
+Business: Кэш каталога тарифов и локаций в памяти процесса (squad_uuids, traffic_gb) для выдачи подписки
+Args: CATALOG_CACHE_TTL_SECONDS из переменных окружения
+Returns: get_plan()/find_plan()/location_squads() без запроса в БД на каждый платёж;
+         bump_version() - инвалидация при изменении тарифов и локаций
+'''
+
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from db import get_connection
+
+CACHE_TTL_SECONDS = float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '300'))
+
+_lock = threading.Lock()
+_cache: Dict[str, Any] = {
+    'version': None,
+    'expires_at': 0.0,
+    'plans_by_id': {},
+    'plans_by_name_days': {},
+    'location_squads': {}
+}
+
+
+def bump_version(cursor: Any):
+    '''
+    Вызывается в транзакции, изменяющей тарифы или локации.
+    Другие процессы увидят новую версию по истечении TTL, текущий - сразу.
+    '''
+    cursor.execute("""
+        INSERT INTO catalog_version (id, version, updated_at)
+        VALUES (1, 1, NOW())
+        ON CONFLICT (id) DO UPDATE SET version = catalog_version.version + 1, updated_at = NOW()
+    """)
+    invalidate()
+
+
+def invalidate():
+    '''Сбрасывает кэш текущего процесса'''
+    with _lock:
+        _cache['version'] = None
+        _cache['expires_at'] = 0.0
+
+
+def _load(cursor: Any):
+    cursor.execute("""
+        SELECT plan_id, name, days, traffic_gb, squad_uuids
+        FROM t_p66544974_beauty_website_proje.subscription_plans
+        WHERE is_active = true
+    """)
+    plans_by_id = {}
+    plans_by_name_days = {}
+    for row in cursor.fetchall():
+        plan = {
+            'plan_id': row[0],
+            'name': row[1],
+            'days': row[2],
+            'traffic_gb': row[3],
+            'squad_uuids': list(row[4] or [])
+        }
+        plans_by_id[int(plan['plan_id'])] = plan
+        # Как и прежний запрос с LIMIT 1 - берём первый попавшийся тариф с таким name/days
+        plans_by_name_days.setdefault((plan['name'], plan['days']), plan)
+
+    cursor.execute("""
+        SELECT location_id, squad_uuid
+        FROM t_p66544974_beauty_website_proje.locations
+        WHERE squad_uuid IS NOT NULL
+    """)
+    location_squads = {int(row[0]): row[1] for row in cursor.fetchall()}
+
+    _cache['plans_by_id'] = plans_by_id
+    _cache['plans_by_name_days'] = plans_by_name_days
+    _cache['location_squads'] = location_squads
+    print(f'📚 Catalog loaded: {len(plans_by_id)} plans, {len(location_squads)} locations')
+
+
+def _ensure_fresh():
+    '''По истечении TTL сверяет версию каталога и перечитывает его только если она изменилась'''
+    if time.monotonic() < _cache['expires_at']:
+        return
+
+    with _lock:
+        if time.monotonic() < _cache['expires_at']:
+            return
+
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+            row = cursor.fetchone()
+            version = row[0] if row else 0
+            if version != _cache['version']:
+                _load(cursor)
+                _cache['version'] = version
+            cursor.close()
+
+        _cache['expires_at'] = time.monotonic() + CACHE_TTL_SECONDS
+
+
+def get_plan(plan_id: int) -> Optional[Dict[str, Any]]:
+    _ensure_fresh()
+    return _cache['plans_by_id'].get(int(plan_id))
+
+
+def find_plan(name: str, days: int) -> Optional[Dict[str, Any]]:
+    _ensure_fresh()
+    return _cache['plans_by_name_days'].get((name, days))
+
+
+def location_squads(location_ids: Iterable[int]) -> List[str]:
+    _ensure_fresh()
+    squads = _cache['location_squads']
+    return [squads[int(loc_id)] for loc_id in location_ids if int(loc_id) in squads]
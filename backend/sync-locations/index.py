@@ -6,10 +6,14 @@ Returns: HTTP response dict с результатами синхронизаци
 
 import json
 import os
-import psycopg2
-import requests
+import http_client
 from typing import Dict, Any, List
 
+from psycopg2.extras import execute_values
+
+import catalog
+from db import get_connection
+
 COUNTRY_FLAGS = {
     'RU': '🇷🇺', 'US': '🇺🇸', 'DE': '🇩🇪', 'FR': '🇫🇷', 'GB': '🇬🇧', 
     'JP': '🇯🇵', 'CA': '🇨🇦', 'AU': '🇦🇺', 'NL': '🇳🇱', 'SG': '🇸🇬',
@@ -18,6 +22,8 @@ COUNTRY_FLAGS = {
     'KR': '🇰🇷', 'HK': '🇭🇰', 'TW': '🇹🇼', 'TR': '🇹🇷', 'UA': '🇺🇦'
 }
 
+LOCATION_FIELDS = ('name', 'flag_emoji', 'squad_uuid')
+
 def parse_country_from_name(name: str) -> tuple:
     '''Извлечь код страны и название из имени сквада'''
     name_upper = name.upper()
@@ -29,6 +35,89 @@ def parse_country_from_name(name: str) -> tuple:
     
     return 'XX', '🌍', name
 
+def squads_to_locations(squads: List[Any]) -> tuple:
+    '''
+    Локации по country_code из списка squads. Несколько squads одной страны - побеждает последний
+    (как при прежней построчной синхронизации), sort_order - по первому.
+    '''
+    incoming: Dict[str, Dict[str, Any]] = {}
+    skipped = []
+    for idx, squad in enumerate(squads):
+        if not isinstance(squad, dict):
+            print(f'Skipping squad {idx}: squad is not a dict')
+            skipped.append({'index': idx, 'reason': 'not an object'})
+            continue
+        
+        squad_id = squad.get('uuid') or squad.get('id')
+        squad_name = squad.get('name', '')
+        if not squad_id or not squad_name:
+            print(f'Skipping squad {idx}: missing id or name. Squad: {squad}')
+            skipped.append({'index': idx, 'reason': 'missing id or name'})
+            continue
+        
+        country_code, flag, country_name = parse_country_from_name(squad_name)
+        print(f'Squad: {squad_name} -> {country_code} {flag} {country_name}')
+        previous = incoming.get(country_code)
+        incoming[country_code] = {
+            'country_code': country_code,
+            'name': country_name,
+            'flag_emoji': flag,
+            'squad_uuid': squad_id,
+            'sort_order': previous['sort_order'] if previous else idx + 1
+        }
+    return incoming, skipped
+
+def diff_locations(incoming: Dict[str, Dict[str, Any]], current: Dict[str, List[tuple]]) -> Dict[str, List[Any]]:
+    '''Сравнение в памяти: что вставить, что обновить, что уже совпадает'''
+    diff: Dict[str, List[Any]] = {'inserted': [], 'updated': [], 'unchanged': [], 'changes': []}
+    for code, location in incoming.items():
+        rows = current.get(code)
+        if not rows:
+            diff['inserted'].append(code)
+            continue
+        target = (location['name'], location['flag_emoji'], location['squad_uuid'])
+        # Строк одной страны бывает несколько (Россия и Санкт-Петербург) - обновляются все
+        stale = [row for row in rows if row != target]
+        if not stale:
+            diff['unchanged'].append(code)
+            continue
+        diff['updated'].append(code)
+        diff['changes'].append({
+            'country_code': code,
+            'from': [dict(zip(LOCATION_FIELDS, row)) for row in stale],
+            'to': dict(zip(LOCATION_FIELDS, target))
+        })
+    
+    # Локации без squad в Remnawave не удаляем: цены и настройки задаются в админке
+    diff['missing_in_remnawave'] = sorted(code for code in current if code not in incoming)
+    return diff
+
+def apply_locations(cursor: Any, changes: List[Dict[str, Any]]):
+    '''
+    Все изменения одним запросом. country_code в locations не уникален (у RU две строки),
+    поэтому вместо ON CONFLICT - UPDATE существующих и INSERT новых в одном CTE
+    '''
+    execute_values(cursor, """
+        WITH incoming (name, country_code, flag_emoji, squad_uuid, sort_order) AS (VALUES %s),
+        updated AS (
+            UPDATE t_p66544974_beauty_website_proje.locations l
+            SET name = i.name, flag_emoji = i.flag_emoji, squad_uuid = i.squad_uuid
+            FROM incoming i
+            WHERE l.country_code = i.country_code
+              AND (l.name, l.flag_emoji, l.squad_uuid) IS DISTINCT FROM (i.name, i.flag_emoji, i.squad_uuid)
+        )
+        INSERT INTO t_p66544974_beauty_website_proje.locations
+        (name, country_code, flag_emoji, price_per_day, traffic_gb_per_day, is_active, sort_order, squad_uuid)
+        SELECT i.name, i.country_code, i.flag_emoji, 5.0, 1, true, i.sort_order, i.squad_uuid
+        FROM incoming i
+        WHERE NOT EXISTS (
+            SELECT 1 FROM t_p66544974_beauty_website_proje.locations l WHERE l.country_code = i.country_code
+        )
+    """, [
+        (loc['name'], loc['country_code'], loc['flag_emoji'], loc['squad_uuid'], loc['sort_order'])
+        for loc in changes
+    ], template='(%s, %s, %s, %s, %s::integer)', page_size=len(changes))
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     headers_in = event.get('headers', {})
@@ -84,7 +173,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     try:
         print(f'Fetching squads from {api_url}/api/internal-squads')
-        response = requests.get(
+        response = http_client.get(
             f'{api_url}/api/internal-squads',
             headers={'Authorization': f'Bearer {api_token}'},
             timeout=10
@@ -117,68 +206,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         print(f'Received {len(squads)} squads from Remnawave')
         
-        conn = psycopg2.connect(db_url)
-        cursor = conn.cursor()
+        incoming, skipped = squads_to_locations(squads)
         
-        synced = 0
-        updated = 0
-        skipped = 0
-        
-        for idx, squad in enumerate(squads):
-            # Check if squad is a dict or has get method
-            if isinstance(squad, str):
-                print(f'Skipping squad {idx}: squad is a string, not dict')
-                skipped += 1
-                continue
-                
-            squad_id = squad.get('uuid') or squad.get('id')
-            squad_name = squad.get('name', '')
-            
-            if not squad_id or not squad_name:
-                print(f'Skipping squad {idx}: missing id or name. Squad: {squad}')
-                skipped += 1
-                continue
-            
-            country_code, flag, country_name = parse_country_from_name(squad_name)
-            print(f'Squad: {squad_name} -> {country_code} {flag} {country_name}')
-            
+        with get_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                SELECT location_id FROM t_p66544974_beauty_website_proje.locations
-                WHERE country_code = %s
-            """, (country_code,))
+                SELECT country_code, name, flag_emoji, squad_uuid
+                FROM t_p66544974_beauty_website_proje.locations
+            """)
+            current: Dict[str, List[tuple]] = {}
+            for code, name, flag, squad_uuid in cursor.fetchall():
+                current.setdefault(code, []).append((name, flag, squad_uuid))
             
-            existing = cursor.fetchone()
-            
-            if existing:
-                cursor.execute("""
-                    UPDATE t_p66544974_beauty_website_proje.locations
-                    SET name = %s, flag_emoji = %s, squad_uuid = %s
-                    WHERE country_code = %s
-                """, (country_name, flag, squad_id, country_code))
-                updated += 1
-            else:
-                cursor.execute("""
-                    INSERT INTO t_p66544974_beauty_website_proje.locations
-                    (name, country_code, flag_emoji, price_per_day, traffic_gb_per_day, is_active, sort_order, squad_uuid)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """, (country_name, country_code, flag, 5.0, 1, True, idx + 1, squad_id))
-                synced += 1
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+            diff = diff_locations(incoming, current)
+            changes = [incoming[code] for code in diff['inserted'] + diff['updated']]
+            # Ничего не изменилось - не пишем и не сбрасываем кэш каталога
+            if changes:
+                apply_locations(cursor, changes)
+                catalog.bump_version(cursor)
+            cursor.close()
         
-        print(f'Sync completed: synced={synced}, updated={updated}, skipped={skipped}')
+        print(f'Sync completed: inserted={len(diff["inserted"])}, updated={len(diff["updated"])}, '
+              f'unchanged={len(diff["unchanged"])}, skipped={len(skipped)}')
         
         return {
             'statusCode': 200,
             'headers': cors_headers,
             'body': json.dumps({
-                'message': 'Sync completed',
+                'message': 'Sync completed' if changes else 'Already in sync',
                 'total_squads': len(squads),
-                'synced': synced,
-                'updated': updated,
-                'skipped': skipped
+                'synced': len(diff['inserted']),
+                'updated': len(diff['updated']),
+                'skipped': len(skipped),
+                'diff': {**diff, 'skipped': skipped}
             }),
             'isBase64Encoded': False
         }
@@ -1,14 +1,29 @@
 '''
-Business: Sync all user UUIDs from Remnawave to database
-Args: event with httpMethod
-Returns: Number of synced UUIDs
+Business: Sync user UUIDs from Remnawave to database and refresh the remnawave_users mirror
+Args: event with httpMethod; ?mode=full|delta (or "mode" in body) - by default delta since the last
+      watermark, full pass once per SYNC_FULL_INTERVAL_HOURS (only a full pass marks deleted users)
+Returns: Number of synced UUIDs and changed mirror rows
 '''
 
 import json
 import os
-import psycopg2
-import requests
-from typing import Dict, Any
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+from psycopg2.extras import execute_values
+
+import remnawave_client
+import remnawave_governor
+from db import get_connection
+from remnawave_client import DeltaUnsupported
+from remnawave_mirror import SYNC_STATE_NAME, load_sync_state, mark_missing_deleted, save_sync_state, upsert_users
+
+# Массовая задача: уступает живым запросам (оплата, личный кабинет) в очереди к Remnawave
+remnawave_governor.set_default_lane(remnawave_governor.LANE_BULK)
+
+FULL_INTERVAL_HOURS = float(os.environ.get('SYNC_FULL_INTERVAL_HOURS', '24'))
+# Запас назад от отметки: расхождение часов и пользователи с одинаковым updatedAt
+WATERMARK_OVERLAP_SECONDS = int(os.environ.get('SYNC_WATERMARK_OVERLAP_SECONDS', '60'))
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'POST')
@@ -29,6 +44,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    params = event.get('queryStringParameters') or {}
+    try:
+        body_data = json.loads(event.get('body') or '{}')
+    except json.JSONDecodeError:
+        body_data = {}
+    requested_mode = params.get('mode') or (body_data.get('mode') if isinstance(body_data, dict) else None)
+    
     try:
         remnawave_api_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
         remnawave_token = os.environ.get('REMNAWAVE_API_TOKEN', '')
@@ -42,66 +64,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        print('📡 Fetching users from Remnawave...')
-        response = requests.get(
-            f'{remnawave_api_url}/api/users',
-            headers={'Authorization': f'Bearer {remnawave_token}'},
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            return {
-                'statusCode': 500,
-                'headers': cors_headers,
-                'body': json.dumps({'error': f'Failed to fetch users: {response.status_code}'}),
-                'isBase64Encoded': False
-            }
-        
-        users_data = response.json()
-        users_list = users_data.get('response', {}).get('users', [])
-        
-        print(f'📊 Found {len(users_list)} users in Remnawave')
-        
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
-        
-        synced_count = 0
-        
-        for user in users_list:
-            username = user.get('username')
-            user_uuid = user.get('uuid')
+        with get_connection() as conn:
+            cur = conn.cursor()
             
-            if username and user_uuid:
+            watermark, full_sync_age = load_sync_state(cur)
+            mode = choose_mode(requested_mode, watermark, full_sync_age)
+            
+            result = None
+            if mode == 'delta':
                 try:
-                    safe_username = username.replace("'", "''")
-                    safe_uuid = user_uuid.replace("'", "''")
-                    
-                    cur.execute(f"""
-                        INSERT INTO user_uuids (username, remnawave_uuid, created_at)
-                        VALUES ('{safe_username}', '{safe_uuid}', NOW())
-                        ON CONFLICT (username, remnawave_uuid) DO NOTHING
-                    """)
-                    
-                    if cur.rowcount > 0:
-                        synced_count += 1
-                        print(f'✅ {username}: {user_uuid}')
-                except Exception as e:
-                    print(f'⚠️ Failed {username}: {str(e)}')
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+                    result = sync_delta(conn, cur, watermark)
+                except DeltaUnsupported as e:
+                    # Уже записанные страницы повторно ничего не изменят - просто делаем полный проход
+                    print(f'⚠️ Delta sync unavailable ({str(e)}), falling back to full sync')
+                    conn.rollback()
+            if result is None:
+                result = sync_full(conn, cur)
+            
+            cur.close()
         
-        print(f'🎉 Synced {synced_count} new UUIDs')
+        print(f'🎉 {result["mode"]} sync: {result["synced_count"]} new UUIDs')
+        print(f'🪞 Mirror: {result["mirror_changed"]} changed, {result["mirror_deleted"]} marked deleted')
         
         return {
             'statusCode': 200,
             'headers': cors_headers,
-            'body': json.dumps({
-                'success': True,
-                'total_users': len(users_list),
-                'synced_count': synced_count
-            }),
+            'body': json.dumps({'success': True, **result}),
             'isBase64Encoded': False
         }
         
@@ -113,3 +101,127 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
+
+
+def choose_mode(requested: Optional[str], watermark: Optional[datetime], full_sync_age: Optional[float]) -> str:
+    '''Дельта, пока есть отметка и полный проход был не дольше FULL_INTERVAL_HOURS назад'''
+    if requested == 'full' or not watermark:
+        return 'full'
+    if requested == 'delta':
+        return 'delta'
+    if full_sync_age is None or full_sync_age > FULL_INTERVAL_HOURS * 3600:
+        return 'full'
+    return 'delta'
+
+
+def save_uuids(cur: Any, users: List[Dict[str, Any]]) -> int:
+    '''Пары username/UUID страницы одним запросом; возвращает число новых'''
+    rows = sorted({(u['username'], u['uuid']) for u in users if u.get('username') and u.get('uuid')})
+    if not rows:
+        return 0
+    inserted = execute_values(cur, """
+        INSERT INTO user_uuids (username, remnawave_uuid, created_at)
+        VALUES %s
+        ON CONFLICT (username, remnawave_uuid) DO NOTHING
+        RETURNING username
+    """, rows, template='(%s, %s, NOW())', page_size=len(rows), fetch=True)
+    return len(inserted)
+
+
+def _max_updated_at(users: List[Dict[str, Any]], current: Optional[datetime]) -> Optional[datetime]:
+    '''Отметка хранится в UTC без часового пояса, как и остальные TIMESTAMP зеркала'''
+    for user in users:
+        updated_at = remnawave_client.parse_timestamp(user.get('updatedAt'))
+        if updated_at is not None:
+            updated_at = updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+            if current is None or updated_at > current:
+                current = updated_at
+    return current
+
+
+def sync_page(cur: Any, users: List[Dict[str, Any]]) -> tuple:
+    '''Два запроса на страницу: новые UUID и изменившиеся строки зеркала'''
+    synced = save_uuids(cur, users)
+    # Зеркало: переписываем только пользователей с изменившимся updatedAt
+    changed = upsert_users(cur, users)
+    return synced, changed
+
+
+def sync_full(conn: Any, cur: Any) -> Dict[str, Any]:
+    '''Полный проход по /api/users; помечает удалёнными тех, кого в Remnawave больше нет'''
+    print('📡 Fetching users from Remnawave page by page...')
+    synced_count = 0
+    mirror_changed = 0
+    total_users = 0
+    watermark = None
+    # Держим в памяти только UUID (для пометки удалённых), сами пользователи - по одной странице
+    seen_uuids = []
+    
+    for users_list, total_users in remnawave_client.iter_user_pages():
+        seen_uuids.extend(u['uuid'] for u in users_list if u.get('username') and u.get('uuid'))
+        synced, changed = sync_page(cur, users_list)
+        synced_count += synced
+        mirror_changed += changed
+        watermark = _max_updated_at(users_list, watermark)
+        conn.commit()
+    
+    print(f'📊 Found {len(seen_uuids)} users in Remnawave')
+    
+    # Удаления отмечаем только если проход увидел столько же, сколько Remnawave насчитал:
+    # если список сдвинулся между страницами, кого-то можно было пропустить
+    mirror_deleted = 0
+    complete = bool(seen_uuids) and total_users == len(seen_uuids)
+    if complete:
+        mirror_deleted = mark_missing_deleted(cur, seen_uuids)
+    # Неполный проход не засчитывается как полный: следующий вызов повторит его, а не уйдёт в дельту
+    save_sync_state(cur, len(seen_uuids), mirror_changed, watermark, full=complete)
+    conn.commit()
+    
+    return {
+        'mode': 'full',
+        'total_users': len(seen_uuids),
+        'synced_count': synced_count,
+        'mirror_changed': mirror_changed,
+        'mirror_deleted': mirror_deleted
+    }
+
+
+def sync_delta(conn: Any, cur: Any, watermark: datetime) -> Dict[str, Any]:
+    '''Только пользователи с updatedAt после отметки: время зависит от числа изменений, а не от размера базы'''
+    since = (watermark - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)).replace(tzinfo=timezone.utc)
+    print(f'📡 Fetching users updated since {since.isoformat()}...')
+    synced_count = 0
+    mirror_changed = 0
+    processed = 0
+    total_users = None
+    new_watermark = watermark
+    
+    for users_list, total_users in remnawave_client.iter_user_pages_since(since):
+        synced, changed = sync_page(cur, users_list)
+        synced_count += synced
+        mirror_changed += changed
+        processed += len(users_list)
+        new_watermark = _max_updated_at(users_list, new_watermark)
+        conn.commit()
+    
+    print(f'📊 {processed} users changed since the watermark')
+    
+    if total_users is None:
+        # Изменений нет: total из Remnawave не пришёл, отмечаем только время дельты.
+        # last_synced_at не трогаем - он означает полный проход и освежает всё зеркало
+        cur.execute(
+            "UPDATE remnawave_sync_state SET last_partial_sync_at = NOW(), changed_users = 0 WHERE name = %s",
+            (SYNC_STATE_NAME,)
+        )
+    else:
+        save_sync_state(cur, total_users, mirror_changed, new_watermark, full=False)
+    conn.commit()
+    
+    return {
+        'mode': 'delta',
+        'total_users': total_users,
+        'processed_users': processed,
+        'synced_count': synced_count,
+        'mirror_changed': mirror_changed,
+        'mirror_deleted': 0
+    }
@@ -6,9 +6,10 @@ Returns: HTTP response с данными кодов или статусом оп
 
 import json
 import os
-import psycopg2
 from typing import Dict, Any
 
+from db import get_connection
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -24,7 +25,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': ''
         }
     
-    conn = None
     try:
         database_url = os.environ.get('DATABASE_URL')
         if not database_url:
@@ -38,115 +38,115 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'success': False, 'error': 'DATABASE_URL not configured'})
             }
         
-        conn = psycopg2.connect(database_url)
-        cur = conn.cursor()
+        with get_connection() as conn:
+            cur = conn.cursor()
         
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS tracking_codes (
-                id SERIAL PRIMARY KEY,
-                head_code TEXT DEFAULT '',
-                body_code TEXT DEFAULT '',
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS tracking_codes (
+                    id SERIAL PRIMARY KEY,
+                    head_code TEXT DEFAULT '',
+                    body_code TEXT DEFAULT '',
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
         
-        cur.execute("SELECT COUNT(*) FROM tracking_codes")
-        count = cur.fetchone()[0]
-        if count == 0:
-            cur.execute("INSERT INTO tracking_codes (head_code, body_code) VALUES ('', '')")
+            cur.execute("SELECT COUNT(*) FROM tracking_codes")
+            count = cur.fetchone()[0]
+            if count == 0:
+                cur.execute("INSERT INTO tracking_codes (head_code, body_code) VALUES ('', '')")
         
-        conn.commit()
+            conn.commit()
         
-        if method == 'GET':
-            params = event.get('queryStringParameters', {}) or {}
-            admin_password = params.get('admin_password', '')
+            if method == 'GET':
+                params = event.get('queryStringParameters', {}) or {}
+                admin_password = params.get('admin_password', '')
+            
+                correct_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
+            
+                if admin_password != 'none' and admin_password != correct_password:
+                    return {
+                        'statusCode': 403,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'success': False, 'error': 'Invalid admin password'})
+                    }
             
-            correct_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
+                cur.execute("SELECT head_code, body_code FROM tracking_codes LIMIT 1")
+                row = cur.fetchone()
+            
+                head_code = row[0] if row else ''
+                body_code = row[1] if row else ''
             
-            if admin_password != 'none' and admin_password != correct_password:
                 return {
-                    'statusCode': 403,
+                    'statusCode': 200,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
                     'isBase64Encoded': False,
-                    'body': json.dumps({'success': False, 'error': 'Invalid admin password'})
+                    'body': json.dumps({
+                        'success': True,
+                        'head_code': head_code,
+                        'body_code': body_code
+                    })
                 }
+        
+            elif method == 'POST':
+                body_data = json.loads(event.get('body', '{}'))
+                admin_password = body_data.get('admin_password', '')
             
-            cur.execute("SELECT head_code, body_code FROM tracking_codes LIMIT 1")
-            row = cur.fetchone()
+                correct_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
+                if admin_password != correct_password:
+                    return {
+                        'statusCode': 403,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'success': False, 'error': 'Invalid admin password'})
+                    }
             
-            head_code = row[0] if row else ''
-            body_code = row[1] if row else ''
+                head_code = body_data.get('head_code', '')
+                body_code = body_data.get('body_code', '')
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'success': True,
-                    'head_code': head_code,
-                    'body_code': body_code
-                })
-            }
-        
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            admin_password = body_data.get('admin_password', '')
+                cur.execute("""
+                    UPDATE tracking_codes 
+                    SET head_code = %s, body_code = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = 1
+                """, (head_code, body_code))
+            
+                if cur.rowcount == 0:
+                    cur.execute("""
+                        INSERT INTO tracking_codes (id, head_code, body_code) 
+                        VALUES (1, %s, %s)
+                    """, (head_code, body_code))
+            
+                conn.commit()
             
-            correct_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
-            if admin_password != correct_password:
                 return {
-                    'statusCode': 403,
+                    'statusCode': 200,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
                     'isBase64Encoded': False,
-                    'body': json.dumps({'success': False, 'error': 'Invalid admin password'})
+                    'body': json.dumps({'success': True})
                 }
-            
-            head_code = body_data.get('head_code', '')
-            body_code = body_data.get('body_code', '')
-            
-            cur.execute("""
-                UPDATE tracking_codes 
-                SET head_code = %s, body_code = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = 1
-            """, (head_code, body_code))
-            
-            if cur.rowcount == 0:
-                cur.execute("""
-                    INSERT INTO tracking_codes (id, head_code, body_code) 
-                    VALUES (1, %s, %s)
-                """, (head_code, body_code))
-            
-            conn.commit()
-            
+        
             return {
-                'statusCode': 200,
+                'statusCode': 405,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
                 'isBase64Encoded': False,
-                'body': json.dumps({'success': True})
+                'body': json.dumps({'success': False, 'error': 'Method not allowed'})
             }
         
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({'success': False, 'error': 'Method not allowed'})
-        }
-        
     except Exception as e:
         return {
             'statusCode': 500,
@@ -157,6 +157,3 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False,
             'body': json.dumps({'success': False, 'error': str(e)})
         }
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
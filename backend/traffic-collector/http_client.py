@@ -0,0 +1,128 @@
+'''
+Business: Исходящие HTTP-запросы через постоянные keep-alive сессии (отдельная на каждый хост)
+Args: HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_DEFAULT_TIMEOUT из переменных окружения
+Returns: get/post/patch/put/delete/request с интерфейсом requests и stats() с метриками переиспользования,
+         add_governor() - ограничитель частоты запросов к отдельному сервису
+'''
+
+import os
+import threading
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', '4'))
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '10'))
+DEFAULT_TIMEOUT = float(os.environ.get('HTTP_DEFAULT_TIMEOUT', '15'))
+
+# Сессии живут на уровне модуля: тёплый вызов функции не платит за DNS, TCP и TLS заново
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_requests_sent: Dict[str, int] = {}
+# Ограничители частоты: applies_to(url), acquire() перед запросом, observe(status, headers)/observe_error() после
+_governors: List[Any] = []
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+def get_session(url: str) -> requests.Session:
+    '''Возвращает сессию для хоста из url, создавая её при первом обращении'''
+    key = _host_key(url)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[key] = session
+            _requests_sent[key] = 0
+        return session
+
+
+def request(method: str, url: str, **kwargs: Any) -> requests.Response:
+    '''То же, что requests.request, но через общую сессию хоста и с таймаутом по умолчанию'''
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    session = get_session(url)
+    key = _host_key(url)
+    governor = next((g for g in _governors if g.applies_to(url)), None)
+    if governor is None:
+        _requests_sent[key] = _requests_sent.get(key, 0) + 1
+        return session.request(method, url, **kwargs)
+
+    governor.acquire()
+    _requests_sent[key] = _requests_sent.get(key, 0) + 1
+    try:
+        response = session.request(method, url, **kwargs)
+    except requests.RequestException:
+        governor.observe_error()
+        raise
+    governor.observe(response.status_code, response.headers)
+    return response
+
+
+def add_governor(governor: Any):
+    '''Регистрирует ограничитель; повторная регистрация того же объекта игнорируется'''
+    if governor not in _governors:
+        _governors.append(governor)
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return request('POST', url, **kwargs)
+
+
+def put(url: str, **kwargs: Any) -> requests.Response:
+    return request('PUT', url, **kwargs)
+
+
+def patch(url: str, **kwargs: Any) -> requests.Response:
+    return request('PATCH', url, **kwargs)
+
+
+def delete(url: str, **kwargs: Any) -> requests.Response:
+    return request('DELETE', url, **kwargs)
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    '''
+    Метрики по хостам: requests - отправлено запросов, connections - открыто новых
+    соединений, reused - запросов, ушедших по уже открытому соединению
+    '''
+    result = {}
+    for key, session in list(_sessions.items()):
+        connections = 0
+        adapter = session.get_adapter(key + '/')
+        pools = adapter.poolmanager.pools
+        for pool_key in list(pools.keys()):
+            pool = pools.get(pool_key)
+            if pool is not None:
+                connections += pool.num_connections
+        sent = _requests_sent.get(key, 0)
+        result[key] = {
+            'requests': sent,
+            'connections': connections,
+            'reused': max(sent - connections, 0)
+        }
+    return result
+
+
+def close_sessions():
+    '''Закрывает все сессии (для локальных прогонов и бенчмарков)'''
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _requests_sent.clear()
@@ -0,0 +1,322 @@
+'''
+Business: История потребления трафика: сбор счётчиков всех пользователей Remnawave по расписанию,
+          дневной ряд пользователя и топ потребителей без обращения к Remnawave при чтении
+Args: event с httpMethod: POST - проход по /api/users страницами (вызов по расписанию);
+      GET ?username=&days= - дневной ряд; GET ?action=top&days=&limit= - топ (X-Admin-Password)
+Returns: HTTP response со статистикой прохода или данными из traffic_daily
+'''
+
+import json
+import os
+import time
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional
+
+from psycopg2.extras import execute_values
+
+import remnawave_client
+import remnawave_governor
+from db import get_connection
+from remnawave_client import RemnawaveError
+
+# Массовая задача: уступает живым запросам (оплата, личный кабинет) в очереди к Remnawave
+remnawave_governor.set_default_lane(remnawave_governor.LANE_BULK)
+
+PAGE_SIZE = int(os.environ.get('TRAFFIC_PAGE_SIZE', '500'))
+TIME_BUDGET_SECONDS = float(os.environ.get('TRAFFIC_TIME_BUDGET_SECONDS', '25'))
+RETENTION_DAYS = int(os.environ.get('TRAFFIC_RETENTION_DAYS', '400'))
+SERIES_DAYS_DEFAULT = 30
+SERIES_DAYS_MAX = 365
+TOP_LIMIT_DEFAULT = 20
+TOP_LIMIT_MAX = 100
+SWEEP_LOCK_KEY = 'traffic-collector'
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    cors_headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Password',
+        'Access-Control-Max-Age': '86400',
+        'Content-Type': 'application/json'
+    }
+
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    params = event.get('queryStringParameters') or {}
+    headers = event.get('headers') or {}
+
+    try:
+        if method == 'GET' and params.get('action') == 'top':
+            admin_password = headers.get('x-admin-password') or headers.get('X-Admin-Password')
+            if admin_password != os.environ.get('ADMIN_PASSWORD', 'admin123'):
+                return {
+                    'statusCode': 401,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': 'Unauthorized'}),
+                    'isBase64Encoded': False
+                }
+
+            days = _int_param(params.get('days'), SERIES_DAYS_DEFAULT, SERIES_DAYS_MAX)
+            limit = _int_param(params.get('limit'), TOP_LIMIT_DEFAULT, TOP_LIMIT_MAX)
+            return {
+                'statusCode': 200,
+                'headers': cors_headers,
+                'body': json.dumps(top_consumers(days, limit)),
+                'isBase64Encoded': False
+            }
+
+        if method == 'GET':
+            username = params.get('username', '')
+            if not username:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': 'Username required'}),
+                    'isBase64Encoded': False
+                }
+
+            days = _int_param(params.get('days'), SERIES_DAYS_DEFAULT, SERIES_DAYS_MAX)
+            return {
+                'statusCode': 200,
+                'headers': cors_headers,
+                'body': json.dumps(daily_series(username, days)),
+                'isBase64Encoded': False
+            }
+
+        stats = collect_traffic()
+        print(f'📈 Traffic sweep: {stats}')
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': json.dumps({'status': 'ok', **stats}),
+            'isBase64Encoded': False
+        }
+    except RemnawaveError as e:
+        print(f'❌ Remnawave error during traffic sweep: {e.status_code} {e.details}')
+        return {
+            'statusCode': 502,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e), 'details': e.details}),
+            'isBase64Encoded': False
+        }
+    except Exception as e:
+        print(f'❌ Traffic collector error: {str(e)}')
+        return {
+            'statusCode': 500,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def _int_param(raw: Any, default: int, maximum: int) -> int:
+    try:
+        value = int(raw) if raw not in (None, '') else default
+    except (TypeError, ValueError):
+        value = default
+    return max(1, min(value, maximum))
+
+
+def _lifetime_bytes(user: Dict[str, Any]) -> Optional[int]:
+    '''Счётчик за всё время: в новых версиях Remnawave он внутри userTraffic'''
+    value = user.get('lifetimeUsedTrafficBytes')
+    if value is None:
+        value = (user.get('userTraffic') or {}).get('lifetimeUsedTrafficBytes')
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def collect_traffic() -> Dict[str, Any]:
+    '''
+    Проход по /api/users страницами по PAGE_SIZE. Для каждого пользователя приращение
+    счётчика с прошлого прохода прибавляется к строке (username, сегодня) в traffic_daily.
+    Каждая страница коммитится вместе со смещением прохода в traffic_sweeps: вызов, которому
+    не хватило TIME_BUDGET_SECONDS, следующий продолжает с next_start, ничего не посчитав дважды.
+    Очистка счётчиков и traffic_daily - когда проход дошёл до конца списка.
+    '''
+    started = time.monotonic()
+    today = date.today()
+    stats = {'users_seen': 0, 'users_changed': 0, 'bytes_added': 0, 'pages': 0, 'complete': False}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Запуски по расписанию могут наложиться - второй просто выходит
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (SWEEP_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            cursor.close()
+            return {**stats, 'skipped': True}
+
+        try:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM traffic_sweeps WHERE finished_at IS NOT NULL)")
+            has_baseline = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT id, next_start FROM traffic_sweeps WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1"
+            )
+            row = cursor.fetchone()
+            if row:
+                sweep_id, offset = row
+                print(f'⏩ Resuming traffic sweep #{sweep_id} at offset {offset}')
+            else:
+                cursor.execute("INSERT INTO traffic_sweeps DEFAULT VALUES RETURNING id")
+                sweep_id, offset = cursor.fetchone()[0], 0
+            conn.commit()
+            stats['sweep_id'] = sweep_id
+            stats['start'] = offset
+
+            for users, _ in remnawave_client.iter_user_pages(PAGE_SIZE, start=offset):
+                changed, added = _record_page(cursor, users, today, has_baseline)
+                offset += len(users)
+                cursor.execute("""
+                    UPDATE traffic_sweeps
+                    SET next_start = %s, users_seen = users_seen + %s,
+                        users_changed = users_changed + %s, bytes_added = bytes_added + %s
+                    WHERE id = %s
+                """, (offset, len(users), changed, added, sweep_id))
+                conn.commit()
+
+                stats['pages'] += 1
+                stats['users_seen'] += len(users)
+                stats['users_changed'] += changed
+                stats['bytes_added'] += added
+                if time.monotonic() - started >= TIME_BUDGET_SECONDS:
+                    break
+            else:
+                stats['complete'] = True
+
+            if stats['complete']:
+                # Счётчики удалённых (и пересозданных с новым UUID) пользователей больше не нужны.
+                # Смотрим на зеркало, а не на список прохода: offset-страницы могут пропустить
+                # пользователя при удалении соседа, и его счётчик потом посчитался бы заново целиком
+                cursor.execute("""
+                    DELETE FROM traffic_counters c
+                    USING remnawave_users r
+                    WHERE r.uuid = c.user_uuid AND r.deleted_at IS NOT NULL
+                """)
+                cursor.execute("DELETE FROM traffic_daily WHERE day < %s", (today - timedelta(days=RETENTION_DAYS),))
+
+                cursor.execute("UPDATE traffic_sweeps SET finished_at = NOW() WHERE id = %s", (sweep_id,))
+                conn.commit()
+            else:
+                stats['next_start'] = offset
+        finally:
+            # Lock сессионный: снимаем явно, иначе он останется на подключении в пуле
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (SWEEP_LOCK_KEY,))
+            cursor.close()
+
+    stats['duration_ms'] = round((time.monotonic() - started) * 1000)
+    return stats
+
+
+def _record_page(cursor: Any, users: List[Dict[str, Any]], today: date, has_baseline: bool) -> tuple:
+    '''Три запроса на страницу: прошлые счётчики, новые счётчики, дневные приращения'''
+    samples = {}
+    for user in users:
+        lifetime = _lifetime_bytes(user)
+        if user.get('uuid') and user.get('username') and lifetime is not None:
+            samples[user['uuid']] = (user['username'], lifetime)
+    if not samples:
+        return 0, 0
+
+    cursor.execute(
+        "SELECT user_uuid, lifetime_bytes FROM traffic_counters WHERE user_uuid = ANY(%s)",
+        (list(samples),)
+    )
+    previous = dict(cursor.fetchall())
+
+    usage: Dict[str, int] = {}
+    for user_uuid, (username, lifetime) in samples.items():
+        before = previous.get(user_uuid)
+        if before is None:
+            # Новый UUID после первого прохода - пользователь создан с прошлого прохода, весь счётчик его
+            delta = lifetime if has_baseline else 0
+        elif lifetime >= before:
+            delta = lifetime - before
+        else:
+            # Счётчик сбросили в Remnawave - считаем с нуля
+            delta = lifetime
+        if delta:
+            usage[username] = usage.get(username, 0) + delta
+
+    counter_rows = [
+        (user_uuid, username, lifetime)
+        for user_uuid, (username, lifetime) in samples.items()
+        if previous.get(user_uuid) != lifetime
+    ]
+    if counter_rows:
+        execute_values(cursor, """
+            INSERT INTO traffic_counters (user_uuid, username, lifetime_bytes, sampled_at)
+            VALUES %s
+            ON CONFLICT (user_uuid) DO UPDATE
+            SET username = EXCLUDED.username, lifetime_bytes = EXCLUDED.lifetime_bytes, sampled_at = NOW()
+        """, counter_rows, template='(%s, %s, %s, NOW())', page_size=PAGE_SIZE)
+
+    if usage:
+        execute_values(cursor, """
+            INSERT INTO traffic_daily (username, day, bytes)
+            VALUES %s
+            ON CONFLICT (username, day) DO UPDATE
+            SET bytes = traffic_daily.bytes + EXCLUDED.bytes
+        """, [(username, today, delta) for username, delta in usage.items()], page_size=PAGE_SIZE)
+
+    return len(usage), sum(usage.values())
+
+
+def daily_series(username: str, days: int) -> Dict[str, Any]:
+    '''Ряд за последние days дней, включая сегодня; дни без трафика - нули'''
+    first_day = date.today() - timedelta(days=days - 1)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT day, bytes FROM traffic_daily
+            WHERE username = %s AND day >= %s
+            ORDER BY day
+        """, (username, first_day))
+        by_day = dict(cursor.fetchall())
+        cursor.close()
+
+    series = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        series.append({'date': day.isoformat(), 'bytes': int(by_day.get(day, 0))})
+
+    return {
+        'username': username,
+        'days': days,
+        'series': series,
+        'total_bytes': sum(point['bytes'] for point in series)
+    }
+
+
+def top_consumers(days: int, limit: int) -> Dict[str, Any]:
+    first_day = date.today() - timedelta(days=days - 1)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT username, SUM(bytes) AS total_bytes
+            FROM traffic_daily
+            WHERE day >= %s
+            GROUP BY username
+            ORDER BY total_bytes DESC, username
+            LIMIT %s
+        """, (first_day, limit))
+        rows = cursor.fetchall()
+        cursor.execute("SELECT MAX(finished_at) FROM traffic_sweeps")
+        last_sweep = cursor.fetchone()[0]
+        cursor.close()
+
+    return {
+        'days': days,
+        'users': [{'username': username, 'bytes': int(total)} for username, total in rows],
+        'last_sweep_at': last_sweep.isoformat() if last_sweep else None
+    }
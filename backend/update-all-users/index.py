@@ -1,19 +1,37 @@
+'''
+Business: Fleet-wide traffic limit change: streams all Remnawave users page by page and applies
+          trafficLimitBytes/trafficLimitStrategy to those that differ, in chunks through the bulk endpoint
+Args: event with httpMethod POST, X-Admin-Key header, body {traffic_limit_bytes | traffic_limit_gb,
+      traffic_limit_strategy, dry_run (default true), start - offset to resume from}
+Returns: Diff (dry run) or per-chunk progress with throughput; complete=false and next_start
+         when the time budget ran out - call again with start=next_start
+'''
+
 import json
 import os
-import requests
-from typing import Dict, Any
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+import remnawave_client
+import remnawave_governor
+from db import get_connection
+from remnawave_client import RemnawaveError
+from remnawave_mirror import upsert_users
+
+# Массовая задача: уступает живым запросам (оплата, личный кабинет) в очереди к Remnawave
+remnawave_governor.set_default_lane(remnawave_governor.LANE_BULK)
+
+PAGE_SIZE = int(os.environ.get('BULK_UPDATE_PAGE_SIZE', '500'))
+CHUNK_SIZE = int(os.environ.get('BULK_UPDATE_CHUNK_SIZE', '100'))
+WORKERS = int(os.environ.get('BULK_UPDATE_WORKERS', '8'))
+TIME_BUDGET_SECONDS = float(os.environ.get('BULK_UPDATE_TIME_BUDGET_SECONDS', '25'))
+DIFF_SAMPLE_LIMIT = 20
+STRATEGIES = ('NO_RESET', 'DAY', 'WEEK', 'MONTH')
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Business: Update all users traffic limits using BULK UPDATE endpoint
-    Args: event - dict with httpMethod, context - Cloud Function execution context  
-    Returns: HTTP response dict with update results
-    Version: 4.0.0 - BULK UPDATE
-    '''
-    print(f'🚀 VERSION 4.0.0 - BULK UPDATE ENDPOINT TEST')
-    print(f'🔧 Method: {event.get("httpMethod", "NONE")}')
     method: str = event.get('httpMethod', 'POST')
-    
+
     cors_headers = {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'POST, OPTIONS',
@@ -21,7 +39,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'Access-Control-Max-Age': '86400',
         'Content-Type': 'application/json'
     }
-    
+
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
@@ -29,169 +47,270 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': '',
             'isBase64Encoded': False
         }
-    
-    if method == 'POST':
-        remnawave_url = os.environ.get('REMNAWAVE_API_URL', '').rstrip('/')
-        remnawave_token = os.environ.get('REMNAWAVE_API_TOKEN', '')
-        
-        if not remnawave_url or not remnawave_token:
-            return {
-                'statusCode': 500,
-                'headers': cors_headers,
-                'body': json.dumps({'error': 'Remnawave API not configured'}),
-                'isBase64Encoded': False
-            }
-        
-        headers = {
-            'Authorization': f'Bearer {remnawave_token}',
-            'Content-Type': 'application/json'
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    headers = event.get('headers', {})
+    admin_key = headers.get('X-Admin-Key', headers.get('x-admin-key', ''))
+    expected_key = os.environ.get('ADMIN_PASSWORD', '')
+
+    if not admin_key or admin_key != expected_key:
+        return {
+            'statusCode': 403,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+
+    if not remnawave_client.is_configured():
+        return {
+            'statusCode': 500,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Remnawave API not configured'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        body_data = json.loads(event.get('body') or '{}')
+    except json.JSONDecodeError:
+        body_data = {}
+
+    fields, error = parse_target(body_data)
+    if error:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': error}),
+            'isBase64Encoded': False
+        }
+
+    dry_run = body_data.get('dry_run', True) is not False
+    try:
+        start = max(0, int(body_data.get('start') or 0))
+    except (TypeError, ValueError):
+        start = 0
+
+    try:
+        result = update_traffic_limits(fields, dry_run, start)
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': json.dumps(result),
+            'isBase64Encoded': False
         }
-        
+    except RemnawaveError as e:
+        print(f'❌ Remnawave error: {e.status_code} {e.details}')
+        return {
+            'statusCode': 502,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e), 'details': e.details}),
+            'isBase64Encoded': False
+        }
+    except Exception as e:
+        print(f'💥 CRITICAL ERROR: {str(e)}')
+        return {
+            'statusCode': 500,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def parse_target(body_data: Dict[str, Any]) -> tuple:
+    '''Returns (fields for Remnawave, error message)'''
+    limit = body_data.get('traffic_limit_bytes')
+    if limit is None and body_data.get('traffic_limit_gb') is not None:
         try:
-            # Получаем ПЕРВОГО пользователя
-            print('🔍 Fetching first user...')
-            users_response = requests.get(
-                f'{remnawave_url}/api/users?limit=1',
-                headers=headers,
-                timeout=15
-            )
-            
-            print(f'📡 Users API Response: {users_response.status_code}')
-            users_data = users_response.json()
-            print(f'📦 Full Response: {json.dumps(users_data, indent=2)}')
-            
-            # Извлекаем первого пользователя
-            if 'response' in users_data and 'users' in users_data['response']:
-                first_user = users_data['response']['users'][0] if users_data['response']['users'] else None
-            elif 'users' in users_data:
-                first_user = users_data['users'][0] if users_data['users'] else None
-            elif isinstance(users_data, list):
-                first_user = users_data[0] if users_data else None
-            else:
-                first_user = None
-            
-            if not first_user:
-                return {
-                    'statusCode': 500,
-                    'headers': cors_headers,
-                    'body': json.dumps({'error': 'No users found'}),
-                    'isBase64Encoded': False
-                }
-            
-            print('=' * 80)
-            print('👤 FIRST USER DATA:')
-            print(json.dumps(first_user, indent=2))
-            print('=' * 80)
-            
-            test_username = first_user.get('username')
-            test_uuid = first_user.get('uuid')
-            
-            print(f'🧪 Test username: {test_username}')
-            print(f'🧪 Test UUID: {test_uuid}')
-            
-            # Тестовый payload (разные варианты названий полей)
-            test_payload_v1 = {
-                'data_limit': 32212254720,
-                'data_limit_reset_strategy': 'day'
-            }
-            
-            test_payload_v2 = {
-                'trafficLimitBytes': 32212254720,
-                'trafficLimitStrategy': 'DAY'
-            }
-            
-            # Попробуем BULK UPDATE endpoint (как в Rust SDK)
-            print('\n' + '=' * 80)
-            print('🚀 TESTING BULK UPDATE ENDPOINTS')
-            print('=' * 80)
-            
-            bulk_payload = {
-                'users': [
-                    {
-                        'uuid': test_uuid,
-                        'data_limit': 32212254720,
-                        'data_limit_reset_strategy': 'day'
-                    }
-                ]
-            }
-            
-            test_results = []
-            
-            # Test 1: POST /api/users/bulk/update
-            print('\n🧪 TEST 1: POST /api/users/bulk/update')
-            try:
-                r1 = requests.post(f'{remnawave_url}/api/users/bulk/update', headers=headers, json=bulk_payload, timeout=15)
-                print(f'✅ Status: {r1.status_code}')
-                print(f'📦 Response: {r1.text[:500]}')
-                test_results.append({
-                    'test': 'POST /api/users/bulk/update',
-                    'status': r1.status_code,
-                    'response': r1.text[:500]
-                })
-            except Exception as e:
-                print(f'❌ ERROR: {str(e)}')
-                test_results.append({'test': 'POST /api/users/bulk/update', 'error': str(e)})
-            
-            # Test 2: POST /api/users/bulk (без /update)
-            print('\n🧪 TEST 2: POST /api/users/bulk')
-            try:
-                r2 = requests.post(f'{remnawave_url}/api/users/bulk', headers=headers, json=bulk_payload, timeout=15)
-                print(f'✅ Status: {r2.status_code}')
-                print(f'📦 Response: {r2.text[:500]}')
-                test_results.append({
-                    'test': 'POST /api/users/bulk',
-                    'status': r2.status_code,
-                    'response': r2.text[:500]
-                })
-            except Exception as e:
-                print(f'❌ ERROR: {str(e)}')
-                test_results.append({'test': 'POST /api/users/bulk', 'error': str(e)})
-            
-            # Test 3: PATCH /api/users/bulk
-            print('\n🧪 TEST 3: PATCH /api/users/bulk')
-            try:
-                r3 = requests.patch(f'{remnawave_url}/api/users/bulk', headers=headers, json=bulk_payload, timeout=15)
-                print(f'✅ Status: {r3.status_code}')
-                print(f'📦 Response: {r3.text[:500]}')
-                test_results.append({
-                    'test': 'PATCH /api/users/bulk',
-                    'status': r3.status_code,
-                    'response': r3.text[:500]
+            limit = int(float(body_data['traffic_limit_gb']) * 1024 ** 3)
+        except (TypeError, ValueError):
+            return None, 'traffic_limit_gb must be a number'
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+        return None, 'traffic_limit_bytes (or traffic_limit_gb) must be a non-negative integer'
+
+    fields: Dict[str, Any] = {'trafficLimitBytes': limit}
+    strategy = body_data.get('traffic_limit_strategy')
+    if strategy:
+        strategy = str(strategy).upper()
+        if strategy not in STRATEGIES:
+            return None, f'traffic_limit_strategy must be one of {", ".join(STRATEGIES)}'
+        fields['trafficLimitStrategy'] = strategy
+    return fields, None
+
+
+def needs_update(user: Dict[str, Any], fields: Dict[str, Any]) -> bool:
+    return any(user.get(key) != value for key, value in fields.items())
+
+
+def update_traffic_limits(fields: Dict[str, Any], dry_run: bool, start: int) -> Dict[str, Any]:
+    '''
+    One pass over /api/users from offset start. Differing users of each page go to Remnawave
+    in chunks of CHUNK_SIZE: POST /api/users/bulk/update, or WORKERS parallel PATCHes when the
+    panel has no bulk endpoint. Only one page of users is kept in memory.
+    '''
+    started = time.monotonic()
+    stats = {'scanned': 0, 'matched': 0, 'updated': 0, 'failed': 0}
+    diff: Dict[str, int] = {}
+    samples: List[Dict[str, Any]] = []
+    chunks: List[Dict[str, Any]] = []
+    errors: List[Dict[str, Any]] = []
+    state = {'bulk_supported': True}
+    offset = start
+    total = 0
+    complete = True
+
+    mode = 'dry run' if dry_run else 'update'
+    print(f'🚀 Traffic limit {mode}: {fields}, starting at offset {start}')
+
+    for users, total in remnawave_client.iter_user_pages(PAGE_SIZE, start=start):
+        page_start = offset
+        offset += len(users)
+        stats['scanned'] += len(users)
+        targets = [u for u in users if u.get('uuid') and needs_update(u, fields)]
+        stats['matched'] += len(targets)
+
+        if dry_run:
+            for user in targets:
+                key = f'{user.get("trafficLimitBytes")}/{user.get("trafficLimitStrategy")}'
+                diff[key] = diff.get(key, 0) + 1
+                if len(samples) < DIFF_SAMPLE_LIMIT:
+                    samples.append({
+                        'username': user.get('username'),
+                        'uuid': user.get('uuid'),
+                        'from': {key: user.get(key) for key in fields},
+                        'to': fields
+                    })
+        else:
+            for i in range(0, len(targets), CHUNK_SIZE):
+                chunk = apply_chunk(targets[i:i + CHUNK_SIZE], fields, state)
+                stats['updated'] += chunk['updated']
+                stats['failed'] += len(chunk['errors'])
+                errors.extend(chunk['errors'])
+                elapsed = time.monotonic() - started
+                chunks.append({
+                    'offset': page_start,
+                    'size': chunk['size'],
+                    'updated': chunk['updated'],
+                    'failed': len(chunk['errors']),
+                    'method': chunk['method'],
+                    'ms': chunk['ms']
                 })
-            except Exception as e:
-                print(f'❌ ERROR: {str(e)}')
-                test_results.append({'test': 'PATCH /api/users/bulk', 'error': str(e)})
-            
-            print('\n' + '=' * 80)
-            print('✅ BULK TESTS COMPLETED')
-            print('=' * 80)
-            
+                print(f'📦 Chunk {len(chunks)}: {chunk["updated"]}/{chunk["size"]} via {chunk["method"]} '
+                      f'in {chunk["ms"]}ms, scanned {offset}/{total}, '
+                      f'{round(stats["updated"] / elapsed, 1) if elapsed else 0} updates/s')
+                if i + CHUNK_SIZE < len(targets) and elapsed >= TIME_BUDGET_SECONDS:
+                    # Повтор страницы безопасен: обновлённые уже не отличаются от цели
+                    offset = page_start
+                    complete = False
+                    break
+            if not complete:
+                break
+
+        if offset < total and time.monotonic() - started >= TIME_BUDGET_SECONDS:
+            complete = False
+            break
+
+    duration = time.monotonic() - started
+    result: Dict[str, Any] = {
+        'success': True,
+        'dry_run': dry_run,
+        'fields': fields,
+        'total_users': total,
+        **stats,
+        'complete': complete,
+        'next_start': None if complete else offset,
+        'duration_ms': round(duration * 1000),
+        'users_per_second': round(stats['scanned'] / duration, 1) if duration else 0.0,
+        'updates_per_second': round(stats['updated'] / duration, 1) if duration else 0.0
+    }
+    if dry_run:
+        # Сколько пользователей изменится, по текущим значениям "лимит/стратегия"
+        result['diff'] = diff
+        result['samples'] = samples
+    else:
+        result['bulk_endpoint'] = state['bulk_supported']
+        result['chunks'] = chunks
+        result['errors'] = errors[:DIFF_SAMPLE_LIMIT]
+
+    print(f'🏁 {mode}: scanned {stats["scanned"]}, matched {stats["matched"]}, updated {stats["updated"]}, '
+          f'failed {stats["failed"]} in {result["duration_ms"]}ms')
+    print(f'🚦 Remnawave governor: {remnawave_governor.stats()}')
+    return result
+
+
+def apply_chunk(users: List[Dict[str, Any]], fields: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+    '''One bulk request for the chunk; parallel PATCHes if the bulk endpoint is missing or failed'''
+    chunk_started = time.monotonic()
+    uuids = [u['uuid'] for u in users]
+
+    if state['bulk_supported']:
+        try:
+            updated = remnawave_client.bulk_update_users(uuids, fields)
+            save_mirror_fields(uuids, fields)
             return {
-                'statusCode': 200,
-                'headers': cors_headers,
-                'body': json.dumps({
-                    'message': 'API endpoint tests completed',
-                    'test_user': {
-                        'username': test_username,
-                        'uuid': test_uuid
-                    },
-                    'test_results': test_results
-                }, indent=2),
-                'isBase64Encoded': False
+                'size': len(users),
+                'updated': updated,
+                'errors': [],
+                'method': 'bulk',
+                'ms': round((time.monotonic() - chunk_started) * 1000)
             }
-            
+        except RemnawaveError as e:
+            if e.status_code in (400, 404, 405):
+                # Панель без bulk-эндпоинта (или другой формат) - дальше только PATCH
+                print(f'⚠️ Bulk update unavailable ({e.status_code}), falling back to PATCH')
+                state['bulk_supported'] = False
+            else:
+                print(f'⚠️ Bulk update failed for chunk ({e.status_code}), retrying with PATCH')
+
+    def patch_one(user: Dict[str, Any]) -> tuple:
+        try:
+            return remnawave_client.patch_user(user['uuid'], fields), None
         except Exception as e:
-            print(f'💥 CRITICAL ERROR: {str(e)}')
-            return {
-                'statusCode': 500,
-                'headers': cors_headers,
-                'body': json.dumps({'error': str(e)}),
-                'isBase64Encoded': False
-            }
-    
+            details = e.details if isinstance(e, RemnawaveError) else ''
+            return None, {'username': user.get('username'), 'uuid': user['uuid'], 'error': details or str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(WORKERS, len(users)))) as pool:
+        results = list(pool.map(patch_one, users))
+
+    patched = [user for user, _ in results if user]
+    if patched:
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                upsert_users(cursor, patched)
+                cursor.close()
+        except Exception as e:
+            print(f'⚠️ Failed to update Remnawave mirror: {str(e)}')
+
     return {
-        'statusCode': 405,
-        'headers': cors_headers,
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+        'size': len(users),
+        'updated': len(patched),
+        'errors': [error for _, error in results if error],
+        'method': 'patch',
+        'ms': round((time.monotonic() - chunk_started) * 1000)
+    }
+
+
+def save_mirror_fields(uuids: List[str], fields: Dict[str, Any]):
+    '''
+    Bulk endpoint returns only affectedRows: write the new limit into the mirror directly.
+    remnawave_updated_at stays old, so the next sync-uuids rewrites these rows in full.
+    '''
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE remnawave_users
+                SET traffic_limit_bytes = %s,
+                    traffic_limit_strategy = COALESCE(%s, traffic_limit_strategy),
+                    synced_at = NOW()
+                WHERE uuid = ANY(%s)
+            """, (fields['trafficLimitBytes'], fields.get('trafficLimitStrategy'), uuids))
+            cursor.close()
+    except Exception as e:
+        print(f'⚠️ Failed to update Remnawave mirror: {str(e)}')
@@ -0,0 +1,370 @@
+'''
+Business: Локальные заглушки внешних сервисов для бенчмарков и тестов (ЮKassa, Remnawave, send-email, activate-referral)
+Args: задержка ответа, доля ошибок 5xx, лимит запросов в секунду (сверх него 429), число синтетических пользователей
+Returns: start_stub() - HTTP-сервер в фоновом потоке, base_url для подстановки в переменные окружения;
+         запуск из командной строки поднимает отдельный сервис на localhost
+
+Запуск (Remnawave на 10 000 пользователей, 30 мс, 1% ошибок, не больше 50 запросов в секунду):
+    python benchmarks/stubs.py remnawave --port 8099 --users 10000 --latency-ms 30 --error-rate 0.01 --rate-limit 50
+'''
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+Route = Callable[[str, str, Dict[str, Any]], Tuple[int, Any]]
+
+
+class StubServer:
+    '''
+    HTTP-сервер с задержкой ответа (latency_ms +- jitter_ms) и внедрением сбоев:
+    error_rate - доля ответов 503, rate_limit - запросов в секунду, сверх которых отвечает 429 с Retry-After
+    '''
+
+    def __init__(self, name: str, route: Route, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, rate_limit: float = 0.0, host: str = '127.0.0.1', port: int = 0,
+                 random_seed: int = 0):
+        self.name = name
+        self.route = route
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.injected_errors = 0
+        self.throttled = 0
+        self._rng = random.Random(random_seed)
+        self._tokens = max(rate_limit, 1.0)
+        self._tokens_updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _fault(self) -> Optional[Tuple[int, Any, Dict[str, str]]]:
+        '''Сбой для очередного запроса или None'''
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit > 0:
+                now = time.monotonic()
+                self._tokens = min(max(self.rate_limit, 1.0), self._tokens + (now - self._tokens_updated) * self.rate_limit)
+                self._tokens_updated = now
+                if self._tokens < 1:
+                    self.throttled += 1
+                    return 429, {'message': 'Too many requests'}, {'Retry-After': '1'}
+                self._tokens -= 1
+            if self.error_rate > 0 and self._rng.random() < self.error_rate:
+                self.injected_errors += 1
+                return 503, {'message': 'Injected failure'}, {}
+        return None
+
+    def _delay(self) -> float:
+        if not self.latency_ms and not self.jitter_ms:
+            return 0.0
+        with self._lock:
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def stats(self) -> Dict[str, int]:
+        return {'requests': self.requests, 'injected_errors': self.injected_errors, 'throttled': self.throttled}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'StubServer':
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    body = {}
+
+                fault = stub._fault()
+                delay = stub._delay()
+                if delay:
+                    time.sleep(delay)
+
+                extra_headers: Dict[str, str] = {}
+                if fault:
+                    status, payload, extra_headers = fault
+                else:
+                    status, payload = stub.route(self.command, self.path, body)
+                data = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for header, value in extra_headers.items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _handle
+
+            def log_message(self, format: str, *args: Any):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f'stub-{self.name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def yookassa_route() -> Route:
+    '''POST /v3/payments - создаёт платёж в статусе pending'''
+    def route(method: str, path: str, body: Dict[str, Any]) -> Tuple[int, Any]:
+        if method == 'POST' and path.rstrip('/').endswith('/payments'):
+            payment_id = str(uuid.uuid4())
+            return 200, {
+                'id': payment_id,
+                'status': 'pending',
+                'paid': False,
+                'amount': body.get('amount', {}),
+                'metadata': body.get('metadata', {}),
+                'confirmation': {
+                    'type': 'redirect',
+                    'confirmation_url': f'https://yookassa.stub/checkout/{payment_id}'
+                },
+                'receipt_registration': 'pending'
+            }
+        return 404, {'type': 'error', 'code': 'not_found'}
+    return route
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+# Старые имена полей из update-all-users -> поля Remnawave API
+_LEGACY_FIELDS = {'data_limit': 'trafficLimitBytes', 'data_limit_reset_strategy': 'trafficLimitStrategy'}
+
+
+def _user_fields(body: Dict[str, Any]) -> Dict[str, Any]:
+    fields = {}
+    for key, value in body.items():
+        key = _LEGACY_FIELDS.get(key, key)
+        if key == 'trafficLimitStrategy' and isinstance(value, str):
+            value = value.upper()
+        if key == 'inboundUuids':
+            key = 'activeInternalSquads'
+        if key == 'activeInternalSquads':
+            value = [{'uuid': s} for s in value or []]
+        if key in ('expireAt', 'status', 'trafficLimitBytes', 'trafficLimitStrategy', 'activeInternalSquads',
+                   'description', 'email', 'telegramId', 'tag'):
+            fields[key] = value
+    return fields
+
+
+def remnawave_route(seed_users: int = 0, traffic_step_bytes: int = 0, squads: Optional[List[str]] = None,
+                    random_seed: int = 0) -> Route:
+    '''
+    Remnawave API в памяти: пользователи (с seed_users синтетическими), internal squads, bulk-обновления.
+    traffic_step_bytes > 0 - при каждой выдаче в списке счётчик трафика пользователя растёт
+    на случайную величину до этого значения (для traffic-collector).
+    '''
+    rng = random.Random(random_seed)
+    squad_uuids = squads or ['e742f30b-82fb-431a-918b-1b4d22d6ba4d']
+    users: Dict[str, Dict[str, Any]] = {}
+    uuid_by_username: Dict[str, str] = {}
+    lock = threading.Lock()
+
+    def add_user(body: Dict[str, Any]) -> Dict[str, Any]:
+        user_uuid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        now = _now_iso()
+        user = {
+            'uuid': user_uuid,
+            'shortUuid': user_uuid[:8],
+            'username': body.get('username'),
+            'status': 'ACTIVE',
+            'expireAt': body.get('expireAt'),
+            'createdAt': now,
+            'updatedAt': now,
+            'trafficLimitBytes': body.get('trafficLimitBytes', 0),
+            'trafficLimitStrategy': body.get('trafficLimitStrategy', 'NO_RESET'),
+            'usedTrafficBytes': 0,
+            'lifetimeUsedTrafficBytes': 0,
+            'subscriptionUrl': f'https://sub.stub/{user_uuid[:8]}',
+            'activeInternalSquads': [{'uuid': s} for s in body.get('activeInternalSquads') or []]
+        }
+        users[user_uuid] = user
+        uuid_by_username[user['username']] = user_uuid
+        return user
+
+    def update_user(user: Dict[str, Any], fields: Dict[str, Any]):
+        user.update(fields)
+        user['updatedAt'] = _now_iso()
+
+    def remove_user(user_uuid: str):
+        user = users.pop(user_uuid)
+        uuid_by_username.pop(user['username'], None)
+
+    def by_username(username: str) -> Optional[Dict[str, Any]]:
+        user_uuid = uuid_by_username.get(username)
+        return users.get(user_uuid) if user_uuid else None
+
+    def grow_traffic(page: List[Dict[str, Any]]):
+        if not traffic_step_bytes:
+            return
+        for user in page:
+            step = rng.randint(0, traffic_step_bytes)
+            user['usedTrafficBytes'] += step
+            user['lifetimeUsedTrafficBytes'] += step
+
+    for i in range(seed_users):
+        expire_days = rng.randint(-30, 365)
+        user = add_user({
+            'username': f'user{i:06d}',
+            'expireAt': (datetime.now(timezone.utc) + timedelta(days=expire_days)).isoformat().replace('+00:00', 'Z'),
+            'trafficLimitBytes': 32212254720,
+            'trafficLimitStrategy': 'DAY',
+            'activeInternalSquads': [rng.choice(squad_uuids)]
+        })
+        user['lifetimeUsedTrafficBytes'] = rng.randint(0, 50 * 1024 ** 3)
+        if expire_days < 0:
+            user['status'] = 'EXPIRED'
+
+    def bulk_update(body: Dict[str, Any], all_users: bool = False) -> Tuple[int, Any]:
+        '''{uuids, fields} (Remnawave), {fields} для всех или [{uuid, ...}] (варианты из update-all-users)'''
+        if all_users:
+            targets = [(user, _user_fields(body.get('fields', body))) for user in users.values()]
+        elif 'users' in body:
+            targets = [(users.get(item.get('uuid')), _user_fields(item)) for item in body.get('users') or []]
+        else:
+            fields = _user_fields(body.get('fields') or {})
+            targets = [(users.get(user_uuid), fields) for user_uuid in body.get('uuids') or []]
+
+        affected = 0
+        for user, fields in targets:
+            if user is not None and fields:
+                update_user(user, fields)
+                affected += 1
+        return 200, {'response': {'affectedRows': affected}}
+
+    def route(method: str, path: str, body: Dict[str, Any]) -> Tuple[int, Any]:
+        parsed = urlsplit(path)
+        path = parsed.path.rstrip('/')
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+
+        with lock:
+            if path == '/api/internal-squads' and method == 'GET':
+                return 200, {'response': {
+                    'total': len(squad_uuids),
+                    'internalSquads': [{'uuid': s, 'name': f'squad-{s[:8]}'} for s in squad_uuids]
+                }}
+
+            if path == '/api/users' and method == 'GET':
+                if query.get('username'):
+                    user = by_username(query['username'])
+                    page = [user] if user else []
+                    return 200, {'response': {'users': page, 'total': len(page)}}
+                start = int(query.get('start', 0))
+                size = int(query['size']) if 'size' in query else len(users)
+                ordered: Iterable[Dict[str, Any]] = users.values()
+                for sort in reversed(json.loads(query.get('sorting') or '[]')):
+                    ordered = sorted(ordered, key=lambda u, key=sort.get('id'): u.get(key) or '', reverse=bool(sort.get('desc')))
+                page = list(islice(ordered, start, start + size))
+                grow_traffic(page)
+                return 200, {'response': {'users': page, 'total': len(users)}}
+
+            if path == '/api/users' and method == 'POST':
+                if by_username(body.get('username', '')):
+                    return 400, {'message': 'User username already exists'}
+                return 201, {'response': add_user(body)}
+
+            if path in ('/api/users/bulk/update', '/api/users/bulk') and method in ('POST', 'PATCH'):
+                return bulk_update(body)
+
+            if path == '/api/users/bulk/all/update' and method == 'POST':
+                return bulk_update(body, all_users=True)
+
+            if (path.startswith('/api/users/by-username/') or path.startswith('/api/user/')) and method == 'GET':
+                user = by_username(path.rsplit('/', 1)[1])
+                return (200, {'response': user}) if user else (404, {'message': 'User not found'})
+
+            if path.startswith('/api/users/'):
+                user_uuid = path.rsplit('/', 1)[1]
+                user = users.get(user_uuid)
+                if not user:
+                    return 404, {'message': 'User not found'}
+                if method == 'GET':
+                    return 200, {'response': user}
+                if method == 'DELETE':
+                    remove_user(user_uuid)
+                    return 200, {'response': {'isDeleted': True}}
+                if method == 'PATCH':
+                    update_user(user, _user_fields(body))
+                    return 200, {'response': user}
+
+        return 404, {'message': f'{method} {path} not found'}
+    return route
+
+
+def ok_route() -> Route:
+    '''Любой POST - 200 {"success": true} (send-email, activate-referral)'''
+    def route(method: str, path: str, body: Dict[str, Any]) -> Tuple[int, Any]:
+        return 200, {'success': True}
+    return route
+
+
+def start_stub(name: str, route: Route, latency_ms: float = 0.0, **faults: Any) -> StubServer:
+    '''faults: jitter_ms, error_rate, rate_limit, host, port, random_seed - см. StubServer'''
+    return StubServer(name, route, latency_ms, **faults).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of an external service')
+    parser.add_argument('service', choices=['remnawave', 'yookassa', 'ok'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--users', type=int, default=0, help='synthetic Remnawave users to seed')
+    parser.add_argument('--traffic-step-bytes', type=int, default=0,
+                        help='max traffic added to a user each time it is listed')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='requests per second before 429')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.service == 'remnawave':
+        route = remnawave_route(seed_users=args.users, traffic_step_bytes=args.traffic_step_bytes, random_seed=args.seed)
+    elif args.service == 'yookassa':
+        route = yookassa_route()
+    else:
+        route = ok_route()
+
+    stub = start_stub(args.service, route, args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                      rate_limit=args.rate_limit, host=args.host, port=args.port, random_seed=args.seed)
+    print(f'{args.service} stub listening on {stub.base_url} (Ctrl+C to stop)')
+    try:
+        while True:
+            time.sleep(60)
+            print(f'{args.service} stub: {stub.stats()}')
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+-- Очередь задач выдачи подписки после оплаты (outbox для webhook ЮКассы)
+CREATE TABLE IF NOT EXISTS provisioning_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    job_type VARCHAR(50) NOT NULL,
+    payment_id VARCHAR(255) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 8,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    locked_until TIMESTAMP,
+    last_error TEXT,
+    result JSONB,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW(),
+    completed_at TIMESTAMP,
+    UNIQUE(payment_id, job_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_provisioning_outbox_due ON provisioning_outbox(next_attempt_at) WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_provisioning_outbox_status ON provisioning_outbox(status, created_at DESC);
+
+COMMENT ON TABLE provisioning_outbox IS 'Задачи после оплаты: создание/продление в Remnawave, реферальный бонус, письмо';
+COMMENT ON COLUMN provisioning_outbox.job_type IS 'provision, referral или welcome_email';
+COMMENT ON COLUMN provisioning_outbox.status IS 'pending, processing, done или failed';
+COMMENT ON COLUMN provisioning_outbox.locked_until IS 'Время, после которого зависшая задача снова доступна воркеру';
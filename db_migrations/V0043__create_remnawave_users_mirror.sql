@@ -0,0 +1,32 @@
+-- Локальное зеркало пользователей Remnawave для поиска по username/UUID без выгрузки всего списка
+CREATE TABLE IF NOT EXISTS remnawave_users (
+    uuid VARCHAR(64) PRIMARY KEY,
+    username VARCHAR(255) NOT NULL,
+    short_uuid VARCHAR(64),
+    status VARCHAR(32),
+    expire_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ,
+    traffic_limit_bytes BIGINT,
+    traffic_limit_strategy VARCHAR(32),
+    used_traffic_bytes BIGINT,
+    subscription_url TEXT,
+    internal_squads JSONB NOT NULL DEFAULT '[]',
+    remnawave_updated_at TIMESTAMPTZ,
+    synced_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    deleted_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_remnawave_users_username ON remnawave_users(username) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_remnawave_users_expire_at ON remnawave_users(expire_at) WHERE deleted_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS remnawave_sync_state (
+    name VARCHAR(64) PRIMARY KEY,
+    last_synced_at TIMESTAMP,
+    total_users INTEGER DEFAULT 0,
+    changed_users INTEGER DEFAULT 0
+);
+
+COMMENT ON TABLE remnawave_users IS 'Зеркало пользователей Remnawave: обновляется sync-uuids и при каждом создании/продлении/удалении';
+COMMENT ON COLUMN remnawave_users.internal_squads IS 'UUID активных internal squads';
+COMMENT ON COLUMN remnawave_users.deleted_at IS 'Пользователь удалён в Remnawave (или пересоздан с новым UUID)';
+COMMENT ON TABLE remnawave_sync_state IS 'Время последней полной синхронизации зеркала';
@@ -0,0 +1,11 @@
+-- Обработанные уведомления ЮKassa: повторная доставка того же события отсекается по первичному ключу
+CREATE TABLE IF NOT EXISTS processed_payment_events (
+    payment_id VARCHAR(255) NOT NULL,
+    event VARCHAR(64) NOT NULL,
+    processed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (payment_id, event)
+);
+
+CREATE INDEX IF NOT EXISTS idx_processed_payment_events_processed_at ON processed_payment_events(processed_at);
+
+COMMENT ON TABLE processed_payment_events IS 'Идемпотентность webhook: одна строка на пару (payment_id, event)';
@@ -0,0 +1,10 @@
+-- Версия каталога тарифов и локаций: функции держат каталог в памяти и перечитывают его только при смене версии
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO catalog_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+COMMENT ON TABLE catalog_version IS 'Одна строка; version увеличивается при каждом изменении subscription_plans или locations';
@@ -0,0 +1,9 @@
+-- Keyset-пагинация истории платежей по (created_at, id): created_at становится обязательным
+UPDATE payments SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL;
+ALTER TABLE payments ALTER COLUMN created_at SET NOT NULL;
+
+-- История одного пользователя (личный кабинет)
+CREATE INDEX IF NOT EXISTS idx_payments_username_keyset ON payments(username, created_at DESC, id DESC);
+
+-- Вся таблица (админка)
+CREATE INDEX IF NOT EXISTS idx_payments_keyset ON payments(created_at DESC, id DESC);
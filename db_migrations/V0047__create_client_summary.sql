@@ -0,0 +1,28 @@
+-- Сводка по клиентам для админки: обновляется при изменении платежей клиента, не требует GROUP BY по payments
+CREATE TABLE IF NOT EXISTS client_summary (
+    username VARCHAR(255) PRIMARY KEY,
+    email VARCHAR(255),
+    last_payment TIMESTAMP NOT NULL,
+    total_paid DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    payment_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Keyset-пагинация по каждой из сортировок админки
+CREATE INDEX IF NOT EXISTS idx_client_summary_last_payment ON client_summary(last_payment, username);
+CREATE INDEX IF NOT EXISTS idx_client_summary_total_paid ON client_summary(total_paid, username);
+CREATE INDEX IF NOT EXISTS idx_client_summary_payment_count ON client_summary(payment_count, username);
+
+-- Начальное заполнение (то же, что client_summary.rebuild())
+INSERT INTO client_summary (username, email, last_payment, total_paid, payment_count, updated_at)
+SELECT username,
+       (ARRAY_AGG(email ORDER BY created_at DESC, id DESC))[1],
+       MAX(created_at),
+       COALESCE(SUM(amount) FILTER (WHERE status = 'succeeded'), 0),
+       COUNT(*) FILTER (WHERE status = 'succeeded'),
+       NOW()
+FROM payments
+GROUP BY username
+ON CONFLICT (username) DO NOTHING;
+
+COMMENT ON TABLE client_summary IS 'Одна строка на клиента: последний платёж, сумма и число успешных платежей';
@@ -0,0 +1,31 @@
+-- История потребления трафика: collector раз в N минут снимает счётчики всех пользователей Remnawave
+-- и прибавляет приращение к дневной строке пользователя; при чтении Remnawave не вызывается
+CREATE TABLE IF NOT EXISTS traffic_counters (
+    user_uuid VARCHAR(64) PRIMARY KEY,
+    username VARCHAR(255) NOT NULL,
+    lifetime_bytes BIGINT NOT NULL,
+    sampled_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS traffic_daily (
+    username VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    bytes BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, day)
+);
+
+-- Топ потребителей за период: диапазон по дню, затем GROUP BY username
+CREATE INDEX IF NOT EXISTS idx_traffic_daily_day ON traffic_daily(day, username) INCLUDE (bytes);
+
+CREATE TABLE IF NOT EXISTS traffic_sweeps (
+    id SERIAL PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP,
+    users_seen INTEGER NOT NULL DEFAULT 0,
+    users_changed INTEGER NOT NULL DEFAULT 0,
+    bytes_added BIGINT NOT NULL DEFAULT 0
+);
+
+COMMENT ON TABLE traffic_counters IS 'Последнее значение lifetimeUsedTrafficBytes по UUID пользователя Remnawave';
+COMMENT ON TABLE traffic_daily IS 'Потреблённый трафик по пользователю и дню (сумма приращений счётчика)';
+COMMENT ON TABLE traffic_sweeps IS 'Журнал проходов traffic-collector';
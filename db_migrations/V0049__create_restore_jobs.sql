@@ -0,0 +1,28 @@
+-- Задания восстановления пользователей в Remnawave: прогресс сохраняется после каждой пачки,
+-- прерванное по таймауту задание продолжается со следующего username
+CREATE TABLE IF NOT EXISTS restore_jobs (
+    id SERIAL PRIMARY KEY,
+    status VARCHAR(16) NOT NULL DEFAULT 'running',
+    custom_days INTEGER NOT NULL DEFAULT 0,
+    last_username VARCHAR(255),
+    total INTEGER NOT NULL DEFAULT 0,
+    restored INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_restore_jobs_running ON restore_jobs(id) WHERE status = 'running';
+
+CREATE TABLE IF NOT EXISTS restore_job_errors (
+    job_id INTEGER NOT NULL REFERENCES restore_jobs(id),
+    username VARCHAR(255) NOT NULL,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (job_id, username)
+);
+
+COMMENT ON TABLE restore_jobs IS 'Массовое восстановление пользователей в Remnawave (restore-users), last_username - контрольная точка';
+COMMENT ON TABLE restore_job_errors IS 'Пользователи, которых не удалось восстановить в задании';
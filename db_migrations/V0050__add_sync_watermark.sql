@@ -0,0 +1,9 @@
+-- Отметка для дельта-синхронизации sync-uuids: забираем только пользователей с updatedAt не раньше неё
+ALTER TABLE remnawave_sync_state ADD COLUMN IF NOT EXISTS watermark TIMESTAMP;
+ALTER TABLE remnawave_sync_state ADD COLUMN IF NOT EXISTS last_full_sync_at TIMESTAMP;
+
+-- Существующая запись пишется только полной синхронизацией
+UPDATE remnawave_sync_state SET last_full_sync_at = last_synced_at WHERE last_full_sync_at IS NULL;
+
+COMMENT ON COLUMN remnawave_sync_state.watermark IS 'Самый поздний updatedAt из Remnawave, который видела синхронизация (UTC)';
+COMMENT ON COLUMN remnawave_sync_state.last_full_sync_at IS 'Последний полный проход (с пометкой удалённых)';
@@ -0,0 +1,24 @@
+-- Сверка оплат с Remnawave (reconcile-users): отчёт о расхождениях и выполненных исправлениях
+CREATE TABLE IF NOT EXISTS reconcile_runs (
+    id SERIAL PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP,
+    panel_source VARCHAR(16) NOT NULL DEFAULT 'api',
+    repair BOOLEAN NOT NULL DEFAULT false,
+    paid_users INTEGER NOT NULL DEFAULT 0,
+    panel_users INTEGER NOT NULL DEFAULT 0,
+    counts JSONB NOT NULL DEFAULT '{}',
+    samples JSONB NOT NULL DEFAULT '{}',
+    repaired INTEGER NOT NULL DEFAULT 0,
+    repair_failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_reconcile_runs_started_at ON reconcile_runs(started_at DESC);
+
+-- Поток оплат по username в порядке COLLATE "C" для слияния со списком Remnawave
+CREATE INDEX IF NOT EXISTS idx_payments_succeeded_username_c
+    ON payments(username COLLATE "C", created_at, id) WHERE status = 'succeeded';
+
+COMMENT ON TABLE reconcile_runs IS 'Запуски сверки оплат с Remnawave: число расхождений по категориям и примеры';
+COMMENT ON COLUMN reconcile_runs.panel_source IS 'Откуда взят список пользователей: api - Remnawave, mirror - зеркало remnawave_users';
@@ -0,0 +1,6 @@
+-- Время дельта-синхронизации (и прерванного полного прохода) отдельно от last_synced_at:
+-- last_synced_at означает полный проход и делает свежими все строки зеркала
+ALTER TABLE remnawave_sync_state ADD COLUMN IF NOT EXISTS last_partial_sync_at TIMESTAMP;
+
+COMMENT ON COLUMN remnawave_sync_state.last_synced_at IS 'Последний полный проход: от него зеркало считается свежим';
+COMMENT ON COLUMN remnawave_sync_state.last_partial_sync_at IS 'Последняя дельта-синхронизация или прерванный полный проход';
@@ -0,0 +1,5 @@
+-- Проход traffic-collector не успевает за один вызов на большом парке: следующий вызов
+-- продолжает незавершённый проход с сохранённого смещения, а не начинает его заново
+ALTER TABLE traffic_sweeps ADD COLUMN IF NOT EXISTS next_start INTEGER NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN traffic_sweeps.next_start IS 'Смещение в /api/users, с которого продолжить незавершённый проход';
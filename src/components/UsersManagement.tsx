@@ -29,6 +29,7 @@ const UsersManagement = ({ adminPassword }: UsersManagementProps) => {
   const [deletingUser, setDeletingUser] = useState<string | null>(null);
   const [searchQuery, setSearchQuery] = useState('');
   const [selectedUsers, setSelectedUsers] = useState<string[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
 
   const loadUsers = async () => {
     setLoading(true);
@@ -46,6 +47,7 @@ const UsersManagement = ({ adminPassword }: UsersManagementProps) => {
 
       const data = await response.json();
       setUsers(data.users || []);
+      setNextCursor(data.next_cursor || null);
     } catch (error) {
       console.error('Load users error:', error);
       toast({
@@ -57,6 +59,36 @@ const UsersManagement = ({ adminPassword }: UsersManagementProps) => {
     setLoading(false);
   };
 
+  const loadMoreUsers = async () => {
+    if (!nextCursor) return;
+
+    setLoading(true);
+    try {
+      const response = await fetch(`${API_ENDPOINTS.ADMIN_USERS}?cursor=${encodeURIComponent(nextCursor)}`, {
+        method: 'GET',
+        headers: {
+          'X-Admin-Key': adminPassword
+        }
+      });
+
+      if (!response.ok) {
+        throw new Error('Failed to fetch users');
+      }
+
+      const data = await response.json();
+      setUsers(prev => [...prev, ...(data.users || [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch (error) {
+      console.error('Load more users error:', error);
+      toast({
+        title: '❌ Ошибка',
+        description: 'Не удалось загрузить пользователей',
+        variant: 'destructive'
+      });
+    }
+    setLoading(false);
+  };
+
   const handleDeleteUser = async (username: string) => {
     if (!confirm(`Вы уверены, что хотите удалить пользователя ${username}?\n\nЭто удалит пользователя из:\n- Базы данных\n- RemnaWave панели`)) {
       return;
@@ -512,6 +544,14 @@ const UsersManagement = ({ adminPassword }: UsersManagementProps) => {
               </TableBody>
             </Table>
           </div>
+          {nextCursor && (
+            <div className="flex justify-center mt-4">
+              <Button onClick={loadMoreUsers} disabled={loading} variant="outline">
+                <Icon name="ChevronDown" size={16} className="mr-2" />
+                Показать ещё
+              </Button>
+            </div>
+          )}
         </CardContent>
       </Card>
     </div>
@@ -1,5 +1,6 @@
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card";
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from "@/components/ui/table";
+import { Button } from "@/components/ui/button";
 
 export interface Client {
   username: string;
@@ -11,9 +12,12 @@ export interface Client {
 
 interface ClientsTabProps {
   clients: Client[];
+  loading?: boolean;
+  hasMore?: boolean;
+  onLoadMore?: () => void;
 }
 
-export const ClientsTab = ({ clients }: ClientsTabProps) => {
+export const ClientsTab = ({ clients, loading, hasMore, onLoadMore }: ClientsTabProps) => {
   return (
     <Card>
       <CardHeader>
@@ -45,6 +49,13 @@ export const ClientsTab = ({ clients }: ClientsTabProps) => {
             ))}
           </TableBody>
         </Table>
+        {hasMore && onLoadMore && (
+          <div className="flex justify-center mt-4">
+            <Button onClick={onLoadMore} disabled={loading} variant="outline">
+              Показать ещё
+            </Button>
+          </div>
+        )}
       </CardContent>
     </Card>
   );
@@ -5,12 +5,14 @@ import { Client } from "@/components/admin/ClientsTab";
 export const useClientsManagement = (API_URL: string, password: string) => {
   const [clients, setClients] = useState<Client[]>([]);
   const [loading, setLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const { toast } = useToast();
 
-  const loadClients = async () => {
+  const loadClients = async (cursor: string | null = null) => {
     setLoading(true);
     try {
-      const response = await fetch(`${API_URL}?action=clients`, {
+      const query = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`${API_URL}?action=clients${query}`, {
         headers: {
           'X-Admin-Password': password
         }
@@ -18,7 +20,9 @@ export const useClientsManagement = (API_URL: string, password: string) => {
       
       if (response.ok) {
         const data = await response.json();
-        setClients(data.clients || []);
+        const page = data.clients || [];
+        setClients(prev => cursor ? [...prev, ...page] : page);
+        setNextCursor(data.next_cursor || null);
       }
     } catch (error) {
       toast({
@@ -31,10 +35,18 @@ export const useClientsManagement = (API_URL: string, password: string) => {
     }
   };
 
+  const loadMoreClients = () => {
+    if (nextCursor) {
+      loadClients(nextCursor);
+    }
+  };
+
   return {
     clients,
     setClients,
     loading,
-    loadClients
+    loadClients,
+    hasMore: nextCursor !== null,
+    loadMoreClients
   };
 };
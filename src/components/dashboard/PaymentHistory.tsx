@@ -16,9 +16,12 @@ interface PaymentHistoryProps {
   payments: Payment[];
   showHistory: boolean;
   onToggleHistory: () => void;
+  hasMore?: boolean;
+  loadingMore?: boolean;
+  onLoadMore?: () => void;
 }
 
-export const PaymentHistory = ({ payments, showHistory, onToggleHistory }: PaymentHistoryProps) => {
+export const PaymentHistory = ({ payments, showHistory, onToggleHistory, hasMore, loadingMore, onLoadMore }: PaymentHistoryProps) => {
   const getPaymentStatusColor = (status: string) => {
     switch (status) {
       case 'succeeded': return 'bg-green-500';
@@ -98,6 +101,13 @@ export const PaymentHistory = ({ payments, showHistory, onToggleHistory }: Payme
               ))}
             </div>
           )}
+          {hasMore && onLoadMore && (
+            <div className="flex justify-center mt-4">
+              <Button onClick={onLoadMore} disabled={loadingMore} variant="outline">
+                Показать ещё
+              </Button>
+            </div>
+          )}
         </CardContent>
       )}
     </Card>
@@ -115,6 +115,8 @@ const Admin = () => {
           <ClientsTab
             clients={clientsManagement.clients}
             loading={clientsManagement.loading}
+            hasMore={clientsManagement.hasMore}
+            onLoadMore={clientsManagement.loadMoreClients}
           />
         )}
 
@@ -29,6 +29,7 @@ const AdminUsers = () => {
   const [deletingUser, setDeletingUser] = useState<string | null>(null);
   const [searchQuery, setSearchQuery] = useState('');
   const [selectedUsers, setSelectedUsers] = useState<string[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
 
   const handleLogin = async () => {
     if (!password) {
@@ -65,6 +66,7 @@ const AdminUsers = () => {
 
       const data = await response.json();
       setUsers(data.users || []);
+      setNextCursor(data.next_cursor || null);
       setIsAuthenticated(true);
       localStorage.setItem('admin_key', password);
       
@@ -108,6 +110,7 @@ const AdminUsers = () => {
 
       const data = await response.json();
       setUsers(data.users || []);
+      setNextCursor(data.next_cursor || null);
     } catch (error) {
       console.error('Load users error:', error);
       toast({
@@ -119,6 +122,37 @@ const AdminUsers = () => {
     setLoading(false);
   };
 
+  const loadMoreUsers = async () => {
+    const savedKey = localStorage.getItem('admin_key');
+    if (!savedKey || !nextCursor) return;
+
+    setLoading(true);
+    try {
+      const response = await fetch(`${API_ENDPOINTS.ADMIN_USERS}?cursor=${encodeURIComponent(nextCursor)}`, {
+        method: 'GET',
+        headers: {
+          'X-Admin-Key': savedKey
+        }
+      });
+
+      if (!response.ok) {
+        throw new Error('Failed to fetch users');
+      }
+
+      const data = await response.json();
+      setUsers(prev => [...prev, ...(data.users || [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch (error) {
+      console.error('Load more users error:', error);
+      toast({
+        title: '❌ Ошибка',
+        description: 'Не удалось загрузить пользователей',
+        variant: 'destructive'
+      });
+    }
+    setLoading(false);
+  };
+
   const handleDeleteUser = async (username: string) => {
     if (!confirm(`Вы уверены, что хотите удалить пользователя ${username}?\n\nЭто удалит пользователя из:\n- Базы данных\n- RemnaWave панели`)) {
       return;
@@ -457,6 +491,14 @@ const AdminUsers = () => {
                 </TableBody>
               </Table>
             </div>
+            {nextCursor && (
+              <div className="flex justify-center mt-4">
+                <Button onClick={loadMoreUsers} disabled={loading} variant="outline">
+                  <Icon name="ChevronDown" size={16} className="mr-2" />
+                  Показать ещё
+                </Button>
+              </div>
+            )}
           </CardContent>
         </Card>
       </div>
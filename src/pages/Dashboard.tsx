@@ -44,6 +44,8 @@ const Dashboard = () => {
   const [error, setError] = useState('');
   const [paymentLoading, setPaymentLoading] = useState(false);
   const [payments, setPayments] = useState<Payment[]>([]);
+  const [paymentsCursor, setPaymentsCursor] = useState<string | null>(null);
+  const [paymentsLoadingMore, setPaymentsLoadingMore] = useState(false);
   const [showHistory, setShowHistory] = useState(false);
   const [showPaymentMethodDialog, setShowPaymentMethodDialog] = useState(false);
   const [selectedPlan, setSelectedPlan] = useState<{ id: number; name: string; price: number; days: number } | null>(null);
@@ -98,6 +100,7 @@ const Dashboard = () => {
       });
       
       setPayments(data.payments || []);
+      setPaymentsCursor(data.next_cursor || null);
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Ошибка загрузки');
     } finally {
@@ -105,6 +108,27 @@ const Dashboard = () => {
     }
   };
 
+  // Следующая страница истории платежей: get-subscription отдаёт по 20 и next_cursor
+  const loadMorePayments = async () => {
+    if (!userData || !paymentsCursor) return;
+    try {
+      setPaymentsLoadingMore(true);
+      const response = await fetch(
+        `${API_ENDPOINTS.GET_SUBSCRIPTION}?username=${encodeURIComponent(userData.username)}&cursor=${encodeURIComponent(paymentsCursor)}`
+      );
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+      const data = await response.json();
+      setPayments(prev => [...prev, ...(data.payments || [])]);
+      setPaymentsCursor(data.next_cursor || null);
+    } catch (error) {
+      console.error('Failed to load more payments:', error);
+    } finally {
+      setPaymentsLoadingMore(false);
+    }
+  };
+
   const handleLogout = () => {
     localStorage.removeItem('vpn_username');
     navigate('/login');
@@ -252,6 +276,9 @@ const Dashboard = () => {
           payments={payments}
           showHistory={showHistory}
           onToggleHistory={() => setShowHistory(!showHistory)}
+          hasMore={paymentsCursor !== null}
+          loadingMore={paymentsLoadingMore}
+          onLoadMore={loadMorePayments}
         />
 
         <PaymentMethodDialog